@@ -0,0 +1,156 @@
+import os
+import time
+import yaml
+import logging
+import threading
+from typing import Optional, Callable
+
+"""
+A process wide cache of AI System config files. A config is read and parsed once and then served from memory.
+The file's modification time is checked at most every DOMINO_CONFIG_REVALIDATE_S seconds (default 5), and a changed
+file is reloaded and its subscribers are notified, so config edits roll out without restarting the server. A file that
+can't be read raises on the first load, and afterwards the last good config is served with one warning per failure.
+"""
+
+ConfigCallback = Callable[[dict, dict], None]
+
+def _revalidate_s() -> float:
+    return float(os.getenv("DOMINO_CONFIG_REVALIDATE_S", "5"))
+
+def _load(path: str) -> dict:
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+class _CachedConfig:
+    def __init__(self, path: str):
+        self.path = path
+        self.config: Optional[dict] = None
+        self.version: Optional[tuple[int, int]] = None
+        self.error: Optional[str] = None
+        # the version of the file that couldn't be parsed, with the error
+        self.parse_error: Optional[tuple[tuple[int, int], str]] = None
+        self.checked_at = float("-inf")
+        self.subscribers: list[ConfigCallback] = []
+
+class AiSystemConfigCache:
+    """Caches parsed config files by path and reloads them when they change.
+
+    Args:
+        revalidate_s: the minimum time between checks of a file's modification time
+    """
+    def __init__(self, revalidate_s: float = 5.0):
+        self.revalidate_s = revalidate_s
+        self._lock = threading.Lock()
+        self._configs: dict[str, _CachedConfig] = {}
+        self._watcher: Optional[threading.Thread] = None
+
+    def get(self, path: str) -> dict:
+        """Returns the config in the file. The returned dictionary is shared, don't modify it"""
+        path = os.path.abspath(path)
+        cached = self._configs.get(path, None)
+        if cached is not None and cached.config is not None and time.monotonic() - cached.checked_at < self.revalidate_s:
+            return cached.config
+        return self._revalidate(path)
+
+    def subscribe(self, path: str, callback: ConfigCallback) -> Callable[[], None]:
+        """Calls callback(new_config, old_config) whenever the config file changes. Files with subscribers are checked
+        on a background thread, so changes are noticed even when nothing reads the config. Returns a function that
+        unsubscribes the callback.
+        """
+        path = os.path.abspath(path)
+        self._revalidate(path)
+        with self._lock:
+            self._configs[path].subscribers.append(callback)
+        self._start_watcher()
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._configs[path].subscribers:
+                    self._configs[path].subscribers.remove(callback)
+        return unsubscribe
+
+    def _revalidate(self, path: str) -> dict:
+        with self._lock:
+            cached = self._configs.setdefault(path, _CachedConfig(path))
+            if cached.config is not None and time.monotonic() - cached.checked_at < self.revalidate_s:
+                return cached.config
+            cached.checked_at = time.monotonic()
+
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                return self._failed(cached, f"Failed to read ai system config yaml {path}: {e}")
+
+            version = (stat.st_mtime_ns, stat.st_size)
+            if version == cached.version and cached.config is not None:
+                if cached.parse_error is not None and cached.parse_error[0] == version:
+                    return self._failed(cached, cached.parse_error[1])
+                self._recovered(cached)
+                return cached.config
+            is_reload = cached.config is not None
+            cached.version = version
+
+            try:
+                config = _load(path)
+            except Exception as e:
+                cached.parse_error = (version, f"Failed to read ai system config yaml {path}: {e}")
+                return self._failed(cached, cached.parse_error[1])
+
+            cached.parse_error = None
+            self._recovered(cached)
+            old_config, cached.config = cached.config, config
+            subscribers = list(cached.subscribers)
+
+        if is_reload:
+            logging.warning(f"Reloaded ai system config {path}")
+            for callback in subscribers:
+                try:
+                    callback(config, old_config)
+                except Exception as e:
+                    logging.warning(f"ai system config subscriber failed: {e}")
+        return config
+
+    def _failed(self, cached: _CachedConfig, error: str) -> dict:
+        if cached.config is None:
+            # there is no config to fall back to
+            raise Exception(error)
+        # keep serving the last good config until the file is fixed, and only warn when the failure changes
+        if error != cached.error:
+            logging.warning(f"{error}, serving the last config that could be read")
+        cached.error = error
+        return cached.config
+
+    def _recovered(self, cached: _CachedConfig):
+        if cached.error is not None:
+            logging.warning(f"ai system config yaml {cached.path} can be read again")
+        cached.error = None
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch, name="domino-config-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.revalidate_s)
+            with self._lock:
+                watched = [c.path for c in self._configs.values() if c.subscribers]
+            for path in watched:
+                self._revalidate(path)
+
+_cache: Optional[AiSystemConfigCache] = None
+_cache_lock = threading.Lock()
+
+def get_ai_system_config_cache() -> AiSystemConfigCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AiSystemConfigCache(revalidate_s=_revalidate_s())
+    return _cache
+
+def subscribe_ai_system_config(path: str, callback: ConfigCallback) -> Callable[[], None]:
+    """Calls callback(new_config, old_config) whenever the config file at path changes, see AiSystemConfigCache.subscribe"""
+    return get_ai_system_config_cache().subscribe(path, callback)
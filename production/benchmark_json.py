@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import argparse
+import dataclasses
+
+"""
+Compares the cost of tagging a trace with each of the JSON encoders in domino_json. Every call builds the tags that
+an evaluation writes, the metric and the size bounded sample, for a small and for a RAG sized record. Nothing is sent
+to the tracking server:
+
+    uv run production/benchmark_json.py
+    uv run production/benchmark_json.py --calls 5000
+"""
+
+@dataclasses.dataclass
+class RetrievedDocument:
+    source: str
+    score: float
+    text: str
+
+def build_records():
+    """Returns a small and a RAG sized record, with the numpy, pydantic and dataclass values that real outputs contain"""
+    import numpy as np
+    from langchain_core.messages import AIMessage, HumanMessage
+    from domino_eval_trace import DominoSpanRecord
+
+    small = DominoSpanRecord(
+        "rag_response",
+        "bench",
+        {"args": [[HumanMessage(content="What is Domino?")]], "kwargs": {}},
+        AIMessage(content="Domino is an enterprise AI platform."),
+    )
+    documents = [RetrievedDocument(f"doc-{i}", np.float32(0.9 - i / 100), "lorem ipsum " * 80) for i in range(20)]
+    rag = DominoSpanRecord(
+        "rag_response",
+        "bench",
+        {"args": ["What is Domino?", documents], "kwargs": {"n_results": np.int64(20)}},
+        AIMessage(content="Domino is an enterprise AI platform. " * 20, response_metadata={"scores": np.arange(20) / 20}),
+    )
+    return {"small": (small, np.float64(0.87)), "rag": (rag, np.float64(0.42))}
+
+def tag_once(record, metric):
+    from domino_eval_trace import DominoTagBatch, domino_log_evaluation_data
+
+    # the batch is never flushed, so only building the tags is measured
+    batch = DominoTagBatch(record.request_id)
+    domino_log_evaluation_data(record, metric, eval_result_label="score", batch=batch)
+    return batch
+
+def us_per_call(record, metric, calls: int) -> float:
+    for _ in range(min(calls, 100)):
+        tag_once(record, metric)
+    started = time.perf_counter()
+    for _ in range(calls):
+        tag_once(record, metric)
+    return (time.perf_counter() - started) / calls * 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare the per call tagging cost of the json encoders")
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    # oversize samples stay in memory instead of being written as artifacts
+    os.environ.setdefault("DOMINO_SAMPLE_ARTIFACTS_DISABLED", "true")
+
+    from domino_json import json_encoders, set_json_encoder
+
+    records = build_records()
+    results = {}
+    for encoder in json_encoders():
+        set_json_encoder(encoder)
+        results[encoder] = {name: us_per_call(record, metric, args.calls) for (name, (record, metric)) in records.items()}
+
+    print(f"{'encoder':<10}" + "".join(f"{name + ' [us/call]':>20}" for name in records))
+    for (encoder, timings) in results.items():
+        print(f"{encoder:<10}" + "".join(f"{t:>20.1f}" for t in timings.values()))
+    sys.exit(0)
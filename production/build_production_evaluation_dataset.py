@@ -1,81 +1,337 @@
 import os
+import csv
+import json
+import time
+import logging
 import mlflow
 from mlflow import MlflowClient
-import pandas as pd
+from typing import Optional, Any
 from datetime import datetime, timezone, timedelta
+from domino_eval_trace import iter_traces
 
 client = MlflowClient()
 
+DATASET_COLUMNS = ['name', 'inputs', 'outputs', 'evaluation_score']
+DATASET_FORMATS = ["parquet", "csv"]
+
 def _get_experiment_id(name: str) -> str:
     exps = mlflow.search_experiments(filter_string=f"name = '{name}'")
     if len(exps) == 0:
         raise Exception(f"{name} experiment not found. Run the dev server first.")
     return exps[0].experiment_id
 
-def build_dataset():
+def _has_pyarrow() -> bool:
+    try:
+        import pyarrow
+        return True
+    except ImportError:
+        return False
+
+def get_dataset_format() -> str:
+    """The format of the dataset files, set with DOMINO_EVAL_DATASET_FORMAT. pyarrow isn't one of the project's
+    dependencies, so the default is parquet only when it was installed separately and csv otherwise. Asking for
+    parquet without pyarrow is an error rather than a silent switch to csv
+    """
+    dataset_format = os.getenv("DOMINO_EVAL_DATASET_FORMAT", None)
+    if not dataset_format:
+        return "parquet" if _has_pyarrow() else "csv"
+    if dataset_format not in DATASET_FORMATS:
+        raise Exception(f"DOMINO_EVAL_DATASET_FORMAT must be one of {DATASET_FORMATS}, got {dataset_format}")
+    if dataset_format == "parquet" and not _has_pyarrow():
+        raise Exception("DOMINO_EVAL_DATASET_FORMAT is parquet but pyarrow is not installed. "
+                        "Run with `uv run --with pyarrow` or set DOMINO_EVAL_DATASET_FORMAT=csv")
+    return dataset_format
+
+def get_dataset_path() -> str:
+    """The directory that the evaluation dataset files are written to. Defaults to the Domino dataset
+    named by DOMINO_EVAL_DATASET_NAME.
+    """
+    # NOTE: recommended best practice of setting eval dataset name env var. User could just hardcode the
+    # dataset name in their script
+    evaluation_ds_name = os.getenv("DOMINO_EVAL_DATASET_NAME", None)
+
+    if not evaluation_ds_name:
+        raise Exception("Must set DOMINO_EVAL_DATASET_NAME in order to build the production eval dataset")
+
+    return os.getenv("DOMINO_EVAL_DATASET_PATH", f"/domino/datasets/local/{evaluation_ds_name}")
+
+def read_dataset_file(path: str):
+    import pandas as pd
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def _to_json(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    return json.dumps(value, default=str)
+
+def _to_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class EvaluationDatasetWriter:
+    """Streams evaluation dataset rows to a parquet or csv file. Rows are appended to column buffers,
+    which are written out as a row group every row_group_size rows, so memory stays bounded no matter how
+    many traces there are. The file is written under a temporary name and only appears at path when the writer
+    is closed.
+
+    Args:
+        path: the file to write, without an extension
+        file_format: "parquet" or "csv"
+        row_group_size: the number of rows to buffer before writing them out
+    """
+    def __init__(self, path: str, file_format: str = "parquet", row_group_size: int = 10000):
+        if file_format not in DATASET_FORMATS:
+            raise Exception(f"file_format must be one of {DATASET_FORMATS}, got {file_format}")
+
+        self.path = f"{path}.{file_format}"
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+
+        self._tmp_path = f"{self.path}.tmp"
+        self._columns: dict[str, list] = {c: [] for c in DATASET_COLUMNS}
+        self._buffered = 0
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, row: dict[str, Any]):
+        for c in DATASET_COLUMNS:
+            self._columns[c].append(row.get(c, None))
+        self._buffered += 1
+
+        if self._buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffered == 0:
+            return
+
+        if self.file_format == "parquet":
+            self._write_parquet_row_group()
+        else:
+            self._write_csv_rows()
+
+        self.rows_written += self._buffered
+        self._columns = {c: [] for c in DATASET_COLUMNS}
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        if self._writer is None:
+            # write an empty file with just the schema, so readers don't need to special case empty slices
+            self._open()
+        self._close_files()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._close_files()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def _open(self):
+        if self.file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self._schema = pa.schema([
+                ('name', pa.string()),
+                ('inputs', pa.string()),
+                ('outputs', pa.string()),
+                ('evaluation_score', pa.float64()),
+            ])
+            self._writer = pq.ParquetWriter(self._tmp_path, self._schema)
+        else:
+            self._file = open(self._tmp_path, 'w', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(DATASET_COLUMNS)
+
+    def _close_files(self):
+        if self.file_format == "parquet" and self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+    def _write_parquet_row_group(self):
+        import pyarrow as pa
+
+        if self._writer is None:
+            self._open()
+        table = pa.Table.from_pydict(self._columns, schema=self._schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+
+    def _write_csv_rows(self):
+        if self._writer is None:
+            self._open()
+        self._writer.writerows(zip(*[self._columns[c] for c in DATASET_COLUMNS]))
+
+CHECKPOINT_FILE_NAME = "_extraction_checkpoint.json"
+LOCK_FILE_NAME = "_extraction.lock"
+
+class ExtractionCheckpoint:
+    """Where the previous extraction stopped: the timestamp of the last extracted trace and the ids of
+    all extracted traces with that timestamp, so that a trace at the boundary is never extracted twice.
+    """
+    def __init__(self, last_timestamp_ms: int, boundary_trace_ids: list[str]):
+        self.last_timestamp_ms = last_timestamp_ms
+        self.boundary_trace_ids = boundary_trace_ids
+
+def read_checkpoint(dataset_path: str) -> Optional[ExtractionCheckpoint]:
+    path = os.path.join(dataset_path, CHECKPOINT_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        d = json.load(f)
+    return ExtractionCheckpoint(d["last_timestamp_ms"], d["boundary_trace_ids"])
+
+def write_checkpoint(dataset_path: str, checkpoint: ExtractionCheckpoint):
+    path = os.path.join(dataset_path, CHECKPOINT_FILE_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            "last_timestamp_ms": checkpoint.last_timestamp_ms,
+            "boundary_trace_ids": checkpoint.boundary_trace_ids,
+        }, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _acquire_extraction_lock(dataset_path: str, stale_after_s: int):
+    """Makes sure that overlapping runs of the job don't extract the same traces"""
+    path = os.path.join(dataset_path, LOCK_FILE_NAME)
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) > stale_after_s:
+        logging.warning(f"Removing stale extraction lock {path}")
+        os.remove(path)
+
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        raise Exception(f"Another extraction is running, remove {path} if that is not the case")
+    os.write(fd, str(os.getpid()).encode())
+    os.close(fd)
+
+def _release_extraction_lock(dataset_path: str):
+    os.remove(os.path.join(dataset_path, LOCK_FILE_NAME))
+
+def build_dataset(page_size: int = 500, row_group_size: int = 10000):
     """
     This function would be run in a scheduled job by the user.
-    builds an evaluation dataset csv
+    builds an evaluation dataset file
     from historical question and answers found in the
     "rag_response" trace
+
+    traces are read a page at a time and streamed to the dataset file, so memory use doesn't
+    grow with the number of traces
+
+    each run resumes from the checkpoint left by the previous run and writes the new traces to a new
+    partition named after the checkpoint it started from. The checkpoint only moves after the partition
+    is complete, so a failed run is retried from the same checkpoint and overwrites the same partition.
+    Traces younger than DOMINO_EVAL_EXTRACT_SETTLE_MS are left for the next run, because a trace is only
+    logged once it ends and it is stamped with its start time.
     """
     experiment_name = "all_knowing_rag_agent_analysis"
     experiment_id = _get_experiment_id(experiment_name)
-    yesterday = datetime.now(timezone.utc) - timedelta(days=1)
 
-    # NOTE: user could use the best practice of interpolating extraction start time timestamp or use their own
-    # timewindow (past day)
-    extraction_start_ts = datetime.fromisoformat(os.getenv("DOMINO_EVAL_EXTRACT_START_TS", str(yesterday))).timestamp() * 1000
-    print(extraction_start_ts)
+    dataset_path = get_dataset_path()
+    os.makedirs(dataset_path, exist_ok=True)
+    _acquire_extraction_lock(dataset_path, int(os.getenv("DOMINO_EVAL_EXTRACT_LOCK_TIMEOUT_S", str(60 * 60))))
+    try:
+        _extract_partition(experiment_id, dataset_path, page_size, row_group_size)
+    finally:
+        _release_extraction_lock(dataset_path)
 
-    # NOTE: recommended best practice of setting eval dataset name env var. User could just hardcode the
-    # dataset name in their script
-    evaluation_ds_name = os.getenv("DOMINO_EVAL_DATASET_NAME", None)
+def _extract_partition(experiment_id: str, dataset_path: str, page_size: int, row_group_size: int):
+    checkpoint = read_checkpoint(dataset_path)
+    if checkpoint is None:
+        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
 
-    if not evaluation_ds_name:
-        raise Exception("Must set DOMINO_EVAL_DATASET_NAME in order to build the production eval dataset")
+        # NOTE: user could use the best practice of interpolating extraction start time timestamp or use their own
+        # timewindow (past day). It is only used for the first run, later runs resume from the checkpoint
+        extraction_start_ts = int(datetime.fromisoformat(os.getenv("DOMINO_EVAL_EXTRACT_START_TS", str(yesterday))).timestamp() * 1000)
+        checkpoint = ExtractionCheckpoint(extraction_start_ts, [])
+    print(checkpoint.last_timestamp_ms)
 
-    completion_traces = mlflow.search_traces(
-        experiment_ids=[experiment_id],
-        filter_string=f"trace.name = 'rag_response' AND attributes.timestamp > {extraction_start_ts}",
-        #filter_string=f"trace.name = 'rag_response'",
-        return_type="list"
+    settle_ms = int(os.getenv("DOMINO_EVAL_EXTRACT_SETTLE_MS", str(5 * 60 * 1000)))
+    extraction_end_ts = int(time.time() * 1000) - settle_ms
+
+    completion_traces = iter_traces(
+        [experiment_id],
+        filter_string=(
+            f"trace.name = 'rag_response' AND attributes.timestamp >= {checkpoint.last_timestamp_ms}"
+            f" AND attributes.timestamp < {extraction_end_ts}"
+        ),
+        page_size=page_size,
+        order_by=["timestamp_ms ASC"],
     )
 
-    # create a datafrom for this slice of the traces and save as an additional file
-    # in the dataset
-    df = pd.DataFrame({
-        'name': [],
-        'inputs': [],
-        'outputs': [],
-        'evaluation_score': [], # we may add or overwrite in our evaluation post processing job
-    })
+    dataset_format = get_dataset_format()
+    if dataset_format == "csv" and not os.getenv("DOMINO_EVAL_DATASET_FORMAT", None):
+        print("writing the dataset as csv because pyarrow is not installed, run with `uv run --with pyarrow` for parquet")
 
-    for trace in completion_traces:
-        spans = trace.search_spans(name="rag_response")
-        if len(spans) == 0:
-            continue
+    # write this slice of the traces as an additional file in the dataset
+    started = time.time()
+    writer = EvaluationDatasetWriter(
+        os.path.join(dataset_path, str(checkpoint.last_timestamp_ms)),
+        file_format=dataset_format,
+        row_group_size=row_group_size,
+    )
+    previous_boundary_ids = set(checkpoint.boundary_trace_ids)
+    last_timestamp_ms = checkpoint.last_timestamp_ms
+    boundary_trace_ids = list(checkpoint.boundary_trace_ids)
+    rows = 0
+    try:
+        for trace in completion_traces:
+            trace_id = trace.info.trace_id
+            timestamp = trace.info.timestamp_ms
+            if timestamp == checkpoint.last_timestamp_ms and trace_id in previous_boundary_ids:
+                continue
 
-        span = spans[0]
-        row = pd.DataFrame([{
-            'name': span.name,
-            'inputs': span.inputs,
-            'outputs': span.outputs,
-            'evaluation_score': trace.info.tags.get('domino.evaluation_result.fullfilled', None),
-        }])
-        df = pd.concat([df, row], ignore_index=True)
+            if timestamp > last_timestamp_ms:
+                last_timestamp_ms = timestamp
+                boundary_trace_ids = []
+            boundary_trace_ids.append(trace_id)
 
+            spans = trace.search_spans(name="rag_response")
+            if len(spans) == 0:
+                continue
 
-    # TODO what if there are a lot of traces? How do we expect users to work with the datset files?
-    # do we expect them to load into a database?
+            span = spans[0]
+            writer.append({
+                'name': span.name,
+                'inputs': _to_json(span.inputs),
+                'outputs': _to_json(span.outputs),
+                'evaluation_score': _to_float(trace.info.tags.get('domino.evaluation_result.fullfilled', None)), # we may add or overwrite in our evaluation post processing job
+            })
+            rows += 1
+    except Exception:
+        writer.abort()
+        raise
 
-    save_csv_to_domino_dataset(str(extraction_start_ts), df)
+    if rows == 0:
+        writer.abort()
+        print("no new traces to extract")
+    else:
+        writer.close()
 
+    # the partition is complete, only now is it safe to move the checkpoint past it
+    write_checkpoint(dataset_path, ExtractionCheckpoint(last_timestamp_ms, boundary_trace_ids))
+    if rows == 0:
+        return
 
-def save_csv_to_domino_dataset(df_name: str, df: pd.DataFrame):
-    # TODO write to domino dataset scratch space
-    evaluation_ds_name = os.environ["DOMINO_EVAL_DATASET_NAME"]
-    print(df.head())
+    elapsed = time.time() - started
+    print(f"wrote {writer.rows_written} rows to {writer.path} in {elapsed:.1f}s ({writer.rows_written / max(elapsed, 1e-9):.1f} rows/s)")
 
 
 if __name__ == "__main__":
@@ -87,5 +343,12 @@ if __name__ == "__main__":
      DOMINO_EVAL_DATASET_NAME="myds" \
      DOMINO_EVAL_EXTRACT_START_TS=$(gdate -d "2 hours ago" "+%Y-%m-%d %H:%M:%S") \
      uv run production/build_production_evaluation_dataset.py
+
+    set DOMINO_EVAL_DATASET_PATH to write somewhere other than the Domino dataset and
+    DOMINO_EVAL_DATASET_FORMAT to choose between parquet and csv. pyarrow is not one of the project's
+    dependencies, so parquet needs `uv run --with pyarrow ...`. Without DOMINO_EVAL_DATASET_FORMAT the
+    dataset is written as parquet when pyarrow is installed and as csv, with a message, when it is not.
+    DOMINO_EVAL_EXTRACT_START_TS is only used by the first run, later runs resume from the checkpoint
+    that is saved in the dataset
     """
     build_dataset()
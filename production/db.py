@@ -1,4 +1,256 @@
-import chromadb
-chroma_client = chromadb.Client()
-collection = chroma_client.create_collection(name="my_collection")
-collection.add(documents=["this week I have to do DOM-1234", "the president in 20205 is trump"], ids=["domino1234", "whopres2025"])
+import os
+import sys
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Iterable, Union
+
+"""
+The knowledge base for the rag application. Documents live in a persistent chroma collection, so they are
+ingested once and shared by every worker instead of being re-added to an in memory copy on every start.
+
+Set DOMINO_VECTOR_STORE_HOST (and DOMINO_VECTOR_STORE_PORT) to use a chroma server, otherwise the collection
+is stored on disk in DOMINO_VECTOR_STORE_PATH. The client and collection are created on first use, so importing
+this module is cheap. Bulk load a directory of documents with:
+
+    uv run production/db.py --source-dir ./docs
+"""
+
+COLLECTION_NAME = os.getenv("DOMINO_VECTOR_STORE_COLLECTION", "my_collection")
+
+SEED_DOCUMENTS = {
+    "domino1234": "this week I have to do DOM-1234",
+    "whopres2025": "the president in 20205 is trump",
+}
+
+def _create_chroma_client():
+    import chromadb
+
+    host = os.getenv("DOMINO_VECTOR_STORE_HOST", None)
+    if host:
+        return chromadb.HttpClient(host=host, port=int(os.getenv("DOMINO_VECTOR_STORE_PORT", "8000")))
+    return chromadb.PersistentClient(path=os.getenv("DOMINO_VECTOR_STORE_PATH", "./domino_vector_store"))
+
+class VersionedCollection:
+    """Wraps a chroma collection and counts the writes made through it, so that caches of query results can
+    key on the version and never return results from before a write. Everything else is passed to the collection.
+    """
+    def __init__(self, collection):
+        self._collection = collection
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def _bump(self):
+        with self._lock:
+            self.version += 1
+
+    def add(self, *args, **kwargs):
+        try:
+            return self._collection.add(*args, **kwargs)
+        finally:
+            self._bump()
+
+    def upsert(self, *args, **kwargs):
+        try:
+            return self._collection.upsert(*args, **kwargs)
+        finally:
+            self._bump()
+
+    def update(self, *args, **kwargs):
+        try:
+            return self._collection.update(*args, **kwargs)
+        finally:
+            self._bump()
+
+    def delete(self, *args, **kwargs):
+        try:
+            return self._collection.delete(*args, **kwargs)
+        finally:
+            self._bump()
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+_embedding_function = None
+_chroma_client = None
+_collection: Optional[VersionedCollection] = None
+_collection_lock = threading.Lock()
+
+def get_embedding_function():
+    """Returns the embedding function of the collection"""
+    global _embedding_function
+    if _embedding_function is None:
+        with _collection_lock:
+            if _embedding_function is None:
+                from chromadb.utils import embedding_functions
+
+                _embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    return _embedding_function
+
+def get_chroma_client():
+    global _chroma_client
+    if _chroma_client is None:
+        with _collection_lock:
+            if _chroma_client is None:
+                _chroma_client = _create_chroma_client()
+    return _chroma_client
+
+def get_collection() -> VersionedCollection:
+    """Returns the knowledge base collection. It is created, and the seed documents are ingested, on first use"""
+    global _collection
+    if _collection is None:
+        embedding_function = get_embedding_function()
+        chroma_client = get_chroma_client()
+        with _collection_lock:
+            if _collection is not None:
+                return _collection
+            _collection = VersionedCollection(
+                chroma_client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
+            )
+        ingest_documents(SEED_DOCUMENTS)
+    return _collection
+
+class IngestionReport:
+    def __init__(self, documents: int, skipped: int, chunks: int, elapsed_s: float):
+        self.documents = documents
+        self.skipped = skipped
+        self.chunks = chunks
+        self.elapsed_s = elapsed_s
+        self.documents_per_s = documents / elapsed_s if elapsed_s > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"ingested {self.documents} documents in {self.elapsed_s:.1f}s ({self.documents_per_s:.2f} documents/s), "
+            f"{self.skipped} unchanged documents skipped, {self.chunks} chunks written"
+        )
+
+def _chunk_id(doc_id: str, i: int) -> str:
+    return f"{doc_id}:{i}"
+
+def _content_hash(text: str, chunk_size: int, chunk_overlap: int) -> str:
+    # the chunking settings are part of the hash, so changing them re-ingests every document
+    return hashlib.sha256(f"{chunk_size}:{chunk_overlap}:{text}".encode()).hexdigest()
+
+def _existing_documents(doc_ids: list[str]) -> dict[str, dict]:
+    """Returns the metadata of the first chunk of every document that is already in the collection"""
+    existing = get_collection().get(ids=[_chunk_id(d, 0) for d in doc_ids], include=["metadatas"])
+    return {m["source_id"]: m for m in existing["metadatas"] if m}
+
+def _upsert_chunks(pool: ThreadPoolExecutor, ids: list[str], chunks: list[str], metadatas: list[dict], batch_size: int):
+    batches = [(i, i + batch_size) for i in range(0, len(ids), batch_size)]
+    embedding_function = get_embedding_function()
+    embeddings = pool.map(lambda b: embedding_function(chunks[b[0]:b[1]]), batches)
+    for ((start, end), batch_embeddings) in zip(batches, embeddings):
+        get_collection().upsert(
+            ids=ids[start:end],
+            documents=chunks[start:end],
+            embeddings=batch_embeddings,
+            metadatas=metadatas[start:end],
+        )
+
+def ingest_documents(
+        documents: Union[dict[str, str], Iterable[tuple[str, str]]],
+        chunk_size: int = 1000,
+        chunk_overlap: int = 100,
+        batch_size: int = 256,
+        max_workers: int = 4,
+        documents_per_pass: int = 1000) -> IngestionReport:
+    """Splits documents into chunks, embeds them and upserts them into the collection. Documents whose content
+    hasn't changed since they were last ingested are skipped, and chunks left over from a longer previous version
+    of a document are deleted.
+
+    Args:
+        documents: a dictionary of document id to text, or an iterable of (document id, text) pairs
+
+        chunk_size: the maximum number of characters in a chunk
+
+        chunk_overlap: the number of characters that neighbouring chunks share
+
+        batch_size: the number of chunks embedded and upserted together
+
+        max_workers: the number of batches embedded in parallel
+
+        documents_per_pass: the number of documents that are checked for changes and ingested together.
+        Bounds memory use, so the documents can be a generator over a large corpus
+    """
+    if isinstance(documents, dict):
+        documents = documents.items()
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    batch_size = min(batch_size, get_chroma_client().get_max_batch_size())
+    ingested, skipped, chunk_count = 0, 0, 0
+    started = time.monotonic()
+
+    def ingest_pass(pass_documents: list[tuple[str, str]]):
+        nonlocal ingested, skipped, chunk_count
+
+        # a document that shows up more than once in a pass would upsert the same chunk ids twice, the last one wins
+        pass_documents = list(dict(pass_documents).items())
+        existing = _existing_documents([doc_id for (doc_id, _) in pass_documents])
+        ids, chunks, metadatas, stale_ids = [], [], [], []
+        for (doc_id, text) in pass_documents:
+            content_hash = _content_hash(text, chunk_size, chunk_overlap)
+            previous = existing.get(doc_id, None)
+            if previous and previous["content_hash"] == content_hash:
+                skipped += 1
+                continue
+
+            doc_chunks = splitter.split_text(text) or [text]
+            for (i, chunk) in enumerate(doc_chunks):
+                ids.append(_chunk_id(doc_id, i))
+                chunks.append(chunk)
+                metadatas.append({"source_id": doc_id, "content_hash": content_hash, "chunks": len(doc_chunks)})
+            if previous:
+                stale_ids.extend(_chunk_id(doc_id, i) for i in range(len(doc_chunks), previous["chunks"]))
+            ingested += 1
+
+        _upsert_chunks(pool, ids, chunks, metadatas, batch_size)
+        if stale_ids:
+            get_collection().delete(ids=stale_ids)
+        chunk_count += len(ids)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="domino-ingestion") as pool:
+        pass_documents = []
+        for document in documents:
+            pass_documents.append(document)
+            if len(pass_documents) == documents_per_pass:
+                ingest_pass(pass_documents)
+                pass_documents = []
+        if pass_documents:
+            ingest_pass(pass_documents)
+
+    return IngestionReport(ingested, skipped, chunk_count, time.monotonic() - started)
+
+def _read_source_dir(source_dir: str, extensions: tuple[str, ...]) -> Iterable[tuple[str, str]]:
+    for (root, _, files) in os.walk(source_dir):
+        for name in sorted(files):
+            if name.endswith(extensions):
+                path = os.path.join(root, name)
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    yield os.path.relpath(path, source_dir), f.read()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ingest a directory of documents into the knowledge base")
+    parser.add_argument("--source-dir", required=True)
+    parser.add_argument("--extensions", default=".txt,.md")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source_dir):
+        sys.exit(f"{args.source_dir} is not a directory")
+
+    report = ingest_documents(
+        _read_source_dir(args.source_dir, tuple(args.extensions.split(","))),
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        max_workers=args.workers,
+    )
+    print(report)
@@ -0,0 +1,238 @@
+import sys
+import time
+import inspect
+import logging
+import importlib
+import statistics
+import threading
+from typing import Any, Callable, Optional
+
+"""
+Autologging setup for init_domino_tracing. In "allow_list" mode only the listed frameworks are patched, instead of
+every integration that mlflow.autolog() knows about, and each framework can be given options:
+
+    init_domino_tracing(
+        "my_experiment",
+        ai_frameworks=["openai", "langchain"],
+        autolog_mode="allow_list",
+        autolog_options={"langchain": {"capture_inputs": False, "max_payload_chars": 2000}},
+    )
+
+capture_inputs, capture_outputs and max_payload_chars are applied by Domino to the spans the framework's autologging
+ends, any other option is passed to mlflow.<framework>.autolog. measure_autolog_overhead reports what each
+framework's autologging adds to a traced call, see profile_autolog.py.
+
+The capture options rely on two things mlflow doesn't promise to keep, both as of mlflow 3.2: the integration that
+ends a span is found by walking the caller's stack with sys._getframe, and a payload's exported size is read from the
+OpenTelemetry span behind span._span. If either is missing, the options that need it are skipped with a warning and
+the spans are exported unchanged, so tracing keeps working on other versions of mlflow and python.
+"""
+
+AUTOLOG_MODES = ["global", "allow_list"]
+
+CAPTURE_OPTIONS = ["capture_inputs", "capture_outputs", "max_payload_chars"]
+
+# spans are ended through these modules, whichever integration started them
+_MLFLOW_CORE_MODULES = ("mlflow.entities", "mlflow.tracing", "mlflow.tracking", "mlflow.utils")
+
+_capture_lock = threading.Lock()
+_capture_options: dict[str, dict[str, Any]] = {}
+_capture_prefixes: dict[str, str] = {}
+_processor_registered = False
+_warned_internals: set[str] = set()
+
+def _autolog_module(framework: str):
+    return importlib.import_module(f"mlflow.{framework}")
+
+def _split_options(framework: str, module, options: dict[str, Any]) -> tuple[dict[str, Any], dict[str, Any]]:
+    capture = {k: v for (k, v) in options.items() if k in CAPTURE_OPTIONS}
+    autolog_kwargs = {k: v for (k, v) in options.items() if k not in CAPTURE_OPTIONS}
+    if not autolog_kwargs:
+        return autolog_kwargs, capture
+
+    supported = inspect.signature(module.autolog).parameters
+    unsupported = [k for k in autolog_kwargs if k not in supported]
+    if unsupported:
+        raise Exception(f"mlflow.{framework}.autolog doesn't support the options {unsupported}")
+    return autolog_kwargs, capture
+
+def _warn_internals_once(what: str, e: Exception):
+    if what not in _warned_internals:
+        _warned_internals.add(what)
+        logging.warning(f"Skipping the Domino autolog capture options that need {what}, which were written for mlflow 3.2: {e}")
+
+def _ending_integration() -> Optional[str]:
+    """Returns the framework whose autologging is ending the current span, by finding the first caller
+    outside of mlflow's tracing core
+    """
+    try:
+        frame = sys._getframe(2)
+    except (AttributeError, ValueError) as e:
+        _warn_internals_once("the caller's stack", e)
+        return None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith(_MLFLOW_CORE_MODULES):
+            for (framework, prefix) in _capture_prefixes.items():
+                if module == prefix or module.startswith(prefix + "."):
+                    return framework
+            return None
+        frame = frame.f_back
+    return None
+
+def _truncate(payload: Optional[str], max_chars: int) -> Optional[str]:
+    if payload is None or len(payload) <= max_chars:
+        return None
+    return f"{payload[:max_chars]}... [truncated {len(payload) - max_chars} of {len(payload)} chars]"
+
+def _apply_capture_options(span):
+    """An mlflow span processor that drops or truncates the inputs and outputs of autologged spans"""
+    from mlflow.tracing.constant import SpanAttributeKey
+
+    framework = _ending_integration()
+    if framework is None:
+        return
+    options = _capture_options[framework]
+
+    max_chars = options.get("max_payload_chars", None)
+    attributes = {}
+    if max_chars is not None:
+        try:
+            # the raw attributes are the json that will be exported
+            attributes = span._span.attributes or {}
+        except AttributeError as e:
+            _warn_internals_once("the span's exported attributes", e)
+            max_chars = None
+    if not options.get("capture_inputs", True):
+        span.set_inputs(None)
+    elif max_chars is not None and (truncated := _truncate(attributes.get(SpanAttributeKey.INPUTS, None), max_chars)):
+        span.set_inputs(truncated)
+
+    if not options.get("capture_outputs", True):
+        span.set_outputs(None)
+    elif max_chars is not None and (truncated := _truncate(attributes.get(SpanAttributeKey.OUTPUTS, None), max_chars)):
+        span.set_outputs(truncated)
+
+def _set_capture_options(capture: dict[str, dict[str, Any]]):
+    global _capture_options, _capture_prefixes, _processor_registered
+    with _capture_lock:
+        _capture_options = capture
+        _capture_prefixes = {fw: f"mlflow.{fw}" for fw in capture}
+        if not capture or _processor_registered:
+            return
+
+        import mlflow.tracing
+        from mlflow.tracing.config import get_config
+
+        mlflow.tracing.configure(span_processors=[*get_config().span_processors, _apply_capture_options])
+        _processor_registered = True
+
+def enable_autolog(
+        frameworks: list[str],
+        mode: str = "global",
+        options: Optional[dict[str, dict[str, Any]]] = None):
+    """Turns on autologging.
+
+    Args:
+        frameworks: the ai frameworks to autolog, see https://mlflow.org/docs/latest/ml/tracking/autolog#supported-libraries
+
+        mode: "global" calls mlflow.autolog() for every supported library first, "allow_list" only patches frameworks
+
+        options: per framework options, keyed by framework. capture_inputs and capture_outputs turn off recording the
+        inputs or outputs of the framework's spans and max_payload_chars truncates them. Other options are passed to
+        mlflow.<framework>.autolog
+    """
+    if mode not in AUTOLOG_MODES:
+        raise Exception(f"autolog mode must be one of {AUTOLOG_MODES}, got {mode}")
+    options = options or {}
+    unknown = [fw for fw in options if fw not in frameworks]
+    if unknown:
+        raise Exception(f"autolog options were given for {unknown}, which are not in ai_frameworks")
+
+    import mlflow
+
+    if mode == "global":
+        mlflow.autolog()
+
+    modules = {}
+    for fw in frameworks:
+        try:
+            modules[fw] = _autolog_module(fw)
+        except Exception as e:
+            logging.warning(f"Failed to call mlflow autolog for {fw} ai framework: {e}")
+
+    # unknown options raise before any framework is patched
+    split = {fw: _split_options(fw, module, options.get(fw, {})) for (fw, module) in modules.items()}
+
+    capture = {}
+    for (fw, (autolog_kwargs, capture_options)) in split.items():
+        try:
+            modules[fw].autolog(**autolog_kwargs)
+        except Exception as e:
+            logging.warning(f"Failed to call mlflow autolog for {fw} ai framework: {e}")
+            continue
+        if capture_options:
+            capture[fw] = capture_options
+    _set_capture_options(capture)
+
+def measure_autolog_overhead(
+        func: Callable[[], Any],
+        frameworks: list[str],
+        calls: int = 100,
+        warmup: int = 10,
+        rounds: int = 3,
+        options: Optional[dict[str, dict[str, Any]]] = None) -> dict[str, dict[str, float]]:
+    """Measures the time each framework's autologging adds to a call of func, which should be a traced function
+    that uses the frameworks. func is timed with autologging off for all of the frameworks and then with it on for
+    one framework at a time, taking turns in every round, and the median of the rounds is reported. It leaves
+    autologging off for the frameworks, so run it in its own process, like profile_autolog.py does.
+
+    Args:
+        func: the function to time, it is called without arguments
+
+        frameworks: the ai frameworks to measure
+
+        calls: the number of timed calls per round
+
+        warmup: the number of untimed calls before each round
+
+        rounds: the number of times each configuration is timed
+
+        options: per framework autolog options, as in enable_autolog
+
+    Returns:
+        The mean milliseconds per call of the baseline and of every framework, with the overhead over the baseline
+    """
+    def ms_per_call() -> float:
+        for _ in range(warmup):
+            func()
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        return (time.perf_counter() - started) / calls * 1000
+
+    def disable_all():
+        for fw in frameworks:
+            _autolog_module(fw).autolog(disable=True)
+        _set_capture_options({})
+
+    # the configurations take turns in every round, so drift over the run affects all of them alike
+    samples: dict[str, list[float]] = {name: [] for name in ["baseline", *frameworks]}
+    for _ in range(rounds):
+        disable_all()
+        samples["baseline"].append(ms_per_call())
+        for fw in frameworks:
+            enable_autolog([fw], mode="allow_list", options={fw: (options or {}).get(fw, {})})
+            samples[fw].append(ms_per_call())
+            disable_all()
+
+    baseline = statistics.median(samples["baseline"])
+    report = {"baseline": {"ms_per_call": baseline}}
+    for fw in frameworks:
+        ms = statistics.median(samples[fw])
+        report[fw] = {
+            "ms_per_call": ms,
+            "overhead_ms": ms - baseline,
+            "overhead_pct": (ms - baseline) / baseline * 100 if baseline else 0.0,
+        }
+    return report
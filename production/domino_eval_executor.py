@@ -0,0 +1,194 @@
+import os
+import atexit
+import asyncio
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Optional, Callable, Any
+from domino_trace_spool import flush_trace_spool
+
+BACKPRESSURE_POLICIES = ["drop", "block", "sample"]
+
+class DominoEvaluationExecutor:
+    """Runs inline evaluations on background worker threads, so that a traced function can return its
+    result right away and have the evaluation tags attached to its trace later.
+
+    Args:
+        max_workers: the number of worker threads that run evaluations
+
+        max_queue_size: the maximum number of evaluations that can be waiting to run
+
+        backpressure: what to do when the queue is full. "drop" discards the new evaluation, "block" waits
+        for room in the queue and "sample" keeps accepting a sample_rate fraction of new evaluations once the queue
+        is half full and drops them when it is full.
+
+        sample_rate: the fraction of evaluations to keep under the "sample" backpressure policy
+    """
+    def __init__(
+            self,
+            max_workers: int = 2,
+            max_queue_size: int = 1000,
+            backpressure: str = "drop",
+            sample_rate: float = 0.5):
+
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise Exception(f"backpressure must be one of {BACKPRESSURE_POLICIES}, got {backpressure}")
+
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.backpressure = backpressure
+        self.sample_rate = sample_rate
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._workers: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "dropped": 0,
+        }
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> bool:
+        """Queues fn to run on a worker thread. Returns False if the evaluation was dropped because of backpressure."""
+        self._start_workers()
+
+        if self.backpressure == "sample" and self._queue.qsize() >= self.max_queue_size // 2:
+            if random.random() >= self.sample_rate:
+                return self._drop()
+
+        with self._lock:
+            self._pending += 1
+            self._stats["submitted"] += 1
+
+        try:
+            self._queue.put((fn, args, kwargs), block=self.backpressure == "block")
+        except queue.Full:
+            with self._lock:
+                self._pending -= 1
+                self._stats["submitted"] -= 1
+                self._idle.notify_all()
+            return self._drop()
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every queued evaluation has finished. Returns False if the timeout expired first."""
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Drains the queue and stops the worker threads."""
+        drained = self.flush(timeout)
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._queue.put(None)
+        return drained
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+        return stats
+
+    def _drop(self) -> bool:
+        with self._lock:
+            self._stats["dropped"] += 1
+        logging.warning("Dropped a Domino evaluation because the evaluation queue is full")
+        return False
+
+    def _start_workers(self):
+        if len(self._workers) == self.max_workers:
+            return
+
+        with self._lock:
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self._run,
+                    name=f"domino-evaluation-{len(self._workers)}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            fn, args, kwargs = job
+            status = "completed"
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                status = "failed"
+                logging.warning(f"Domino evaluation failed: {e}")
+
+            with self._lock:
+                self._stats[status] += 1
+                self._pending -= 1
+                if self._pending == 0:
+                    self._idle.notify_all()
+
+_executor: Optional[DominoEvaluationExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_evaluation_executor() -> DominoEvaluationExecutor:
+    """Returns the process wide evaluation executor. It is configured from the DOMINO_EVAL_WORKERS,
+    DOMINO_EVAL_QUEUE_SIZE, DOMINO_EVAL_BACKPRESSURE and DOMINO_EVAL_SAMPLE_RATE environment variables
+    unless configure_evaluation_executor was called first.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = DominoEvaluationExecutor(
+                    max_workers=int(os.getenv("DOMINO_EVAL_WORKERS", "2")),
+                    max_queue_size=int(os.getenv("DOMINO_EVAL_QUEUE_SIZE", "1000")),
+                    backpressure=os.getenv("DOMINO_EVAL_BACKPRESSURE", "drop"),
+                    sample_rate=float(os.getenv("DOMINO_EVAL_SAMPLE_RATE", "0.5")),
+                )
+    return _executor
+
+def configure_evaluation_executor(
+        max_workers: int = 2,
+        max_queue_size: int = 1000,
+        backpressure: str = "drop",
+        sample_rate: float = 0.5) -> DominoEvaluationExecutor:
+    """Replaces the process wide evaluation executor. Evaluations queued on the previous executor are drained first."""
+    global _executor
+    with _executor_lock:
+        previous = _executor
+        _executor = DominoEvaluationExecutor(max_workers, max_queue_size, backpressure, sample_rate)
+
+    if previous:
+        previous.shutdown()
+    return _executor
+
+def flush_domino_evaluations(timeout: Optional[float] = None) -> bool:
+    """Waits for all background evaluations to finish and their tags to be written. Call this before
+    the process exits, e.g. in a server shutdown hook or at the end of an evaluation script.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    if _executor is not None and not _executor.flush(timeout):
+        return False
+
+    # traces and their tags are exported from the spool, which sends a trace's writes in order. Traces are exported
+    # from mlflow's background queue instead when the spool is disabled, or init_domino_tracing wasn't called
+    if os.getenv("MLFLOW_ENABLE_ASYNC_TRACE_LOGGING", "false").lower() == "true":
+        import mlflow
+
+        mlflow.flush_trace_async_logging()
+    return flush_trace_spool(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+
+async def flush_domino_evaluations_async(timeout: Optional[float] = None) -> bool:
+    """flush_domino_evaluations for async code, it waits without blocking the event loop"""
+    return await asyncio.to_thread(flush_domino_evaluations, timeout)
+
+# the spool flushes itself at exit, after the evaluations have spooled their tags
+atexit.register(lambda: _executor is None or _executor.flush())
@@ -1,15 +1,100 @@
 import os
 from mlflow import MlflowClient
-from typing import Optional, Callable, Any
+from typing import Optional, Callable, Any, Iterator
 import mlflow
 import json
 import time
-import yaml
-import logging
+import inspect
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from mlflow.tracing.trace_manager import InMemoryTraceManager
+from mlflow.tracing import provider as mlflow_tracing_provider
+from mlflow.tracing.provider import set_span_in_context, detach_span_from_context
+from opentelemetry.sdk.trace.sampling import Decision, Sampler, SamplingResult
+from domino_eval_executor import get_evaluation_executor
+from ai_system_config import get_ai_system_config_cache
+from domino_trace_spool import after_trace_export, get_trace_spool, install_trace_exporter, track_trace_exports
+from domino_autolog import enable_autolog
+from domino_json import dumps as json_dumps
+from domino_payloads import bounded, offload_sample, sample_artifact_tag, span_payload_max_bytes, tag_sample_max_bytes
+from domino_sampling import DominoSamplingPolicy, SAMPLING_RATE_TAG, configure_sampling, get_sampling_policy, sampling_policy_from_env
 
 client = MlflowClient()
 
+_tag_write_stats_lock = threading.Lock()
+_tag_write_stats = {
+    "tags_set": 0,
+    "tags_written": 0,
+    "requests": 0,
+}
+
+def get_tag_write_stats() -> dict[str, int]:
+    """Returns counters for the Domino trace tag writes done by this process.
+
+    tags_set is the number of tags that were requested, which is also the number of tracking server
+    requests that would have been made by writing each tag individually. requests is the number of
+    requests that were actually made and requests_saved is the difference.
+    """
+    with _tag_write_stats_lock:
+        stats = dict(_tag_write_stats)
+    stats["requests_saved"] = stats["tags_set"] - stats["requests"]
+    return stats
+
+def _send_trace_tags(trace_id: str, tags: dict[str, str]):
+    spool = get_trace_spool()
+    if spool is not None:
+        spool.enqueue(trace_id, tags)
+        return
+
+    # the REST api only supports setting one trace tag per request
+    for (k, v) in tags.items():
+        client.set_trace_tag(trace_id, k, v)
+
+def _write_trace_tags(trace_id: str, tags: dict[str, str]) -> int:
+    """Writes tags to a trace and returns the number of tracking server requests it takes.
+    If the trace has not been exported yet, the tags are added to the in memory trace and
+    get sent along with it, which costs no extra requests. Otherwise they are spooled to local disk
+    and sent by the spool's background exporter, so the caller doesn't wait for the tracking server.
+    Tags for a trace that is being exported are written once the export has finished.
+    """
+    with InMemoryTraceManager.get_instance().get_trace(trace_id) as trace:
+        if trace:
+            trace.info.tags.update(tags)
+            return 0
+
+    after_trace_export(trace_id, functools.partial(_send_trace_tags, trace_id, tags))
+    return len(tags)
+
+class DominoTagBatch:
+    """Accumulates all of the Domino tags for a trace, so that they are written together when the span closes
+    instead of making one blocking tracking server request per tag. Setting the same tag twice only writes the last value.
+    """
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.tags: dict[str, str] = {}
+        self.tags_set = 0
+
+    def set_tag(self, key: str, value: str):
+        self.tags[key] = value
+        self.tags_set += 1
+
+    def flush(self):
+        if not self.tags:
+            return
+
+        tags, tags_set = self.tags, self.tags_set
+        self.tags, self.tags_set = {}, 0
+        requests = _write_trace_tags(self.trace_id, tags)
+
+        with _tag_write_stats_lock:
+            _tag_write_stats["tags_set"] += tags_set
+            _tag_write_stats["tags_written"] += len(tags)
+            _tag_write_stats["requests"] += requests
+
 def _do_evaluation(
         span,
         evaluator: Optional[Callable[[Any, Any], dict[str, Any]]] = None,
@@ -19,15 +104,95 @@ def _do_evaluation(
             return evaluator(span.inputs, span.outputs)
         return None
 
+# the trace of the innermost start_domino_trace or append_domino_span call
+_current_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("domino_current_trace_id", default=None)
+# whether the innermost start_domino_trace or append_domino_span call was sampled out
+_sampled_out: contextvars.ContextVar[bool] = contextvars.ContextVar("domino_sampled_out", default=False)
+
+class _SampledOutSampler(Sampler):
+    """Drops every span that is started inside a call that was sampled out, e.g. by autologging or in the call's tool
+    threads, and leaves the other spans to mlflow's sampler. mlflow turns a span that isn't sampled into a no-op span
+    """
+    def __init__(self, sampler: Sampler):
+        self.sampler = sampler
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        if _sampled_out.get():
+            return SamplingResult(Decision.DROP)
+        return self.sampler.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+
+    def get_description(self) -> str:
+        return f"DominoSampledOut{{{self.sampler.get_description()}}}"
+
+def _drop_sampled_out_spans():
+    # checked on every sampled out call, because mlflow replaces its tracer provider e.g. when the tracking uri changes
+    mlflow_tracing_provider._get_tracer(__name__)
+    tracer_provider = mlflow_tracing_provider._MLFLOW_TRACER_PROVIDER
+    sampler = getattr(tracer_provider, "sampler", None)
+    if sampler is not None and not isinstance(sampler, _SampledOutSampler):
+        tracer_provider.sampler = _SampledOutSampler(sampler)
+
+def set_domino_trace_tag(key: str, value: str):
+    """Tags the trace of the enclosing start_domino_trace or append_domino_span call from inside the traced
+    function. The trace hasn't been exported yet, so the tag is sent along with it and costs no extra requests.
+    Does nothing when called outside of a traced function.
+
+    Args:
+        key: the tag key
+        value: the tag value
+    """
+    trace_id = _current_trace_id.get()
+    if trace_id is None:
+        return
+
+    tags = DominoTagBatch(trace_id)
+    tags.set_tag(key, value)
+    tags.flush()
+
+class DominoSpanRecord:
+    """An in process copy of the parts of a span that evaluation and tagging use. The decorators
+    build it from the inputs and outputs they already have, so a finished trace never has to be
+    downloaded from the tracking server again.
+    """
+    def __init__(self, name: str, request_id: str, inputs: Any, outputs: Any):
+        self.name = name
+        self.request_id = request_id
+        self.inputs = inputs
+        self.outputs = outputs
+
+def _evaluate_and_tag(
+        span,
+        evaluator: Optional[Callable[[Any, Any], dict[str, Any]]] = None,
+        is_production: bool = False,
+        extract_input_field: Optional[str] = None,
+        extract_output_field: Optional[str] = None):
+    """Runs on an evaluation worker after the traced function has returned and tags the trace
+    with the evaluation results.
+    """
+    eval_result = _do_evaluation(span, evaluator, is_production)
+    if not eval_result:
+        return
+
+    tags = DominoTagBatch(span.request_id)
+    for (k, v) in eval_result.items():
+
+        # tag trace with the evaluation inputs, outputs, and result
+        # or maybe assessment?
+        domino_log_evaluation_data(
+            span,
+            eval_result_label=k,
+            eval_result=v,
+            extract_input_field=extract_input_field,
+            extract_output_field=extract_output_field,
+            batch=tags,
+        )
+    tags.flush()
+
 def read_ai_system_config(path: str = "./ai_system_config.yaml") -> dict:
-    params = {}
-    try:
-        with open(path, 'r') as f:
-            params = yaml.safe_load(f)
-    except Exception as e:
-        # TODO make this quiet in production
-        logging.warning("Failed to read ai system config yaml: ", e)
-    return params
+    """Returns the AI System config in the yaml file at path. It is parsed once and served from memory until
+    the file changes, see ai_system_config.AiSystemConfigCache. Don't modify the returned dictionary.
+    """
+    return get_ai_system_config_cache().get(path)
 
 def _add_domino_tags(
         span,
@@ -36,41 +201,54 @@ def _add_domino_tags(
         extract_output_field: Optional[str] = None,
         is_eval: bool = False,
         sample: Optional[Any] = None,
+        batch: Optional[DominoTagBatch] = None,
     ):
-    client.set_trace_tag(
-        span.request_id,
+    tags = batch or DominoTagBatch(span.request_id)
+    tags.set_tag(
         "domino.internal.aisystem.is_production",
-        json.dumps(is_prod)
+        json_dumps(is_prod)
     )
-    client.set_trace_tag(
-        span.request_id,
+    tags.set_tag(
         "domino.internal.is_eval",
-        json.dumps(is_eval)
+        json_dumps(is_eval)
     )
 
-    raw_sample = sample or [span.inputs, span.outputs]
+    if is_eval:
+        raw_sample = sample or [span.inputs, span.outputs]
 
-    # TODO I want to get rid of these
-    if not sample and extract_input_field:
-        raw_sample = [extract_subfield(span.inputs, extract_input_field), raw_sample[1]]
+        # TODO I want to get rid of these
+        if not sample and extract_input_field:
+            raw_sample = [extract_subfield(span.inputs, extract_input_field), raw_sample[1]]
 
-    if not sample and extract_output_field:
-        raw_sample = [raw_sample[0], extract_subfield(span.outputs, extract_output_field)]
+        if not sample and extract_output_field:
+            raw_sample = [raw_sample[0], extract_subfield(span.outputs, extract_output_field)]
 
-    if is_eval:
-        tag_sample = None
+        # tag values are limited to 5 kb https://mlflow.org/docs/latest/api_reference/rest-api.html#request-structure
+        max_bytes = tag_sample_max_bytes()
         if sample:
-            tag_sample = json.dumps(sample)
+            _, tag_sample, truncated = bounded(sample, max_bytes)
         else:
-            tag_sample = '|'.join([json.dumps(s) for s in raw_sample])
-
-        # TODO validate that sample is < 5 kb https://mlflow.org/docs/latest/api_reference/rest-api.html#request-structure
-        client.set_trace_tag(
-            span.request_id,
+            # the separator takes one of the bytes
+            parts = [bounded(s, (max_bytes - 1) // 2) for s in raw_sample]
+            tag_sample = '|'.join([text for (_, text, _) in parts])
+            truncated = any(t for (_, _, t) in parts)
+
+        # the full sample is only written once per trace and span, even when there are several evaluation results
+        artifact_tag = sample_artifact_tag(span.name)
+        if truncated and artifact_tag not in tags.tags:
+            full_sample = json_dumps(sample) if sample else '|'.join([json_dumps(s) for s in raw_sample])
+            artifact = offload_sample(span.request_id, span.name, full_sample)
+            if artifact:
+                tags.set_tag(artifact_tag, artifact)
+
+        tags.set_tag(
             f"domino.internal.{span.name}.sample",
             tag_sample
         )
 
+    if not batch:
+        tags.flush()
+
 
 def extract_subfield(field: dict[str, Any], extract_field: str):
     inputs = field
@@ -107,7 +285,10 @@ def init_domino_tracing(
         experiment_name: str,
         ai_frameworks: list[str] = list(),
         is_production: bool = False,
-        ai_system_config_path: str = "./ai_system_config.yaml"):
+        ai_system_config_path: str = "./ai_system_config.yaml",
+        sampling: Optional[DominoSamplingPolicy] = None,
+        autolog_mode: Optional[str] = None,
+        autolog_options: Optional[dict[str, dict[str, Any]]] = None):
     """Initialize code based Domino tracing for an AI System component.
     If in dev mode, it is expected that a run has been intialized. All traces will be linked to that run and a
     LoggedModel will be created, which represents the AI System component and will contain the configuration
@@ -121,18 +302,28 @@ def init_domino_tracing(
         ai_frameworks: the ai frameworks to initialize autologging for, see https://mlflow.org/docs/latest/ml/tracking/autolog#supported-libraries
         is_production: whether or not this component is running in production mode
         ai_system_config_path: the path to the ai system configuration file
+        sampling: the sampling policy in production mode, see domino_sampling.DominoSamplingPolicy. Defaults to
+        a policy built from the DOMINO_TRACE_SAMPLE_* environment variables. Every call is traced in dev mode
+        autolog_mode: "global" turns on autologging for every library mlflow supports and then for ai_frameworks,
+        "allow_list" only for ai_frameworks. Defaults to the DOMINO_AUTOLOG_MODE environment variable or "global"
+        autolog_options: per framework autolog options, e.g. {"langchain": {"capture_inputs": False}}, see domino_autolog.enable_autolog
     """
 
     # set production environment variable
     os.environ["DOMINO_EVALUATION_LOGGING_IS_PROD"] = json.dumps(is_production)
 
+    configure_sampling((sampling or sampling_policy_from_env()) if is_production else None)
+
+    # export traces through the local spool, which also starts sending the writes spooled by earlier processes.
+    # Without it, export them from mlflow's in memory queue instead of on the request path, unless the user chose otherwise.
+    # Either way, evaluation tags that are written while their trace is being exported wait for the export
+    spool = get_trace_spool()
+    if spool is None:
+        os.environ.setdefault("MLFLOW_ENABLE_ASYNC_TRACE_LOGGING", "true")
+    install_trace_exporter(spool)
+
     # initialize autologging
-    mlflow.autolog()
-    for fw in ai_frameworks:
-        try:
-            getattr(mlflow, fw).autolog()
-        except Exception as e:
-            logging.warning(f"Failed to call mlflow autolog for {fw} ai framework", e)
+    enable_autolog(ai_frameworks, autolog_mode or os.getenv("DOMINO_AUTOLOG_MODE", "global"), autolog_options)
 
     mlflow.set_experiment(experiment_name)
 
@@ -153,15 +344,234 @@ def init_domino_tracing(
             params=params
         )
 
+def _span_payload(value: Any) -> Any:
+    max_bytes = span_payload_max_bytes()
+    if max_bytes <= 0 or value is None:
+        return value
+    return bounded(value, max_bytes)[0]
+
+class _DominoSpan:
+    """The span that a call to a decorated function runs in. It is made the active span while the function runs,
+    so that spans created by autologging inside of the function are nested under it.
+    """
+    def __init__(
+            self,
+            name: str,
+            inputs: Any,
+            new_trace: bool,
+            evaluator: Optional[Callable[[Any, Any], dict[str, Any]]] = None,
+            extract_input_field: Optional[str] = None,
+            extract_output_field: Optional[str] = None):
+        self.name = name
+        self.inputs = inputs
+        self.evaluator = evaluator
+        self.extract_input_field = extract_input_field
+        self.extract_output_field = extract_output_field
+        self.is_production = _is_production()
+        self.started_ns = time.time_ns()
+        self.sampling = None
+        self.sampling_rate = 1.0
+        self.kept: Optional[bool] = None
+
+        parent = None if new_trace else mlflow.get_current_active_span()
+        self.ends_trace = parent is None
+        self.span = None
+        if parent:
+            self.span = client.start_span(name, trace_id=parent.trace_id, parent_id=parent.span_id)
+        elif not new_trace and _sampled_out.get():
+            # nested in a call that was sampled out, so there is no trace to append to
+            self.ends_trace = False
+            self.kept = False
+        else:
+            # for scripts that don't call init_domino_tracing, so that evaluation tags wait for the trace's export
+            track_trace_exports()
+            self.sampling = get_sampling_policy()
+            if self.sampling is not None:
+                self.sampling_rate = self.sampling.rate_for(name)
+            if self.sampling is None or self.sampling.sample(name):
+                # a new trace started inside of a call that was sampled out is sampled by itself
+                token = _sampled_out.set(False)
+                try:
+                    self.span = client.start_trace(name)
+                finally:
+                    _sampled_out.reset(token)
+
+    def activate(self) -> tuple:
+        if self.span is None:
+            # spans that autologging starts inside a sampled out call are dropped instead of becoming traces of their own
+            _drop_sampled_out_spans()
+            return (None, _current_trace_id.set(None), _sampled_out.set(True))
+        return (set_span_in_context(self.span), _current_trace_id.set(self.span.trace_id), _sampled_out.set(False))
+
+    def deactivate(self, tokens: tuple):
+        span_token, trace_id_token, sampled_out_token = tokens
+        _sampled_out.reset(sampled_out_token)
+        _current_trace_id.reset(trace_id_token)
+        if span_token is not None:
+            detach_span_from_context(span_token)
+
+    def _keep(self, error: Optional[BaseException]) -> bool:
+        """Applies the tail rules when the call ends. A call that matches one is always kept, so its
+        trace represents only itself and gets a sampling rate of 1
+        """
+        if self.kept is None:
+            duration_ms = (time.time_ns() - self.started_ns) / 1e6
+            if self.sampling is not None and self.sampling.keep(error is not None, duration_ms):
+                self.sampling_rate = 1.0
+                self.kept = True
+            else:
+                self.kept = self.span is not None
+        return self.kept
+
+    def end(self, result: Any = None, error: Optional[BaseException] = None, attributes: Optional[dict[str, Any]] = None):
+        if not self._keep(error):
+            return
+        if self.span is None:
+            # sampled out when it started but kept by a tail rule, the trace is created after the fact
+            # and doesn't have the spans that were started inside of the call
+            self.span = client.start_trace(self.name, start_time_ns=self.started_ns)
+
+        record = DominoSpanRecord(self.name, self.span.trace_id, self.inputs, result)
+
+        # the trace is tagged as not evaluated while it is still in memory, which costs no requests.
+        # The evaluation runs in the background and overwrites these tags when it finishes
+        tags = DominoTagBatch(self.span.trace_id)
+        if self.sampling is not None:
+            tags.set_tag(SAMPLING_RATE_TAG, json_dumps(self.sampling_rate))
+        _add_domino_tags(record, self.is_production, self.extract_input_field, self.extract_output_field, is_eval=False, batch=tags)
+        tags.flush()
+
+        # the payloads are serialized now that the call is known to be kept, and are cut to the
+        # span payload budget. The evaluation still gets the full inputs and outputs from the record
+        self.span.set_inputs(_span_payload(self.inputs))
+        outputs = _span_payload(result)
+
+        status = "OK"
+        if error is not None:
+            # GeneratorExit and CancelledError aren't Exceptions, they mean a stream was closed before it finished
+            self.span.record_exception(error if isinstance(error, Exception) else f"{type(error).__name__}: closed before it finished")
+            status = "ERROR"
+
+        if self.ends_trace:
+            client.end_trace(self.span.trace_id, outputs=outputs, attributes=attributes, status=status)
+        else:
+            client.end_span(self.span.trace_id, self.span.span_id, outputs=outputs, attributes=attributes, status=status)
+
+        if error is None and self.evaluator and not self.is_production:
+            get_evaluation_executor().submit(
+                _evaluate_and_tag,
+                record,
+                self.evaluator,
+                self.is_production,
+                self.extract_input_field,
+                self.extract_output_field,
+            )
+
+    async def end_async(self, result: Any = None, error: Optional[BaseException] = None, attributes: Optional[dict[str, Any]] = None):
+        if self.ends_trace and self._keep(error):
+            # exporting the trace is a blocking request to the tracking server, keep it off the event loop
+            await asyncio.to_thread(self.end, result, error, attributes)
+        else:
+            self.end(result, error, attributes)
+
+def _stream_attributes(started: float, first_item_at: Optional[float], items: int) -> dict[str, Any]:
+    finished = time.monotonic()
+    attributes: dict[str, Any] = {"domino.stream.items": items}
+    if first_item_at is not None:
+        attributes["domino.stream.time_to_first_item_ms"] = round((first_item_at - started) * 1000, 1)
+        if finished > first_item_at:
+            attributes["domino.stream.items_per_s"] = round(items / (finished - first_item_at), 2)
+    return attributes
+
+def _wrap_in_domino_span(
+        func,
+        start_span: Callable[[Any], _DominoSpan],
+        output_reducer: Optional[Callable[[list], Any]] = None):
+    """Wraps a function, coroutine function or async generator function so that each call runs in a new _DominoSpan"""
+
+    if inspect.isasyncgenfunction(func):
+
+        @functools.wraps(func)
+        async def async_generator_wrapper(*args, **kwargs):
+            span = start_span({ 'args': args, 'kwargs': kwargs })
+            generator = func(*args, **kwargs)
+            outputs = []
+            error = None
+            started = time.monotonic()
+            first_item_at = None
+            try:
+                while True:
+                    # the span is only active while the generator runs, not while the caller handles an item
+                    tokens = span.activate()
+                    try:
+                        item = await generator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        span.deactivate(tokens)
+                    if first_item_at is None:
+                        first_item_at = time.monotonic()
+                    outputs.append(item)
+                    yield item
+            except (Exception, GeneratorExit, asyncio.CancelledError) as e:
+                # a stream that the caller closed early, e.g. because the client disconnected, is not evaluated
+                error = e
+                raise
+            finally:
+                await generator.aclose()
+                await span.end_async(
+                    output_reducer(outputs) if output_reducer else outputs,
+                    error,
+                    _stream_attributes(started, first_item_at, len(outputs)),
+                )
+
+        return async_generator_wrapper
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            span = start_span({ 'args': args, 'kwargs': kwargs })
+            tokens = span.activate()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                span.deactivate(tokens)
+                await span.end_async(error=e)
+                raise
+            span.deactivate(tokens)
+            await span.end_async(result)
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        span = start_span({ 'args': args, 'kwargs': kwargs })
+        tokens = span.activate()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            span.deactivate(tokens)
+            span.end(error=e)
+            raise
+        span.deactivate(tokens)
+        span.end(result)
+        return result
+
+    return wrapper
+
 def start_domino_trace(
         name: str,
         evaluator: Optional[Callable[[Any, Any], dict[str, Any]]] = None,
         extract_input_field: Optional[str] = None,
-        extract_output_field: Optional[str] = None
+        extract_output_field: Optional[str] = None,
+        output_reducer: Optional[Callable[[list], Any]] = None,
     ):
     """A decorator that starts an mlflow trace for the function it decorates.
     It also enables the user to run an evaluation inline in the code is run in development mode on
-    the inputs and outputs of the wrapped function call.
+    the inputs and outputs of the wrapped function call. The evaluation runs on a background worker after
+    the function returns, see domino_eval_executor.flush_domino_evaluations.
     The user can provide input and output formatters for formatting what's on the trace
     and the evaluation result inputs, which can be used by client's to extract relevant data when
     analyzing a trace.
@@ -174,6 +584,12 @@ def start_domino_trace(
     def ask_chat_bot(user_input: str) -> dict:
         ...
 
+    async functions and async generators can be decorated too. Their trace is exported off of the event loop and
+    the trace stays the active span across awaits, so autologged spans are nested under it. The output of an async
+    generator is the list of the items it yielded, unless an output_reducer is provided. Its trace ends, and is evaluated,
+    when the generator is exhausted and records the time to the first item, the number of items and the items per
+    second as domino.stream.* attributes. A generator that is closed early is not evaluated.
+
     Args:
         name: the name of the trace to create
 
@@ -184,54 +600,31 @@ def start_domino_trace(
 
         extract_output_field: an optional dot separated string that specifies what subfield to access in the trace output
 
+        output_reducer: an optional function that combines the items yielded by an async generator into the trace output
+
     Returns:
         A decorator that wraps the function to be traced.
     """
-    def decorator(func):
-
-        def wrapper(*args, **kwargs):
-            is_production = _is_production()
-            inputs = { 'args': args, 'kwargs': kwargs }
+    def start_span(inputs) -> _DominoSpan:
+        return _DominoSpan(name, inputs, True, evaluator, extract_input_field, extract_output_field)
 
-            parent_trace = client.start_trace(name, inputs=inputs)
-            result = func(*args, **kwargs)
-            client.end_trace(parent_trace.trace_id, outputs=result)
-
-            # TODO error handling?
-            trace = client.get_trace(parent_trace.trace_id).data.spans[0]
-
-            eval_result = _do_evaluation(trace, evaluator, is_production)
-            if eval_result:
-                for (k, v) in eval_result.items():
-
-                    # tag trace with the evaluation inputs, outputs, and result
-                    # or maybe assessment?
-                    domino_log_evaluation_data(
-                        trace,
-                        eval_result_label=k,
-                        eval_result=v,
-                        extract_input_field=extract_input_field,
-                        extract_output_field=extract_output_field
-                    )
-            else:
-                _add_domino_tags(trace, is_production, extract_input_field, extract_output_field, is_eval=False)
-
-            return result
-
-        return wrapper
+    def decorator(func):
+        return _wrap_in_domino_span(func, start_span, output_reducer)
     return decorator
 
 def append_domino_span(
         name: str,
         evaluator: Optional[Callable[[Any, Any], dict[str, Any]]] = None,
         extract_input_field: Optional[str] = None,
-        extract_output_field: Optional[str] = None
+        extract_output_field: Optional[str] = None,
+        output_reducer: Optional[Callable[[list], Any]] = None,
     ):
     """A decorator that starts an mlflow span for the function it decorates. If there is an existing trace
     this span will be appended to it.
 
     It also enables the user to run an evaluation inline in the code is run in development mode on
-    the inputs and outputs of the wrapped function call.
+    the inputs and outputs of the wrapped function call. The evaluation runs on a background worker after
+    the function returns, see domino_eval_executor.flush_domino_evaluations.
     The user can provide input and output formatters for formatting what's on the trace
     and the evaluation result inputs, which can be used by client's to extract relevant data when
     analyzing a trace.
@@ -244,6 +637,8 @@ def append_domino_span(
     def ask_chat_bot(user_input: str) -> dict:
         ...
 
+    async functions and async generators are supported in the same way as in start_domino_trace.
+
     Args:
         name: the name of the trace to create
 
@@ -254,36 +649,16 @@ def append_domino_span(
 
         extract_output_field: an optional dot separated string that specifies what subfield to access in the trace output
 
+        output_reducer: an optional function that combines the items yielded by an async generator into the span output
+
     Returns:
         A decorator that wraps the function to be traced.
     """
+    def start_span(inputs) -> _DominoSpan:
+        return _DominoSpan(name, inputs, False, evaluator, extract_input_field, extract_output_field)
 
     def decorator(func):
-
-        def wrapper(*args, **kwargs):
-            is_production = _is_production()
-            with mlflow.start_span(name) as parent_span:
-                inputs = { 'args': args, 'kwargs': kwargs }
-                parent_span.set_inputs(inputs)
-                result = func(*args, **kwargs)
-                parent_span.set_outputs(result)
-
-                eval_result = _do_evaluation(parent_span, evaluator, is_production)
-
-                if eval_result:
-                    for (k, v) in eval_result.items():
-                        domino_log_evaluation_data(
-                            parent_span,
-                            eval_result=v,
-                            eval_result_label=k,
-                            extract_input_field=extract_input_field,
-                            extract_output_field=extract_output_field,
-                        )
-                else:
-                    _add_domino_tags(parent_span, is_production, extract_input_field, extract_output_field, is_eval=False)
-                return result
-
-        return wrapper
+        return _wrap_in_domino_span(func, start_span, output_reducer)
     return decorator
 
 def domino_log_evaluation_data(
@@ -293,6 +668,7 @@ def domino_log_evaluation_data(
         sample: Optional[Any] = None,
         extract_input_field: Optional[str] = None,
         extract_output_field: Optional[str] = None,
+        batch: Optional[DominoTagBatch] = None,
     ):
     """This logs evaluation data and metdata to a parent trace. This is used to log the evaluation of a span
     after it was created. This is useful for analyzing past performance of an AI System component.
@@ -304,28 +680,33 @@ def domino_log_evaluation_data(
         more powerful data analysis
 
         eval_result_label: an optional label for the evaluation result. This is used to identify the evaluation result
-        sample: An optional sample representing what was evaluated. It must be JSON serializable. The sample will default to the inputs and outputs of the span.
+        sample: An optional sample representing what was evaluated, see domino_json for the types it can contain. The sample will default to the inputs and outputs of the span.
         extract_input_field: an optional dot separated string that specifies what subfield to access in the trace input
         extract_output_field: an optional dot separated string that specifies what subfield to access in the trace output
+        batch: an optional DominoTagBatch to add the tags to. If provided, the caller is responsible for flushing it,
+        otherwise the tags are written before this returns
     """
 
     is_production = _is_production()
+    tags = batch or DominoTagBatch(span.request_id)
     # TODO can only do this if the span is status = 'OK' or 'ERROR'
-    if eval_result:
+    if eval_result is not None:
         label = eval_result_label or "evaluation_result"
 
-        client.set_trace_tag(
-            span.request_id,
+        tags.set_tag(
             f"domino.prog.metric.{label}",
-            json.dumps(eval_result),
+            json_dumps(eval_result),
         )
-    _add_domino_tags(span, is_production, extract_input_field, extract_output_field, is_eval=eval_result is not None, sample=sample)
+    _add_domino_tags(span, is_production, extract_input_field, extract_output_field, is_eval=eval_result is not None, sample=sample, batch=tags)
+
+    if not batch:
+        tags.flush()
 
 def log_summary_metric(evaluation_label: str, aggregation: Callable[[list], Any]):
     """Use this to log an aggregation metric for an evaluation at the end of a run or when
     doing analyziz in production
 
-    TODO add summary window
+    For time windowed summaries that are computed incrementally, see domino_summary_metrics.log_windowed_summary_metric
 
     Args:
         evaluation_label: The label of the evaluation result that you returned from your evaluator
@@ -372,25 +753,70 @@ class DominoEvaluation:
         self.trace_id = trace_id
         self.span_name = span_name
 
-"""
-helps user find spans that they want to evaluate in a post-hoc fashion
-By default returns spans in from the last day
-TODO add run_id?
-evaluation data is all on the trace, but the span could be a subset of the trace
-"""
-def find_spans(
-        experiment_id: str,
+def iter_traces(
+        experiment_ids: list[str],
+        filter_string: Optional[str] = None,
+        page_size: int = 100,
+        max_traces: Optional[int] = None,
+        order_by: Optional[list[str]] = None,
+        run_id: Optional[str] = None,
+        model_id: Optional[str] = None,
+    ) -> Iterator:
+    """Lazily yields the traces that match a search, following page tokens until the results run out or max_traces
+    is reached. The next page is fetched in the background while the caller works through the current one, so at most
+    two pages are held in memory.
+
+    Args:
+        experiment_ids: the experiments to search
+        filter_string: an optional mlflow trace search filter
+        page_size: the number of traces to request per page
+        max_traces: an optional hard cap on the number of traces to yield
+        order_by: optional order by clauses, e.g. ["timestamp_ms ASC"]
+        run_id: an optional run to scope the search to
+        model_id: an optional LoggedModel to scope the search to
+    """
+    def fetch(page_token: Optional[str], max_results: int):
+        return client.search_traces(
+            experiment_ids=experiment_ids,
+            filter_string=filter_string,
+            max_results=max_results,
+            order_by=order_by,
+            page_token=page_token,
+            run_id=run_id,
+            model_id=model_id,
+        )
+
+    def next_page_size(fetched: int) -> int:
+        if max_traces is None:
+            return page_size
+        return min(page_size, max_traces - fetched)
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="domino-trace-prefetch")
+    try:
+        fetched = 0
+        page_future = pool.submit(fetch, None, next_page_size(fetched)) if next_page_size(fetched) > 0 else None
+        while page_future:
+            page = page_future.result()
+            fetched += len(page)
+
+            page_future = None
+            if page.token and len(page) > 0 and next_page_size(fetched) > 0:
+                page_future = pool.submit(fetch, page.token, next_page_size(fetched))
+
+            yield from page
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _find_spans_filter_string(
         parent_trace_name: Optional[str] = None,
-        span_names: Optional[list[str]] = None,
         start_time_ms: Optional[int] = None,
         end_time_ms: Optional[int] = None,
         evaluations_only: bool = False,
-    ) -> list:
+    ) -> str:
     default_timestamp = int(time.time() * 1000)
     start_time = start_time_ms or (default_timestamp - (24*60*60*1000))
     end_time = end_time_ms or default_timestamp
 
-    limit = 100
     filter_string = f"status = 'OK' AND trace.timestamp > {start_time} AND trace.timestamp < {end_time}"
     if parent_trace_name:
         filter_string += f" AND trace.name = '{parent_trace_name}'"
@@ -398,20 +824,67 @@ def find_spans(
     if evaluations_only:
         filter_string += f" AND tags.domino.internal.is_eval = 'true'"
 
-    traces = mlflow.search_traces(
-        experiment_ids=[experiment_id],
-        filter_string=filter_string,
-        max_results=limit,
-        return_type="list",
-    )
+    return filter_string
 
+def _select_spans(trace, parent_trace_name: Optional[str] = None, span_names: Optional[list[str]] = None) -> list:
     all_span_names = span_names or [parent_trace_name] if parent_trace_name else []
     if len(all_span_names) > 0:
-        spans = []
-        for trace in traces:
-            opt_spans =  [trace.search_spans(name=name) for name in all_span_names]
-            spans.extend([item for sl in opt_spans for item in sl])
-        return spans
+        opt_spans =  [trace.search_spans(name=name) for name in all_span_names]
+        return [item for sl in opt_spans for item in sl]
     else:
         # get top span, which is the parent trace's span
-        return [t.data.spans[0] for t in traces]
+        return [trace.data.spans[0]]
+
+def iter_spans(
+        experiment_id: str,
+        parent_trace_name: Optional[str] = None,
+        span_names: Optional[list[str]] = None,
+        start_time_ms: Optional[int] = None,
+        end_time_ms: Optional[int] = None,
+        evaluations_only: bool = False,
+        page_size: int = 100,
+        max_traces: Optional[int] = None,
+    ) -> Iterator:
+    """The streaming version of find_spans. Spans are yielded lazily from every matching trace instead of only the
+    first 100, so a large time window can be scanned in constant memory.
+
+    Args:
+        experiment_id: the experiment to search
+        parent_trace_name: an optional name of the traces to search
+        span_names: optional names of the spans to return from each trace. Defaults to the parent trace's span
+        start_time_ms: the start of the search window, defaults to one day ago
+        end_time_ms: the end of the search window, defaults to now
+        evaluations_only: whether to only return spans from traces that have been evaluated
+        page_size: the number of traces to request per page
+        max_traces: an optional hard cap on the number of traces to read
+    """
+    filter_string = _find_spans_filter_string(parent_trace_name, start_time_ms, end_time_ms, evaluations_only)
+    for trace in iter_traces([experiment_id], filter_string, page_size=page_size, max_traces=max_traces):
+        yield from _select_spans(trace, parent_trace_name, span_names)
+
+"""
+helps user find spans that they want to evaluate in a post-hoc fashion
+By default returns spans in from the last day
+only the first 100 traces are read, use iter_spans to scan a larger window
+TODO add run_id?
+evaluation data is all on the trace, but the span could be a subset of the trace
+"""
+def find_spans(
+        experiment_id: str,
+        parent_trace_name: Optional[str] = None,
+        span_names: Optional[list[str]] = None,
+        start_time_ms: Optional[int] = None,
+        end_time_ms: Optional[int] = None,
+        evaluations_only: bool = False,
+    ) -> list:
+    limit = 100
+    return list(iter_spans(
+        experiment_id,
+        parent_trace_name=parent_trace_name,
+        span_names=span_names,
+        start_time_ms=start_time_ms,
+        end_time_ms=end_time_ms,
+        evaluations_only=evaluations_only,
+        page_size=limit,
+        max_traces=limit,
+    ))
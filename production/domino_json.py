@@ -0,0 +1,128 @@
+import os
+import json
+import math
+import datetime
+import dataclasses
+import threading
+from typing import Any, Callable, Optional
+
+"""
+The JSON encoder for the tags and samples Domino writes to traces. It uses orjson when it is installed and the standard
+library otherwise, and both understand numpy values, pydantic models (which includes LangChain messages) and dataclasses.
+Objects of other types are encoded as their str(). Both backends write compact JSON with the same values: float32 and
+float16 numbers are written as the shortest decimal of the float32, 0.9 rather than 0.8999999761581421, and NaN and
+infinities as null. Only the text of some floats differs, python writes 1.5e-07 where orjson writes 1.5e-7.
+
+The backend is chosen with the DOMINO_JSON_ENCODER environment variable: auto (default), orjson or stdlib, or with
+set_json_encoder. Other encoders can be added with register_json_encoder.
+"""
+
+def to_builtin(obj: Any) -> Any:
+    """Converts a value that JSON doesn't support to one that it does"""
+    # numpy is only checked for when a numpy value shows up, so it is never imported just for this
+    if type(obj).__module__ == "numpy":
+        dtype = getattr(obj, "dtype", None)
+        if dtype is not None and dtype.kind == "f" and dtype.itemsize < 8:
+            # tolist() widens to the float64 expansion, orjson writes the shortest decimal of the float32
+            narrow = obj.astype("float32")
+            return float(str(narrow)) if narrow.ndim == 0 else [to_builtin(v) for v in narrow]
+        return obj.tolist() if hasattr(obj, "tolist") else obj.item()
+    if hasattr(obj, "model_dump"):
+        # python mode, so that the encoder handles the fields pydantic can't, like numpy arrays
+        return obj.model_dump()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    return str(obj)
+
+def _finite(value: Any) -> Any:
+    """Replaces NaN and infinities, which JSON doesn't have, with None like orjson does"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _finite(v) for (k, v) in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    if value is None or isinstance(value, (str, int)):
+        return value
+    return _finite(to_builtin(value))
+
+def _stdlib_encoder() -> Callable[[Any], str]:
+    encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, allow_nan=False, default=to_builtin)
+
+    def encode(value: Any) -> str:
+        try:
+            return encoder.encode(value)
+        except ValueError as e:
+            if "Out of range float" not in str(e):
+                raise
+            # values are rarely NaN, so they are only looked for after the encoder found one
+            return encoder.encode(_finite(value))
+    return encode
+
+def _orjson_encoder() -> Callable[[Any], str]:
+    import orjson
+
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    fallback = _stdlib_encoder()
+
+    def encode(value: Any) -> str:
+        try:
+            return orjson.dumps(value, default=to_builtin, option=options).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # e.g. integers that don't fit in 64 bits
+            return fallback(value)
+    return encode
+
+_ENCODERS: dict[str, Callable[[], Callable[[Any], str]]] = {
+    "stdlib": _stdlib_encoder,
+    "orjson": _orjson_encoder,
+}
+
+_lock = threading.Lock()
+_encoder: Optional[Callable[[Any], str]] = None
+_encoder_name: Optional[str] = None
+
+def register_json_encoder(name: str, factory: Callable[[], Callable[[Any], str]]):
+    """Makes an encoder available to set_json_encoder. factory is called once and returns a function that encodes
+    a value to a JSON string. It should use to_builtin for the types it doesn't support itself
+    """
+    _ENCODERS[name] = factory
+
+def json_encoders() -> list[str]:
+    """Returns the names of the encoders whose dependencies are installed"""
+    available = []
+    for (name, factory) in _ENCODERS.items():
+        try:
+            factory()
+            available.append(name)
+        except ImportError:
+            pass
+    return available
+
+def set_json_encoder(name: str = "auto") -> str:
+    """Sets the encoder of the process. auto picks orjson when it is installed. Returns the name of the encoder"""
+    global _encoder, _encoder_name
+    if name == "auto":
+        name = "orjson" if "orjson" in json_encoders() else "stdlib"
+    if name not in _ENCODERS:
+        raise Exception(f"json encoder must be auto or one of {list(_ENCODERS.keys())}, got {name}")
+
+    encoder = _ENCODERS[name]()
+    with _lock:
+        _encoder, _encoder_name = encoder, name
+    return name
+
+def get_json_encoder() -> str:
+    if _encoder_name is None:
+        set_json_encoder(os.getenv("DOMINO_JSON_ENCODER", "auto"))
+    return _encoder_name
+
+def dumps(value: Any) -> str:
+    """Encodes a value to a compact JSON string with the encoder of the process"""
+    if _encoder is None:
+        get_json_encoder()
+    return _encoder(value)
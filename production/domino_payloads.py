@@ -0,0 +1,138 @@
+import os
+import gzip
+import base64
+import hashlib
+import logging
+import functools
+import tempfile
+from typing import Any, Optional
+from domino_json import dumps, to_builtin
+from domino_trace_spool import TRACE_ARTIFACT_KEY_PREFIX, after_trace_export, get_trace_spool, upload_trace_artifact
+
+"""
+Size aware serialization of the payloads Domino records on traces. Span inputs and outputs and evaluation samples are
+summarised to a byte budget: long strings are cut, long lists and dicts keep their first items and deeply nested values
+are replaced by a description. A sample that had to be cut is also written in full to a gzip compressed artifact next
+to the trace's data, and the trace is tagged with its path, see load_domino_sample. The artifact is written after the
+trace has been exported, through the trace write spool when there is one. Span payloads are summarised when
+the span ends, so calls that are sampled out never pay for it.
+
+Configured with environment variables:
+    DOMINO_TAG_SAMPLE_MAX_BYTES: the budget of a sample tag (default 4000, mlflow rejects tag values over 5 KB)
+    DOMINO_SPAN_PAYLOAD_MAX_BYTES: the budget of the inputs and of the outputs of a Domino span (default 65536),
+    0 records them in full
+    DOMINO_SAMPLE_ARTIFACTS_DISABLED: set to true to only keep the summarised sample
+"""
+
+SAMPLE_ARTIFACT_DIR = "domino_samples"
+
+def tag_sample_max_bytes() -> int:
+    return int(os.getenv("DOMINO_TAG_SAMPLE_MAX_BYTES", "4000"))
+
+def span_payload_max_bytes() -> int:
+    return int(os.getenv("DOMINO_SPAN_PAYLOAD_MAX_BYTES", str(64 * 1024)))
+
+def _summarize(value: Any, max_chars: int, max_items: int, depth: int) -> tuple[Any, bool]:
+    if isinstance(value, str):
+        if len(value) <= max_chars:
+            return value, False
+        return f"{value[:max_chars]}... [truncated {len(value) - max_chars} of {len(value)} chars]", True
+
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>", True
+
+    if isinstance(value, dict):
+        if depth == 0:
+            return f"<dict with {len(value)} keys>", True
+        summary, truncated = {}, len(value) > max_items
+        for (i, (k, v)) in enumerate(value.items()):
+            if i == max_items:
+                summary["..."] = f"{len(value) - max_items} more keys"
+                break
+            summary[k], t = _summarize(v, max_chars, max_items, depth - 1)
+            truncated = truncated or t
+        return summary, truncated
+
+    if isinstance(value, (list, tuple)):
+        if depth == 0:
+            return f"<list with {len(value)} items>", True
+        summary, truncated = [], len(value) > max_items
+        for v in value[:max_items]:
+            s, t = _summarize(v, max_chars, max_items, depth - 1)
+            summary.append(s)
+            truncated = truncated or t
+        if len(value) > max_items:
+            summary.append(f"... {len(value) - max_items} more items")
+        return summary, truncated
+
+    if value is None or isinstance(value, (bool, int, float)):
+        return value, False
+    # e.g. pydantic models and numpy arrays, which are summarised as the values they are encoded as
+    return _summarize(to_builtin(value), max_chars, max_items, depth)
+
+def bounded(value: Any, max_bytes: int, max_depth: int = 8) -> tuple[Any, str, bool]:
+    """Summarises a value so that its JSON is at most max_bytes long.
+
+    Returns:
+        the summarised value, its JSON and whether anything was cut
+    """
+    # leave room for the quotes and the truncation marker
+    max_chars, max_items = max(16, max_bytes - 64), 100
+    for _ in range(8):
+        summary, truncated = _summarize(value, max_chars, max_items, max_depth)
+        text = dumps(summary)
+        size = len(text.encode("utf-8"))
+        if size <= max_bytes:
+            return summary, text, truncated
+        # shrink in proportion to the overshoot, so one long string doesn't cost many passes
+        max_chars = max(16, int(max_chars * max_bytes / size * 0.9))
+        max_items = max(1, max_items // 2)
+
+    # still too big, e.g. because of many keys, so keep the beginning of the JSON
+    marker = "... [truncated]"
+    cut = text.encode("utf-8")[:max(0, max_bytes - len(marker) - 2)].decode("utf-8", errors="ignore") + marker
+    return cut, dumps(cut), True
+
+def sample_artifact_tag(span_name: str) -> str:
+    return f"domino.internal.{span_name}.sample_artifact"
+
+def _write_sample_artifact(trace_id: str, span_name: str, path: str, data: bytes):
+    try:
+        spool = get_trace_spool()
+        if spool is not None:
+            # sent after the trace's export, and retried until the tracking server accepts it
+            spool.enqueue(trace_id, {f"{TRACE_ARTIFACT_KEY_PREFIX}{path}": base64.b64encode(data).decode("ascii")})
+        else:
+            upload_trace_artifact(trace_id, path, data)
+    except Exception as e:
+        logging.warning(f"Failed to write the sample of {span_name} in trace {trace_id} to an artifact: {e}")
+
+def offload_sample(trace_id: str, span_name: str, sample: str) -> Optional[str]:
+    """Writes the full sample tag value to a gzip compressed artifact in the trace's artifact directory.
+    Returns its path relative to that directory, or None if sample artifacts are disabled. The path only depends on
+    the sample, so it is returned right away, and the artifact is written once the trace has been exported
+    """
+    if os.getenv("DOMINO_SAMPLE_ARTIFACTS_DISABLED", "false") == "true":
+        return None
+
+    data = gzip.compress(sample.encode("utf-8"))
+    path = f"{SAMPLE_ARTIFACT_DIR}/{span_name}.{hashlib.sha256(data).hexdigest()[:16]}.gz"
+    # the evaluation can finish while the trace is still on its way to the tracking server
+    after_trace_export(trace_id, functools.partial(_write_sample_artifact, trace_id, span_name, path, data))
+    return path
+
+def load_domino_sample(trace, span_name: str) -> Optional[str]:
+    """Returns the sample of a span that was evaluated in a trace, as the sample tag would be without a size limit.
+    It is read from the sample artifact when the sample tag had to be cut
+    """
+    artifact = trace.info.tags.get(sample_artifact_tag(span_name), None)
+    if artifact is None:
+        return trace.info.tags.get(f"domino.internal.{span_name}.sample", None)
+
+    from mlflow.tracing.utils.artifact_utils import get_artifact_uri_for_trace
+    from mlflow.store.artifact.artifact_repository_registry import get_artifact_repository
+
+    repo = get_artifact_repository(get_artifact_uri_for_trace(trace.info))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(repo.download_artifacts(artifact, tmp_dir), "rb") as f:
+            return gzip.decompress(f.read()).decode("utf-8")
@@ -0,0 +1,86 @@
+import os
+import random
+import threading
+from typing import Optional
+
+"""
+Head and tail sampling of the traces that start_domino_trace and append_domino_span create in production.
+A call is either traced or not when it starts (head sampling), and a call that wasn't traced can still be kept when it
+ends if it matches a tail rule, e.g. because it raised or was slow. Calls that are sampled out create no spans and
+write no tags. Every kept trace is tagged with domino.internal.sampling_rate, the probability that a call like it
+was kept, so that summaries can weight each trace by 1 / sampling_rate.
+"""
+
+SAMPLING_RATE_TAG = "domino.internal.sampling_rate"
+
+class DominoSamplingPolicy:
+    """Decides which calls get traced.
+
+    Args:
+        rate: the fraction of calls that are traced
+
+        rates: per trace name rates that override rate, e.g. {"rag_response": 0.1}
+
+        keep_errors: whether to always keep calls that raised an exception
+
+        keep_slower_than_ms: always keep calls that took longer than this many milliseconds
+    """
+    def __init__(
+            self,
+            rate: float = 1.0,
+            rates: Optional[dict[str, float]] = None,
+            keep_errors: bool = True,
+            keep_slower_than_ms: Optional[float] = None):
+        for r in [rate, *(rates or {}).values()]:
+            if not 0.0 <= r <= 1.0:
+                raise Exception(f"sampling rates must be between 0 and 1, got {r}")
+
+        self.rate = rate
+        self.rates = rates or {}
+        self.keep_errors = keep_errors
+        self.keep_slower_than_ms = keep_slower_than_ms
+
+    def rate_for(self, name: str) -> float:
+        return self.rates.get(name, self.rate)
+
+    def sample(self, name: str) -> bool:
+        """The head sampling decision for a call that starts a trace"""
+        rate = self.rate_for(name)
+        return rate >= 1.0 or random.random() < rate
+
+    def keep(self, error: bool, duration_ms: float) -> bool:
+        """Whether a finished call matches a tail rule. Calls that do are always kept"""
+        if error and self.keep_errors:
+            return True
+        return self.keep_slower_than_ms is not None and duration_ms > self.keep_slower_than_ms
+
+def _parse_rates(value: str) -> dict[str, float]:
+    rates = {}
+    for entry in filter(None, (e.strip() for e in value.split(","))):
+        name, rate = entry.rsplit("=", 1)
+        rates[name.strip()] = float(rate)
+    return rates
+
+def sampling_policy_from_env() -> DominoSamplingPolicy:
+    """Builds a policy from the DOMINO_TRACE_SAMPLE_RATE, DOMINO_TRACE_SAMPLE_RATES (e.g. "rag_response=0.1,ask=0.5"),
+    DOMINO_TRACE_KEEP_ERRORS and DOMINO_TRACE_KEEP_SLOWER_THAN_MS environment variables
+    """
+    slower_than = os.getenv("DOMINO_TRACE_KEEP_SLOWER_THAN_MS", None)
+    return DominoSamplingPolicy(
+        rate=float(os.getenv("DOMINO_TRACE_SAMPLE_RATE", "1.0")),
+        rates=_parse_rates(os.getenv("DOMINO_TRACE_SAMPLE_RATES", "")),
+        keep_errors=os.getenv("DOMINO_TRACE_KEEP_ERRORS", "true") == "true",
+        keep_slower_than_ms=float(slower_than) if slower_than else None,
+    )
+
+_policy: Optional[DominoSamplingPolicy] = None
+_policy_lock = threading.Lock()
+
+def configure_sampling(policy: Optional[DominoSamplingPolicy]):
+    """Sets the sampling policy of the process. None traces every call"""
+    global _policy
+    with _policy_lock:
+        _policy = policy
+
+def get_sampling_policy() -> Optional[DominoSamplingPolicy]:
+    return _policy
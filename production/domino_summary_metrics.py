@@ -0,0 +1,294 @@
+import os
+import json
+import math
+import time
+import mlflow
+from typing import Optional, Any
+from domino_eval_trace import iter_traces, _is_production, _get_prod_logged_model
+from domino_sampling import SAMPLING_RATE_TAG
+
+WINDOWS_MS = {
+    "hour": 60 * 60 * 1000,
+    "day": 24 * 60 * 60 * 1000,
+}
+
+DEFAULT_STATE_PATH = "./domino_summary_metric_state.json"
+
+class QuantileSketch:
+    """A small mergeable quantile sketch with logarithmic buckets, like DDSketch. Quantiles are accurate to within
+    relative_accuracy of the true value and the sketch can be saved as JSON, so that partial aggregates
+    can be combined across runs of a summary job. Values can be weighted, e.g. by 1 / sampling rate.
+    """
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive: dict[int, float] = {}
+        self.negative: dict[int, float] = {}
+        self.zeros = 0.0
+        self.count = 0.0
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value, self.gamma))
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, weight: float = 1.0):
+        self.count += weight
+        if value > 0:
+            i = self._index(value)
+            self.positive[i] = self.positive.get(i, 0) + weight
+        elif value < 0:
+            i = self._index(-value)
+            self.negative[i] = self.negative.get(i, 0) + weight
+        else:
+            self.zeros += weight
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for i in sorted(self.negative, reverse=True):
+            seen += self.negative[i]
+            if seen > rank:
+                return -self._value(i)
+
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+
+        for i in sorted(self.positive):
+            seen += self.positive[i]
+            if seen > rank:
+                return self._value(i)
+        return self._value(max(self.positive))
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "positive": self.positive,
+            "negative": self.negative,
+            "zeros": self.zeros,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "QuantileSketch":
+        sketch = cls(d["relative_accuracy"])
+        sketch.positive = {int(k): v for (k, v) in d["positive"].items()}
+        sketch.negative = {int(k): v for (k, v) in d["negative"].items()}
+        sketch.zeros = d["zeros"]
+        sketch.count = d["count"]
+        return sketch
+
+class BucketAggregate:
+    """The partial aggregates for the evaluation results in one time bucket. Each value is weighted by the number of
+    calls its trace stands for, so count and sum are estimates of the totals over all calls, including sampled out ones
+    """
+    def __init__(self):
+        self.count = 0.0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.sketch = QuantileSketch()
+
+    def add(self, value: float, weight: float = 1.0):
+        self.count += weight
+        self.sum += value * weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value, weight)
+
+    def value(self, aggregation: str) -> Optional[float]:
+        """Returns the value of an aggregation: count, sum, mean, min, max or a percentile like p50 or p95"""
+        if aggregation == "count":
+            return self.count
+        if aggregation == "sum":
+            return self.sum
+        if aggregation == "mean":
+            return self.sum / self.count if self.count else None
+        if aggregation == "min":
+            return self.min
+        if aggregation == "max":
+            return self.max
+        if aggregation.startswith("p"):
+            return self.sketch.quantile(float(aggregation[1:]) / 100)
+        raise Exception(f"Unsupported summary aggregation {aggregation}")
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "sketch": self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "BucketAggregate":
+        bucket = cls()
+        bucket.count = d["count"]
+        bucket.sum = d["sum"]
+        bucket.min = d["min"]
+        bucket.max = d["max"]
+        bucket.sketch = QuantileSketch.from_dict(d["sketch"])
+        return bucket
+
+def _read_state(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _write_state(path: str, state: dict):
+    # write to a temporary file first, so a crashed job never leaves a half written watermark behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def _parse_metric_value(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return None
+    if isinstance(parsed, (int, float)):
+        return float(parsed)
+    return None
+
+def _trace_weight(tags: dict[str, str]) -> float:
+    """The number of calls a trace stands for, 1 / the sampling rate it was kept with"""
+    rate = _parse_metric_value(tags.get(SAMPLING_RATE_TAG, None))
+    return 1.0 / rate if rate else 1.0
+
+def log_windowed_summary_metric(
+        evaluation_label: str,
+        window: str = "hour",
+        aggregations: list[str] = ["mean", "count"],
+        state_path: Optional[str] = None,
+        settle_ms: int = 5 * 60 * 1000,
+        late_ms: int = 60 * 60 * 1000,
+        page_size: int = 500,
+    ) -> dict[int, dict[str, Any]]:
+    """Logs time windowed summary metrics for an evaluation, e.g. the hourly mean of an evaluation score. This
+    is meant to be called from a scheduled job.
+
+    Each call reads the traces that were created since the previous call, and reads the traces of the last late_ms
+    before that again, because evaluation tags are written in the background and can arrive well after their trace,
+    e.g. when the tracking server was down. A watermark, the traces that were counted in the last late_ms and the
+    partial aggregates (count, sum, min, max and a quantile sketch) of the buckets that can still change are saved
+    in a JSON state file, and the buckets that received new evaluations are logged with their bucket start time as
+    the step, so dashboards get one point per bucket. Traces that were kept by sampling are weighted by 1 / their
+    domino.internal.sampling_rate tag, so count, sum, mean and percentiles estimate all calls.
+
+    Args:
+        evaluation_label: The label of the evaluation result that you returned from your evaluator
+
+        window: the bucket size, "hour" or "day"
+
+        aggregations: the aggregations to log per bucket: count, sum, mean, min, max or a percentile like p95
+
+        state_path: where to save the watermark and partial aggregates. Defaults to the
+        DOMINO_SUMMARY_METRIC_STATE_PATH environment variable or ./domino_summary_metric_state.json
+
+        settle_ms: how old a trace must be before it is included in a summary
+
+        late_ms: how long after a trace was created its evaluation tags are still counted. A trace whose tags
+        arrive later is left out of the summary
+
+        page_size: the number of traces to read per search request
+
+    Returns:
+        The logged aggregates of each updated bucket, keyed by bucket start time in milliseconds
+    """
+    if window not in WINDOWS_MS:
+        raise Exception(f"window must be one of {list(WINDOWS_MS.keys())}, got {window}")
+    window_ms = WINDOWS_MS[window]
+    path = state_path or os.getenv("DOMINO_SUMMARY_METRIC_STATE_PATH", DEFAULT_STATE_PATH)
+
+    tag = f"domino.prog.metric.{evaluation_label}"
+    is_production = _is_production()
+    if is_production:
+        # logs summary metrics to LoggedModel
+        model = _get_prod_logged_model()
+        scope = {"model_id": model.model_id}
+        experiment_id = model.experiment_id
+        state_key = f"model:{model.model_id}:{evaluation_label}:{window}"
+    else:
+        # logs summary metrics to the run
+        run = mlflow.active_run()
+        scope = {"run_id": run.info.run_id}
+        experiment_id = run.info.experiment_id
+        state_key = f"run:{run.info.run_id}:{evaluation_label}:{window}"
+
+    state = _read_state(path)
+    metric_state = state.get(state_key, {})
+    watermark = metric_state.get("watermark_ms", 0)
+    # the trace ids that were counted in the last late_ms, with their timestamps. State files written before
+    # late tags were re-read only have the traces at the watermark
+    counted = {t: watermark for t in metric_state.get("boundary_trace_ids", [])}
+    counted.update(metric_state.get("counted_trace_ids", {}))
+    buckets = {int(k): BucketAggregate.from_dict(v) for (k, v) in metric_state.get("buckets", {}).items()}
+
+    # every trace before the watermark was read already, the ones in the last late_ms are read again for late tags
+    start_ms = max(0, watermark - late_ms)
+    if "counted_trace_ids" not in metric_state:
+        # an older state file only has the traces at its watermark, the ones before it can't be read again
+        start_ms = watermark
+    end_ms = max(watermark, int(time.time() * 1000) - settle_ms)
+    filter_string = (
+        f"trace.timestamp >= {start_ms} AND trace.timestamp < {end_ms}"
+        " AND tags.domino.internal.is_eval = 'true'"
+    )
+
+    updated = set()
+    traces = iter_traces(
+        [experiment_id],
+        filter_string,
+        page_size=page_size,
+        order_by=["timestamp_ms ASC"],
+        **scope,
+    )
+    for trace in traces:
+        trace_id = trace.info.trace_id
+        timestamp = trace.info.timestamp_ms
+        if trace_id in counted:
+            continue
+
+        # a trace without this evaluation's tag yet is read again by the next call, until it is late_ms old
+        value = _parse_metric_value(trace.info.tags.get(tag, None))
+        if value is None:
+            continue
+        counted[trace_id] = timestamp
+
+        bucket_start = timestamp - timestamp % window_ms
+        buckets.setdefault(bucket_start, BucketAggregate()).add(value, _trace_weight(trace.info.tags))
+        updated.add(bucket_start)
+
+    logged = {}
+    for bucket_start in sorted(updated):
+        bucket = buckets[bucket_start]
+        values = {agg: bucket.value(agg) for agg in aggregations}
+        metrics = {
+            f"domino.summary.{evaluation_label}.{window}.{agg}": v
+            for (agg, v) in values.items() if v is not None
+        }
+        mlflow.log_metrics(metrics, step=bucket_start // 1000, timestamp=bucket_start, **scope)
+        logged[bucket_start] = values
+
+    # buckets that ended more than late_ms before the watermark can not receive new traces, so only those after are kept
+    watermark = end_ms
+    state[state_key] = {
+        "watermark_ms": watermark,
+        "counted_trace_ids": {t: ts for (t, ts) in counted.items() if ts >= watermark - late_ms},
+        "buckets": {
+            str(k): v.to_dict() for (k, v) in buckets.items() if k + window_ms > watermark - late_ms
+        },
+    }
+    _write_state(path, state)
+
+    return logged
@@ -0,0 +1,496 @@
+import os
+import time
+import base64
+import atexit
+import random
+import logging
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Optional, Callable, Any
+
+"""
+A write-ahead spool for trace writes: the export of finished traces, see install_trace_exporter, and the tag writes
+that can't be sent along with their trace, e.g. the evaluation tags that are written after the trace was exported.
+Writes are appended to a sqlite file on local disk and a background exporter sends them to the tracking server, so
+the caller never waits for the tracking server and writes survive it being down and the process restarting.
+
+A trace's tag writes are always sent after the trace itself. Writes to a trace that is being exported by this process
+wait for the export, see after_trace_export, and a tag write that fails because its trace is still waiting in the
+spool goes back in the queue behind it.
+"""
+
+# the key of a spooled write that exports a whole trace, its value is the trace's json
+TRACE_EXPORT_KEY = "domino.internal.spool.trace"
+# the key prefix of a spooled write that uploads a file to a trace's artifacts, the key ends with the file's path
+# in the artifact directory and its value is the base64 of the file's content
+TRACE_ARTIFACT_KEY_PREFIX = "domino.internal.spool.artifact:"
+
+def _export_trace(trace_json: str):
+    from mlflow.entities import Trace
+    from mlflow.tracing.client import TracingClient
+    from mlflow.tracing.utils import add_size_stats_to_trace_metadata
+
+    trace = Trace.from_json(trace_json)
+    add_size_stats_to_trace_metadata(trace)
+    client = TracingClient()
+    try:
+        trace_info = client.start_trace(trace.info)
+    except Exception:
+        # a retry after the upload failed, the trace was created by the earlier attempt
+        try:
+            trace_info = client.get_trace_info(trace.info.trace_id)
+        except Exception:
+            pass
+        else:
+            client._upload_trace_data(trace_info, trace.data)
+            return
+        raise
+    client._upload_trace_data(trace_info, trace.data)
+
+def upload_trace_artifact(trace_id: str, path: str, data: bytes):
+    """Writes data to a file in a trace's artifact directory, path is relative to the directory"""
+    from mlflow.tracing.client import TracingClient
+    from mlflow.tracing.utils.artifact_utils import get_artifact_uri_for_trace
+    from mlflow.store.artifact.artifact_repository_registry import get_artifact_repository
+
+    repo = get_artifact_repository(get_artifact_uri_for_trace(TracingClient().get_trace_info(trace_id)))
+    (artifact_dir, file_name) = os.path.split(path)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_path = os.path.join(tmp_dir, file_name)
+        with open(local_path, "wb") as f:
+            f.write(data)
+        repo.log_artifact(local_path, artifact_dir or None)
+
+def _write(trace_id: str, key: str, value: str):
+    if key == TRACE_EXPORT_KEY:
+        _export_trace(value)
+        return
+    if key.startswith(TRACE_ARTIFACT_KEY_PREFIX):
+        upload_trace_artifact(trace_id, key[len(TRACE_ARTIFACT_KEY_PREFIX):], base64.b64decode(value))
+        return
+
+    from mlflow import MlflowClient
+
+    MlflowClient().set_trace_tag(trace_id, key, value)
+
+class TraceWriteSpool:
+    """A durable queue of trace writes and the exporter that drains it. The exporter takes batches of writes,
+    sends the writes of different traces in parallel and the writes of one trace in the order they were spooled,
+    except that the export of a trace always goes first. A failed write is retried with exponential backoff, and
+    the trace's later writes wait for it. A trace's export never waits for its tag writes, and a tag write that
+    fails while its trace is still waiting to be exported is put back behind the export without using up an
+    attempt. Several processes can share a spool file, each write is leased to one exporter at a time.
+
+    Args:
+        path: the sqlite file to spool to
+
+        write: sends one write to the tracking server, it is called with the trace id, key and value. The default
+        sets a trace tag, exports the trace when the key is TRACE_EXPORT_KEY or uploads an artifact when the key
+        starts with TRACE_ARTIFACT_KEY_PREFIX
+
+        batch_size: the maximum number of writes the exporter takes at once
+
+        max_workers: the number of traces whose writes are sent at the same time
+
+        max_attempts: how many times a write is tried before it is dropped
+
+        base_backoff_s: the backoff after the first failure. It doubles on every failure and is jittered
+
+        max_backoff_s: the maximum backoff between attempts
+
+        lease_s: how long a write taken by an exporter is hidden from other exporters
+    """
+    def __init__(
+            self,
+            path: str,
+            write: Callable[[str, str, str], Any] = _write,
+            batch_size: int = 200,
+            max_workers: int = 4,
+            max_attempts: int = 20,
+            base_backoff_s: float = 0.5,
+            max_backoff_s: float = 60.0,
+            lease_s: float = 5 * 60):
+        self.path = path
+        self.write = write
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.lease_s = lease_s
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS trace_writes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                trace_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS trace_writes_trace ON trace_writes (trace_id, not_before)")
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="domino-trace-spool")
+        self._wake = threading.Event()
+        self._idle = threading.Condition()
+        self._stats = {
+            "spooled": 0,
+            "exported": 0,
+            "retries": 0,
+            "requeued": 0,
+            "dropped": 0,
+            "batches": 0,
+        }
+        self._exporter = threading.Thread(target=self._run, name="domino-trace-spool-exporter", daemon=True)
+        self._exporter.start()
+
+    def enqueue(self, trace_id: str, tags: dict[str, str]):
+        """Spools writes for a trace, a dictionary of tag to value. They are on disk when this returns"""
+        now = time.time()
+        rows = [(trace_id, k, v, now, now) for (k, v) in tags.items()]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO trace_writes (trace_id, key, value, enqueued_at, not_before) VALUES (?, ?, ?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._stats["spooled"] += len(rows)
+        self._wake.set()
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the exporter counters, the number of writes waiting in the spool and how long the oldest one has waited"""
+        with self._lock:
+            depth, oldest = self._conn.execute("SELECT COUNT(*), MIN(enqueued_at) FROM trace_writes").fetchone()
+            stats = dict(self._stats)
+        stats["depth"] = depth
+        stats["lag_s"] = time.time() - oldest if oldest is not None else 0.0
+        return stats
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until the spool is empty. Returns False if the timeout expired first"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self._wake.set()
+        with self._idle:
+            while self._depth() > 0:
+                remaining = deadline - time.monotonic() if deadline is not None else 1.0
+                if remaining <= 0:
+                    return False
+                self._idle.wait(min(remaining, 1.0))
+        return True
+
+    def _depth(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM trace_writes").fetchone()[0]
+
+    def _claim_batch(self) -> list[tuple]:
+        """Leases the next batch of writes. The tag writes of a trace with a write that is waiting for a retry or
+        leased by another exporter are skipped, so they are never sent out of order or before the trace is exported.
+        The export of a trace is never held back by its tag writes
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute("""
+                    SELECT seq, trace_id, key, value, attempts FROM trace_writes
+                    WHERE not_before <= ?
+                    AND (key = ? OR trace_id NOT IN (SELECT trace_id FROM trace_writes WHERE not_before > ?))
+                    ORDER BY seq LIMIT ?
+                """, (now, TRACE_EXPORT_KEY, now, self.batch_size)).fetchall()
+                self._conn.executemany(
+                    "UPDATE trace_writes SET not_before = ? WHERE seq = ?", [(now + self.lease_s, r[0]) for r in rows]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _export_trace(self, rows: list[tuple]) -> tuple[list[int], Optional[tuple], list[int]]:
+        """Sends one trace's writes in order. Returns the writes that were sent, the write that failed
+        and the writes after it that weren't tried
+        """
+        for (i, (seq, trace_id, key, value, attempts)) in enumerate(rows):
+            try:
+                self.write(trace_id, key, value)
+            except Exception as e:
+                if key == TRACE_EXPORT_KEY:
+                    what = "export trace"
+                elif key.startswith(TRACE_ARTIFACT_KEY_PREFIX):
+                    what = f"upload artifact {key[len(TRACE_ARTIFACT_KEY_PREFIX):]} to trace"
+                else:
+                    what = f"write tag {key} to trace"
+                logging.warning(f"Failed to {what} {trace_id}, attempt {attempts + 1}: {e}")
+                return [r[0] for r in rows[:i]], rows[i], [r[0] for r in rows[i + 1:]]
+        return [r[0] for r in rows], None, []
+
+    def _export_pending(self, trace_ids: list[str]) -> set[str]:
+        """Returns the traces whose export is still waiting in the spool"""
+        with self._lock:
+            return {r[0] for r in self._conn.execute(
+                f"SELECT DISTINCT trace_id FROM trace_writes WHERE key = ? AND trace_id IN ({','.join('?' * len(trace_ids))})",
+                [TRACE_EXPORT_KEY, *trace_ids],
+            )}
+
+    def _export_batch(self, rows: list[tuple]):
+        by_trace: dict[str, list[tuple]] = {}
+        for row in rows:
+            by_trace.setdefault(row[1], []).append(row)
+        for trace_rows in by_trace.values():
+            # a tag write can be spooled before the export of its trace, e.g. by an evaluation that finished while
+            # the trace was being exported. The export goes first, the sort keeps the order of the other writes
+            trace_rows.sort(key=lambda r: r[2] != TRACE_EXPORT_KEY)
+        try:
+            results = list(self._pool.map(self._export_trace, by_trace.values()))
+        except RuntimeError:
+            # the pool is shut down when the interpreter exits, before the spool's exit flush runs
+            results = [self._export_trace(trace_rows) for trace_rows in by_trace.values()]
+
+        # tag writes that failed, of traces that weren't exported by this batch
+        failed_tags = [f[1] for (_, f, _) in results if f is not None and by_trace[f[1]][0][2] != TRACE_EXPORT_KEY]
+        waiting_for_export = self._export_pending(failed_tags) if failed_tags else set()
+
+        now = time.time()
+        done, retry, release, dropped, requeued = [], [], [], 0, 0
+        for (sent, failed, untried) in results:
+            done.extend(sent)
+            if failed is None:
+                continue
+
+            seq, trace_id, key, _, attempts = failed
+            if key != TRACE_EXPORT_KEY and trace_id in waiting_for_export:
+                # the trace doesn't exist on the tracking server until its export, which is still in the spool, is sent.
+                # The write goes back in the queue, where it waits for the export instead of holding it back
+                release.extend((now, s) for s in [seq, *untried])
+                requeued += 1
+                continue
+            if attempts + 1 >= self.max_attempts:
+                logging.warning(f"Dropped a trace write after {attempts + 1} attempts")
+                done.append(seq)
+                dropped += 1
+                backoff = 0.0
+            else:
+                backoff = random.uniform(0.5, 1.0) * min(self.max_backoff_s, self.base_backoff_s * 2 ** attempts)
+                retry.append((now + backoff, seq))
+            # the trace's later writes wait for the failed one
+            release.extend((now + backoff, s) for s in untried)
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("DELETE FROM trace_writes WHERE seq = ?", [(s,) for s in done])
+                self._conn.executemany("UPDATE trace_writes SET not_before = ?, attempts = attempts + 1 WHERE seq = ?", retry)
+                self._conn.executemany("UPDATE trace_writes SET not_before = ? WHERE seq = ?", release)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._stats["exported"] += len(done) - dropped
+            self._stats["dropped"] += dropped
+            self._stats["retries"] += len(retry)
+            self._stats["requeued"] += requeued
+            self._stats["batches"] += 1
+
+    def _next_ready_in(self) -> float:
+        with self._lock:
+            next_at = self._conn.execute("SELECT MIN(not_before) FROM trace_writes").fetchone()[0]
+        return max(0.0, next_at - time.time()) if next_at is not None else 1.0
+
+    def _release(self, rows: list[tuple]):
+        # makes the writes of a batch that wasn't exported available again, instead of waiting for their lease
+        with self._lock:
+            self._conn.executemany("UPDATE trace_writes SET not_before = ? WHERE seq = ?", [(time.time(), r[0]) for r in rows])
+
+    def _run(self):
+        while True:
+            rows = []
+            try:
+                rows = self._claim_batch()
+                if rows:
+                    self._export_batch(rows)
+                    continue
+            except Exception as e:
+                logging.warning(f"Domino trace spool exporter failed: {e}")
+                try:
+                    self._release(rows)
+                except Exception:
+                    pass
+
+            with self._idle:
+                self._idle.notify_all()
+            self._wake.wait(timeout=min(self._next_ready_in(), 1.0))
+            self._wake.clear()
+
+_spool: Optional[TraceWriteSpool] = None
+_spool_lock = threading.Lock()
+
+def get_trace_spool() -> Optional[TraceWriteSpool]:
+    """Returns the process wide trace write spool, which also starts exporting writes left over from earlier processes.
+    It is configured with the DOMINO_TRACE_SPOOL_PATH, DOMINO_TRACE_SPOOL_BATCH_SIZE, DOMINO_TRACE_SPOOL_WORKERS and
+    DOMINO_TRACE_SPOOL_MAX_ATTEMPTS environment variables. Set DOMINO_TRACE_SPOOL_DISABLED=true to leave exporting
+    traces to mlflow and write tags to the tracking server synchronously instead.
+    """
+    global _spool
+    if os.getenv("DOMINO_TRACE_SPOOL_DISABLED", "false") == "true":
+        return None
+
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = TraceWriteSpool(
+                    os.getenv("DOMINO_TRACE_SPOOL_PATH", "./domino_trace_spool.sqlite"),
+                    batch_size=int(os.getenv("DOMINO_TRACE_SPOOL_BATCH_SIZE", "200")),
+                    max_workers=int(os.getenv("DOMINO_TRACE_SPOOL_WORKERS", "4")),
+                    max_attempts=int(os.getenv("DOMINO_TRACE_SPOOL_MAX_ATTEMPTS", "20")),
+                )
+    return _spool
+
+# the traces this process is exporting, with when the export started and the writes that wait for it to finish
+_exporting: "OrderedDict[str, tuple[float, list[Callable[[], Any]]]]" = OrderedDict()
+_exporting_lock = threading.Lock()
+# mlflow discards a trace e.g. when its export queue is full, the writes that waited for it are dropped after this long
+_EXPORT_WAIT_S = 10 * 60
+
+def _export_started(trace_id: str):
+    now = time.monotonic()
+    with _exporting_lock:
+        _exporting[trace_id] = (now, [])
+        stale = []
+        while _exporting:
+            (oldest, (started, _)) = next(iter(_exporting.items()))
+            if now - started < _EXPORT_WAIT_S:
+                break
+            stale.append((oldest, len(_exporting.pop(oldest)[1])))
+    for (stale_trace_id, writes) in stale:
+        logging.warning(f"Trace {stale_trace_id} wasn't exported within {_EXPORT_WAIT_S}s, dropped {writes} writes that waited for it")
+
+def _export_finished(trace_id: str):
+    with _exporting_lock:
+        _, waiting = _exporting.pop(trace_id, (None, []))
+    for write in waiting:
+        try:
+            write()
+        except Exception as e:
+            logging.warning(f"Failed to write to trace {trace_id} after it was exported: {e}")
+
+def after_trace_export(trace_id: str, write: Callable[[], Any]):
+    """Runs write once this process has finished exporting the trace, or right away if it isn't exporting it, so
+    that a write to a trace that was just taken out of memory doesn't reach the tracking server before the trace.
+    A write that waited is run by the exporter and its errors are logged
+    """
+    with _exporting_lock:
+        exporting = _exporting.get(trace_id, None)
+        if exporting is not None:
+            exporting[1].append(write)
+            return
+    write()
+
+# the spool that finished traces are exported through, None leaves exporting them to mlflow
+_export_spool: Optional[TraceWriteSpool] = None
+
+def _domino_span_exporter(tracking_uri: Optional[str]):
+    from mlflow.tracing.export.mlflow_v3 import MlflowV3SpanExporter
+    from mlflow.tracing.trace_manager import InMemoryTraceManager
+    from mlflow.tracing.utils import maybe_get_request_id
+
+    class DominoSpanExporter(MlflowV3SpanExporter):
+        """Exports finished traces by writing them to the spool, when there is one. Traces that link prompts, and
+        traces of mlflow.genai.evaluate, which reads them back right away, are exported by mlflow as before.
+        Writes to a trace that is being exported wait for it, see after_trace_export
+        """
+        def export(self, spans):
+            # the trace is marked before mlflow takes it out of memory, so a write never finds it in neither place
+            manager = InMemoryTraceManager.get_instance()
+            trace_ids = [manager.get_mlflow_trace_id_from_otel_id(s.context.trace_id) for s in spans if s._parent is None]
+            trace_ids = [t for t in trace_ids if t is not None]
+            for trace_id in trace_ids:
+                _export_started(trace_id)
+            try:
+                super().export(spans)
+            finally:
+                if not self._should_log_async():
+                    # already finished unless mlflow didn't find the trace
+                    for trace_id in trace_ids:
+                        _export_finished(trace_id)
+
+        def _should_log_async(self):
+            # spooling is a local disk write
+            return False if _export_spool is not None else super()._should_log_async()
+
+        def _log_trace(self, trace, prompts):
+            spool = _export_spool
+            try:
+                if spool is None or prompts or maybe_get_request_id(is_evaluate=True):
+                    super()._log_trace(trace, prompts)
+                    return
+                try:
+                    spool.enqueue(trace.info.trace_id, {TRACE_EXPORT_KEY: trace.to_json()})
+                except Exception as e:
+                    logging.warning(f"Failed to spool trace {trace.info.trace_id}, exporting it directly: {e}")
+                    super()._log_trace(trace, prompts)
+            finally:
+                _export_finished(trace.info.trace_id)
+
+    return DominoSpanExporter(tracking_uri=tracking_uri)
+
+_exporter_installed = False
+
+def track_trace_exports():
+    """Makes mlflow export finished traces with the Domino exporter, which lets writes to a trace wait for the trace's
+    export, see after_trace_export. Applies to the current tracer provider and to the ones mlflow creates later, e.g.
+    after mlflow.set_tracking_uri. Cheap after the first call
+    """
+    global _exporter_installed
+    if _exporter_installed:
+        return
+    import mlflow.tracing.provider as provider
+
+    with _spool_lock:
+        if _exporter_installed:
+            return
+        # mlflow has no option for its exporter, so wrap the factory of its span processor
+        create_processor = provider._get_mlflow_span_processor
+
+        def get_mlflow_span_processor(tracking_uri: str):
+            processor = create_processor(tracking_uri)
+            processor.span_exporter = _domino_span_exporter(tracking_uri)
+            return processor
+
+        provider._get_mlflow_span_processor = get_mlflow_span_processor
+        _exporter_installed = True
+
+    if provider._MLFLOW_TRACER_PROVIDER_INITIALIZED.done:
+        processors = getattr(getattr(provider._MLFLOW_TRACER_PROVIDER, "_active_span_processor", None), "_span_processors", ())
+        for processor in processors:
+            if type(processor.span_exporter).__name__ == "MlflowV3SpanExporter":
+                processor.span_exporter = _domino_span_exporter(processor.span_exporter._client.tracking_uri)
+
+def install_trace_exporter(spool: Optional[TraceWriteSpool]):
+    """Makes mlflow export finished traces through the spool, so that traces survive the tracking server being down
+    and the process restarting, like spooled tags. Without a spool, mlflow exports them, but writes to a trace
+    still wait for its export
+    """
+    global _export_spool
+    _export_spool = spool
+    track_trace_exports()
+
+def flush_trace_spool(timeout: Optional[float] = None) -> bool:
+    """Waits until every spooled trace write has been sent. Returns False if the timeout expired first"""
+    if _spool is None:
+        return True
+    return _spool.flush(timeout)
+
+# spooled writes survive a restart, so exit doesn't wait long for a slow tracking server
+atexit.register(lambda: flush_trace_spool(timeout=float(os.getenv("DOMINO_TRACE_SPOOL_EXIT_TIMEOUT_S", "10"))))
@@ -1,19 +1,25 @@
+import logging
 from openai import OpenAI
 import mlflow
 from domino.aisystems.logging import DominoRun
 from util import answer_question_with_context
-from db import collection
+from db import ingest_documents
+from domino_eval_executor import flush_domino_evaluations
+from domino_autolog import enable_autolog
 
 """
 This is an example of how you would evaluate the performance of a rag application in dev
 """
 
-# add docs here in order to improve query context
-collection.add(documents=["this week I have to do DOM-1234"], ids=["domino1234"])
+# add docs here in order to improve query context, documents that are already in the knowledge base are skipped
+ingest_documents({"domino1234": "this week I have to do DOM-1234"})
 
 if __name__ == "__main__":
     mlflow.set_experiment("all_knowing_rag_agent_analysis")
 
+    # init_domino_tracing isn't called in this script, so turn on autologging here to get the openai spans
+    enable_autolog(["openai"], mode="allow_list")
+
     # example questions
     questions = [
         "What is the capital of France?",
@@ -26,3 +32,8 @@ if __name__ == "__main__":
         # evaluating the answer question with context function
         for question in questions:
             answer_question_with_context(question)
+
+        # evaluations run in the background, wait for them before the run ends. Tags that couldn't be sent in time,
+        # e.g. because the tracking server is down, stay in the spool and are sent the next time the spool runs
+        if not flush_domino_evaluations(timeout=120):
+            logging.warning("Not every evaluation tag was written, the rest are sent from the spool later")
@@ -4,6 +4,8 @@ from domino_eval_trace import *
 from util import answer_question_with_context
 import evaluators
 import pandas as pd
+from build_production_evaluation_dataset import get_dataset_path, read_dataset_file
+from evaluation_runner import EvaluationRunner
 
 """
 Runs the question_fulfillment evaluator
@@ -11,8 +13,11 @@ on the dataset built from production "rag_response" traces
 """
 
 def get_domino_dataset_file_names() -> list[str]:
-    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).timestamp() * 1000
-    return [str(yesterday)]
+    """the dataset files are named after the extraction start time in ms"""
+    return [
+        fn for fn in os.listdir(get_dataset_path())
+        if fn.endswith(".parquet") or fn.endswith(".csv")
+    ]
 
 if __name__ == "__main__":
     # required arguments
@@ -20,14 +25,34 @@ if __name__ == "__main__":
     yesterday = datetime.now(timezone.utc) - timedelta(days=2)
     evaluate_start_time_ts = datetime.fromisoformat(os.getenv("DOMINO_EVAL_START_TS", str(yesterday))).timestamp() * 1000
 
+    # NOTE: keep the budget under the judge model's rate limits
+    runner = EvaluationRunner(
+        lambda question, answer: evaluators.question_fullfillment_evaluator(question, answer)['fullfilled'],
+        max_concurrency=int(os.getenv("DOMINO_EVAL_CONCURRENCY", "8")),
+        requests_per_minute=float(os.getenv("DOMINO_EVAL_REQUESTS_PER_MINUTE", "500")),
+        tokens_per_minute=float(os.getenv("DOMINO_EVAL_TOKENS_PER_MINUTE", "200000")),
+    )
+
     # get dataset files with name that are >= evaluate_start_time_ts
+    failed_rows = 0
     for fn in get_domino_dataset_file_names():
-        if int(fn) >= evaluate_start_time_ts:
-            df = pd.read_csv(fn)
-            df['evaluation_score'] = df.apply(
-                lambda row: evaluators.question_fullfillment_evaluator(row['inputs'], row['outputs'])['fullfilled'],
-                axis=1
-            )
+        if int(fn.split('.')[0]) >= evaluate_start_time_ts:
+            path = os.path.join(get_dataset_path(), fn)
+            df = read_dataset_file(path)
+            scores, report = runner.run(list(zip(df['inputs'], df['outputs'])))
+            print(f"{fn}: {report}")
+
+            # the runner returns None for a row whose evaluation failed after all retries, it keeps the score it had
+            failed_rows += report.failed
+            if 'evaluation_score' in df.columns:
+                scores = [previous if score is None else score for (score, previous) in zip(scores, df['evaluation_score'])]
+            df['evaluation_score'] = scores
 
             # write back to dataset scratchspace
-            df.to_csv(fn, index=False)
+            if path.endswith(".parquet"):
+                df.to_parquet(path, index=False)
+            else:
+                df.to_csv(path, index=False)
+
+    if failed_rows:
+        print(f"the evaluation of {failed_rows} rows failed, they kept the score they had, if any")
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import functools
+from typing import Optional, Callable, Any
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for (k, v) in value.items()}
+    return value
+
+class EvaluationCache:
+    """A disk backed cache of LLM judge evaluation results. Entries are keyed by a hash of everything that
+    determines the judgement, so the same question and answer scored by the same judge model and prompt is
+    only sent to the judge once across dev runs, production re-evaluation jobs and retries.
+    The least recently used entries are evicted once the cache holds more than max_entries entries or max_bytes
+    of results.
+
+    Args:
+        path: the sqlite file to store the cache in
+        max_entries: the maximum number of cached evaluations
+        max_bytes: the maximum total size of the cached results
+    """
+    def __init__(self, path: str, max_entries: int = 100000, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS evaluations (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS evaluations_last_access ON evaluations (last_access)")
+        self._entries, self._bytes = self._totals()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Hashes the parts of an evaluation into a cache key. Parts must be JSON serializable or have a stable str().
+        Strings that hold JSON are hashed as the value they encode, so that the span inputs and outputs an inline
+        evaluator gets hash the same as the JSON encoded copies in the production evaluation dataset.
+        """
+        encoded = json.dumps([_normalize(p) for p in parts], sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM evaluations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["hits"] += 1
+            self._conn.execute("UPDATE evaluations SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        encoded = json.dumps(value)
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM evaluations WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO evaluations (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, encoded, len(encoded), time.time())
+            )
+            if previous:
+                self._bytes += len(encoded) - previous[0]
+            else:
+                self._entries += 1
+                self._bytes += len(encoded)
+
+            if self._entries > self.max_entries or self._bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._entries
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM evaluations")
+            self._entries, self._bytes = 0, 0
+
+    def _totals(self) -> tuple[int, int]:
+        entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM evaluations").fetchone()
+        return entries, size
+
+    def _evict(self):
+        # other processes may share the file, so start from the real totals
+        self._entries, self._bytes = self._totals()
+
+        # evict down to 90% of the limits, so that eviction doesn't run on every put
+        target_entries = int(self.max_entries * 0.9)
+        target_bytes = int(self.max_bytes * 0.9)
+        rows = self._conn.execute("SELECT key, size FROM evaluations ORDER BY last_access ASC")
+        evicted = []
+        for (key, size) in rows:
+            if self._entries <= target_entries and self._bytes <= target_bytes:
+                break
+            evicted.append((key,))
+            self._entries -= 1
+            self._bytes -= size
+
+        self._conn.executemany("DELETE FROM evaluations WHERE key = ?", evicted)
+        self._stats["evictions"] += len(evicted)
+
+_cache: Optional[EvaluationCache] = None
+_cache_lock = threading.Lock()
+
+def get_evaluation_cache() -> Optional[EvaluationCache]:
+    """Returns the process wide evaluation cache, configured with the DOMINO_EVAL_CACHE_PATH,
+    DOMINO_EVAL_CACHE_MAX_ENTRIES and DOMINO_EVAL_CACHE_MAX_MB environment variables.
+    Set DOMINO_EVAL_CACHE_DISABLED=true to turn caching off.
+    """
+    global _cache
+    if os.getenv("DOMINO_EVAL_CACHE_DISABLED", "false") == "true":
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EvaluationCache(
+                    os.getenv("DOMINO_EVAL_CACHE_PATH", "./domino_evaluation_cache.sqlite"),
+                    max_entries=int(os.getenv("DOMINO_EVAL_CACHE_MAX_ENTRIES", "100000")),
+                    max_bytes=int(os.getenv("DOMINO_EVAL_CACHE_MAX_MB", "256")) * 1024 * 1024,
+                )
+    return _cache
+
+def cached_evaluation(judge_model: Callable[[], str], prompt: str):
+    """A decorator that caches the results of an LLM judge evaluator in the process wide evaluation cache.
+    The cache key covers the evaluator's name, the judge model, the judge prompt and the evaluator's arguments.
+
+    @cached_evaluation(judge_model=lambda: "gpt-4o-mini", prompt=JUDGE_PROMPT)
+    def judge(question, answer) -> dict:
+        ...
+
+    Args:
+        judge_model: returns the name of the model that the evaluator calls
+        prompt: the judge prompt that the evaluator uses
+    """
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_evaluation_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+
+            key = EvaluationCache.key(func.__qualname__, judge_model(), prompt, args, kwargs)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+            result = func(*args, **kwargs)
+            if result is not None:
+                cache.put(key, result)
+            return result
+
+        return wrapper
+    return decorator
@@ -0,0 +1,175 @@
+import time
+import random
+import logging
+import threading
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, Any
+
+"""
+Runs an evaluator over many rows with bounded concurrency, a requests and tokens per minute budget
+and retries for transient LLM errors. Used by the batch evaluation jobs.
+"""
+
+TRANSIENT_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, TRANSIENT_ERRORS):
+        return True
+    status_code = getattr(e, "status_code", None)
+    return status_code == 429 or (status_code is not None and status_code >= 500)
+
+def estimate_tokens(*args) -> int:
+    """A rough token estimate for an evaluator call: about 4 characters per token for the inputs plus
+    an allowance for the judge prompt and its reply
+    """
+    return sum(len(str(a)) for a in args) // 4 + 250
+
+class RateLimiter:
+    """A token bucket that enforces a requests per minute and a tokens per minute budget across threads.
+    A budget of None is unlimited.
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute or 0
+        self._tokens = tokens_per_minute or 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens: int = 0):
+        """Blocks until one request using the given number of tokens fits in the budget"""
+        while True:
+            with self._lock:
+                self._refill()
+                # a single call that is bigger than the whole budget is let through once the bucket is full
+                tokens_needed = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._tokens < tokens_needed:
+                    wait = max(wait, (tokens_needed - self._tokens) * 60 / self.tokens_per_minute)
+
+                if wait == 0.0:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens_needed
+                    return
+            time.sleep(wait)
+
+def _percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+class EvaluationReport:
+    def __init__(self, count: int, failed: int, retries: int, elapsed_s: float, latencies_s: list[float]):
+        self.count = count
+        self.failed = failed
+        self.retries = retries
+        self.elapsed_s = elapsed_s
+        self.throughput = count / elapsed_s if elapsed_s > 0 else 0.0
+        self.p50_latency_s = _percentile(latencies_s, 50)
+        self.p95_latency_s = _percentile(latencies_s, 95)
+
+    def __str__(self) -> str:
+        p50 = f"{self.p50_latency_s:.2f}s" if self.p50_latency_s is not None else "n/a"
+        p95 = f"{self.p95_latency_s:.2f}s" if self.p95_latency_s is not None else "n/a"
+        return (
+            f"evaluated {self.count} rows in {self.elapsed_s:.1f}s ({self.throughput:.2f} rows/s), "
+            f"{self.failed} failed, {self.retries} retries, p50 latency {p50}, p95 latency {p95}"
+        )
+
+class EvaluationRunner:
+    """Runs an evaluator over a list of rows concurrently.
+
+    Args:
+        evaluator: the function to call for each row, it is called with the row's values as arguments
+
+        max_concurrency: the maximum number of evaluator calls in flight
+
+        requests_per_minute: an optional budget of evaluator calls per minute
+
+        tokens_per_minute: an optional budget of LLM tokens per minute, estimated with count_tokens
+
+        max_retries: how many times to retry a call that failed with a transient error
+
+        base_backoff_s: the backoff before the first retry. It doubles on every retry and is fully jittered
+
+        max_backoff_s: the maximum backoff between retries
+
+        count_tokens: estimates the number of tokens a call will use from the row's values
+    """
+    def __init__(
+            self,
+            evaluator: Callable[..., Any],
+            max_concurrency: int = 8,
+            requests_per_minute: Optional[float] = None,
+            tokens_per_minute: Optional[float] = None,
+            max_retries: int = 5,
+            base_backoff_s: float = 1.0,
+            max_backoff_s: float = 30.0,
+            count_tokens: Callable[..., int] = estimate_tokens):
+        self.evaluator = evaluator
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.count_tokens = count_tokens
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+        self._lock = threading.Lock()
+        self._latencies: list[float] = []
+        self._failed = 0
+        self._retries = 0
+
+    def _evaluate(self, row: tuple) -> Any:
+        tokens = self.count_tokens(*row)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(tokens)
+            started = time.monotonic()
+            try:
+                result = self.evaluator(*row)
+                with self._lock:
+                    self._latencies.append(time.monotonic() - started)
+                return result
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_transient(e):
+                    logging.warning(f"Evaluation failed after {attempt + 1} attempts: {e}")
+                    with self._lock:
+                        self._failed += 1
+                    return None
+
+                with self._lock:
+                    self._retries += 1
+                time.sleep(random.uniform(0, min(self.max_backoff_s, self.base_backoff_s * 2 ** attempt)))
+                attempt += 1
+
+    def run(self, rows: list[tuple]) -> tuple[list[Any], EvaluationReport]:
+        """Evaluates every row and returns the results in the same order as the rows, with None for rows
+        that failed, and a report of the run
+        """
+        self._latencies, self._failed, self._retries = [], 0, 0
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="domino-evaluation-runner") as pool:
+            results = list(pool.map(self._evaluate, rows))
+
+        report = EvaluationReport(len(rows), self._failed, self._retries, time.monotonic() - started, self._latencies)
+        return results, report
@@ -0,0 +1,337 @@
+import os
+import time
+import asyncio
+import logging
+import weakref
+import itertools
+import threading
+import importlib.util
+import httpx
+from typing import Optional, Any, Callable
+
+"""
+One pooled HTTP client for every OpenAI and LangChain caller in the process, so that they share keep-alive connections
+instead of each opening their own, and a global cap on the number of requests in flight to the LLM provider.
+
+Configured with environment variables:
+    DOMINO_HTTP_MAX_CONNECTIONS: the maximum number of open connections (default 100)
+    DOMINO_HTTP_MAX_KEEPALIVE: the maximum number of idle connections kept open (default 50)
+    DOMINO_HTTP_KEEPALIVE_EXPIRY_S: how long an idle connection is kept open (default 60)
+    DOMINO_HTTP_MAX_CONCURRENCY: the maximum number of requests in flight, counted separately for the sync
+    and the async client (default 64)
+    DOMINO_HTTP_ACQUIRE_TIMEOUT_S: how long a request waits for a concurrency slot before it fails with
+    httpx.PoolTimeout (default 60, or the client's pool timeout if that is shorter)
+    DOMINO_HTTP_MAX_HOLD_S: how long a request may hold its slot before the slot is reclaimed for waiting requests,
+    in case its response is never closed (default 600). A response that is garbage collected without being closed
+    gives its slot back right away
+    DOMINO_HTTP2_DISABLED: set to true to use HTTP/1.1 even when the h2 package is installed
+"""
+
+def _http2_available() -> bool:
+    return os.getenv("DOMINO_HTTP2_DISABLED", "false") != "true" and importlib.util.find_spec("h2") is not None
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("DOMINO_HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("DOMINO_HTTP_MAX_KEEPALIVE", "50")),
+        keepalive_expiry=float(os.getenv("DOMINO_HTTP_KEEPALIVE_EXPIRY_S", "60")),
+    )
+
+def _max_concurrency() -> int:
+    return int(os.getenv("DOMINO_HTTP_MAX_CONCURRENCY", "64"))
+
+def _max_hold_s() -> float:
+    return float(os.getenv("DOMINO_HTTP_MAX_HOLD_S", "600"))
+
+def _acquire_timeout_s(request: httpx.Request) -> float:
+    timeout = float(os.getenv("DOMINO_HTTP_ACQUIRE_TIMEOUT_S", "60"))
+    pool_timeout = request.extensions.get("timeout", {}).get("pool", None)
+    return timeout if pool_timeout is None else min(timeout, pool_timeout)
+
+def _pool_timeout(request: httpx.Request, timeout: float) -> httpx.PoolTimeout:
+    return httpx.PoolTimeout(f"no HTTP concurrency slot became free within {timeout}s", request=request)
+
+# the openai sdk's defaults
+TIMEOUT = httpx.Timeout(timeout=600.0, connect=5.0)
+
+class HttpPoolStats:
+    """Counts the requests sent through a pooled client and how often they waited for a concurrency slot"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "in_flight": 0,
+            "waits": 0,
+            "wait_s": 0.0,
+            "errors": 0,
+            "pool_timeouts": 0,
+            "reclaimed": 0,
+        }
+
+    def started(self, wait_s: Optional[float]):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["in_flight"] += 1
+            if wait_s is not None:
+                self._stats["waits"] += 1
+                self._stats["wait_s"] += wait_s
+
+    def finished(self, error: bool = False):
+        with self._lock:
+            self._stats["in_flight"] -= 1
+            self._stats["errors"] += int(error)
+
+    def count(self, stat: str, n: int = 1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+def _pool_connections(transport) -> dict[str, int]:
+    # httpx doesn't expose its connection pool, so these are best effort
+    connections = getattr(getattr(transport, "_pool", None), "connections", [])
+    idle = sum(1 for c in connections if c.is_idle())
+    return {"connections": len(connections), "idle_connections": idle, "active_connections": len(connections) - idle}
+
+class _ReleasingStream(httpx.SyncByteStream):
+    # holds the concurrency slot until the response body has been read, so streamed completions count as in flight
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+def _once(release):
+    released = False
+    lock = threading.Lock()
+
+    def release_once(error: bool = False):
+        nonlocal released
+        with lock:
+            if released:
+                return
+            released = True
+        release(error)
+    return release_once
+
+class _HeldSlots:
+    """The concurrency slots in use, so that slots whose response is never closed can be reclaimed"""
+    def __init__(self, max_hold_s: float, stats: HttpPoolStats):
+        self._max_hold_s = max_hold_s
+        self._stats = stats
+        self._lock = threading.Lock()
+        self._held: dict[int, tuple[float, Callable]] = {}
+        self._keys = itertools.count()
+
+    def hold(self, release: Callable[[bool], None]) -> Callable[[bool], None]:
+        """Returns a function that releases the slot once, however many times it is called"""
+        key = next(self._keys)
+
+        def release_slot(error: bool = False):
+            with self._lock:
+                self._held.pop(key, None)
+            release(error)
+        release_slot = _once(release_slot)
+
+        with self._lock:
+            self._held[key] = (time.monotonic(), release_slot)
+        return release_slot
+
+    def reclaim(self) -> int:
+        """Releases the slots that have been held for longer than max_hold_s"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [release for (held_since, release) in self._held.values() if now - held_since > self._max_hold_s]
+        for release in expired:
+            release()
+        if expired:
+            self._stats.count("reclaimed", len(expired))
+            logging.warning(f"Reclaimed {len(expired)} HTTP concurrency slots held for over {self._max_hold_s}s, "
+                            "their responses were never closed")
+        return len(expired)
+
+def _releasing_response(response: httpx.Response, stream) -> httpx.Response:
+    released = httpx.Response(
+        status_code=response.status_code,
+        headers=response.headers,
+        stream=stream,
+        extensions=response.extensions,
+    )
+    # a response that is dropped without being closed gives its slot back when it is garbage collected
+    weakref.finalize(released, stream._release).atexit = False
+    return released
+
+class LimitedTransport(httpx.BaseTransport):
+    """An HTTP transport with a keep-alive pool that allows at most max_concurrency requests in flight"""
+    def __init__(self, max_concurrency: int, limits: httpx.Limits, http2: bool):
+        self.transport = httpx.HTTPTransport(limits=limits, http2=http2)
+        self.stats = HttpPoolStats()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._held = _HeldSlots(_max_hold_s(), self.stats)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        wait_s = None
+        if not self._semaphore.acquire(blocking=False):
+            started = time.monotonic()
+            self._held.reclaim()
+            timeout = _acquire_timeout_s(request)
+            if not self._semaphore.acquire(timeout=timeout):
+                self.stats.count("pool_timeouts")
+                raise _pool_timeout(request, timeout)
+            wait_s = time.monotonic() - started
+        self.stats.started(wait_s)
+
+        def release(error: bool = False):
+            self._semaphore.release()
+            self.stats.finished(error)
+        release = self._held.hold(release)
+
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            release(error=True)
+            raise
+
+        return _releasing_response(response, _ReleasingStream(response.stream, release))
+
+    def close(self):
+        self.transport.close()
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    """The async version of LimitedTransport"""
+    def __init__(self, max_concurrency: int, limits: httpx.Limits, http2: bool):
+        self.transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+        self.stats = HttpPoolStats()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._held = _HeldSlots(_max_hold_s(), self.stats)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        wait_s = None
+        if self._semaphore.locked():
+            started = time.monotonic()
+            self._held.reclaim()
+            timeout = _acquire_timeout_s(request)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.stats.count("pool_timeouts")
+                raise _pool_timeout(request, timeout) from None
+            wait_s = time.monotonic() - started
+        else:
+            await self._semaphore.acquire()
+        self.stats.started(wait_s)
+
+        loop = asyncio.get_running_loop()
+
+        def release(error: bool = False):
+            # the garbage collector can release a slot from any thread, and the semaphore belongs to the event loop
+            try:
+                on_loop = asyncio.get_running_loop() is loop
+            except RuntimeError:
+                on_loop = False
+            if on_loop:
+                self._semaphore.release()
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(self._semaphore.release)
+            self.stats.finished(error)
+        release = self._held.hold(release)
+
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            release(error=True)
+            raise
+
+        return _releasing_response(response, _AsyncReleasingStream(response.stream, release))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+_lock = threading.Lock()
+_transport: Optional[LimitedTransport] = None
+_async_transport: Optional[AsyncLimitedTransport] = None
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_openai_client = None
+_async_openai_client = None
+
+def get_http_client() -> httpx.Client:
+    """Returns the process wide pooled HTTP client"""
+    global _http_client, _transport
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _transport = LimitedTransport(_max_concurrency(), _limits(), _http2_available())
+                _http_client = httpx.Client(transport=_transport, timeout=TIMEOUT, follow_redirects=True)
+    return _http_client
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Returns the process wide pooled async HTTP client. Its connections belong to the event loop that first
+    uses them, so use it from a single event loop, like the server's
+    """
+    global _async_http_client, _async_transport
+    if _async_http_client is None:
+        with _lock:
+            if _async_http_client is None:
+                _async_transport = AsyncLimitedTransport(_max_concurrency(), _limits(), _http2_available())
+                _async_http_client = httpx.AsyncClient(transport=_async_transport, timeout=TIMEOUT, follow_redirects=True)
+    return _async_http_client
+
+def get_openai_client():
+    """Returns the process wide OpenAI client, which sends its requests through the pooled HTTP client"""
+    global _openai_client
+    if _openai_client is None:
+        http_client = get_http_client()
+        with _lock:
+            if _openai_client is None:
+                from openai import OpenAI
+
+                _openai_client = OpenAI(http_client=http_client)
+    return _openai_client
+
+def get_async_openai_client():
+    """Returns the process wide AsyncOpenAI client, which sends its requests through the pooled async HTTP client"""
+    global _async_openai_client
+    if _async_openai_client is None:
+        http_client = get_async_http_client()
+        with _lock:
+            if _async_openai_client is None:
+                from openai import AsyncOpenAI
+
+                _async_openai_client = AsyncOpenAI(http_client=http_client)
+    return _async_openai_client
+
+def get_http_pool_stats() -> dict[str, Any]:
+    """Returns the request counts, concurrency waits and connection pool sizes of the pooled clients
+    that have been created
+    """
+    stats: dict[str, Any] = {"http2": _http2_available()}
+    for (name, transport) in [("sync", _transport), ("async", _async_transport)]:
+        if transport is None:
+            continue
+        stats[name] = {**transport.stats.snapshot(), **_pool_connections(transport.transport)}
+    return stats
@@ -0,0 +1,68 @@
+import time
+import asyncio
+import argparse
+import httpx
+
+"""
+Sends many concurrent questions to the /assistant endpoint and reports throughput and latency.
+Use it to check that a single uvicorn worker keeps serving other requests while LLM calls are in flight:
+
+    uv run fastapi run production/server.py --workers 1
+    uv run production/load_test_assistant.py --concurrency 50 --requests 500
+"""
+
+QUESTIONS = [
+    "What is the capital of France?",
+    "What tickets do I have to finish this week at work?",
+    "is it warm enough to wear a t-shirt today?",
+    "who is president in 2025?",
+]
+
+def _percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+async def _worker(client: httpx.AsyncClient, url: str, requests: asyncio.Queue, latencies: list[float], errors: list[str]):
+    while True:
+        try:
+            i = requests.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        started = time.perf_counter()
+        try:
+            response = await client.post(url, json={"content": QUESTIONS[i % len(QUESTIONS)]})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(str(e))
+
+async def run_load_test(url: str, concurrency: int, total_requests: int, timeout_s: float):
+    requests = asyncio.Queue()
+    for i in range(total_requests):
+        requests.put_nowait(i)
+
+    latencies: list[float] = []
+    errors: list[str] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout_s, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[_worker(client, url, requests, latencies, errors) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    print(f"{len(latencies)} ok, {len(errors)} errors in {elapsed:.1f}s with concurrency {concurrency}")
+    print(f"throughput: {len(latencies) / elapsed:.2f} requests/s")
+    if latencies:
+        print(f"latency p50: {_percentile(latencies, 50):.2f}s p95: {_percentile(latencies, 95):.2f}s max: {max(latencies):.2f}s")
+    for e in errors[:5]:
+        print(f"error: {e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load test the /assistant endpoint")
+    parser.add_argument("--url", default="http://localhost:8000/assistant")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    asyncio.run(run_load_test(args.url, args.concurrency, args.requests, args.timeout))
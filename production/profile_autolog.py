@@ -0,0 +1,84 @@
+import os
+import sys
+import argparse
+import pathlib
+import tempfile
+import httpx
+
+"""
+Reports the per call overhead that each framework's autologging adds to a traced function. The LLM provider is
+replaced by a canned response, so the numbers are the cost of tracing and not of the model:
+
+    uv run production/profile_autolog.py
+    uv run production/profile_autolog.py openai --calls 500
+
+Traces are logged to a temporary file store unless MLFLOW_TRACKING_URI is set. The sqlite store would need
+alembic and sqlalchemy, which are not in the locked dependencies.
+"""
+
+DEFAULT_FRAMEWORKS = ["openai", "langchain"]
+
+COMPLETION = {
+    "id": "chatcmpl-profile",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4o-mini",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "Domino is an enterprise AI platform."},
+        "finish_reason": "stop",
+    }],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 8, "total_tokens": 20},
+}
+
+def _fake_llm(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json=COMPLETION)
+
+def build_workload(frameworks: list[str]):
+    """Returns a traced function that makes one chat completion through each of the frameworks"""
+    from domino_eval_trace import start_domino_trace
+
+    http_client = httpx.Client(transport=httpx.MockTransport(_fake_llm))
+    settings = {"api_key": "profile", "base_url": "http://llm.invalid/v1"}
+    messages = [{"role": "user", "content": "What is Domino?"}]
+
+    calls = []
+    if "openai" in frameworks:
+        from openai import OpenAI
+
+        client = OpenAI(http_client=http_client, **settings)
+        calls.append(lambda: client.chat.completions.create(model="gpt-4o-mini", messages=messages))
+    if "langchain" in frameworks:
+        from langchain_openai import ChatOpenAI
+
+        llm = ChatOpenAI(model="gpt-4o-mini", http_client=http_client, **settings)
+        calls.append(lambda: llm.invoke(messages))
+
+    @start_domino_trace("autolog_overhead")
+    def traced_call():
+        for call in calls:
+            call()
+    return traced_call
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="report the per call overhead of autologging for each framework")
+    parser.add_argument("frameworks", nargs="*", default=DEFAULT_FRAMEWORKS)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault("MLFLOW_ENABLE_ASYNC_TRACE_LOGGING", "true")
+    tmp_dir = tempfile.mkdtemp(prefix="domino_autolog_")
+    os.environ.setdefault("MLFLOW_TRACKING_URI", pathlib.Path(tmp_dir).as_uri())
+
+    import mlflow
+    from domino_autolog import measure_autolog_overhead
+
+    mlflow.set_experiment("domino_autolog_overhead")
+    report = measure_autolog_overhead(build_workload(args.frameworks), args.frameworks, calls=args.calls, rounds=args.rounds)
+
+    baseline = report.pop("baseline")["ms_per_call"]
+    print(f"traced call without autologging: {baseline:.3f}ms")
+    for (framework, r) in report.items():
+        print(f"{framework}: {r['ms_per_call']:.3f}ms per call, +{r['overhead_ms']:.3f}ms ({r['overhead_pct']:.0f}%)")
+    sys.exit(0)
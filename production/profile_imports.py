@@ -0,0 +1,113 @@
+import os
+import sys
+import argparse
+import subprocess
+
+"""
+Reports how long it takes to import the production modules, using python's -X importtime, and fails when a module
+takes longer than the budget. Each module is imported in a fresh interpreter, so the numbers include everything the
+module pulls in:
+
+    uv run production/profile_imports.py --budget-ms 1500
+    uv run production/profile_imports.py util --top 30
+
+The budget can also be set with the DOMINO_IMPORT_BUDGET_MS environment variable.
+"""
+
+DEFAULT_MODULES = [
+    "db",
+    "rag",
+    "tools",
+    "evaluators",
+    "domino_eval_trace",
+    "util",
+    "server",
+]
+
+class ImportTimeEntry:
+    def __init__(self, module: str, self_us: int, cumulative_us: int, depth: int):
+        self.module = module
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+
+def parse_importtime(stderr: str) -> list[ImportTimeEntry]:
+    """Parses the 'import time: self [us] | cumulative | imported package' lines that -X importtime writes to stderr"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append(ImportTimeEntry(name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+def profile_import(module: str, cwd: str) -> list[ImportTimeEntry]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [cwd, os.getenv("PYTHONPATH", None)]))},
+    )
+    if result.returncode != 0:
+        raise Exception(f"importing {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    return parse_importtime(result.stderr)
+
+def _module_cumulative_us(entries: list[ImportTimeEntry], module: str) -> int:
+    return next(e.cumulative_us for e in reversed(entries) if e.module == module and e.depth == 0)
+
+def _top_level_packages(entries: list[ImportTimeEntry], exclude: str) -> dict[str, int]:
+    """Returns the cumulative import time of each top level package, e.g. openai, mlflow or chromadb, including
+    the packages it imports. Self times aren't summed because they are wrong for imports that overlap with
+    an import on another thread. Overlapping imports, like the ones mlflow starts in the background, can still make a
+    package's time add up to more than the module's total
+    """
+    packages: dict[str, int] = {}
+    # -X importtime prints a module after the modules it imported, so walk backwards to see parents first
+    parents: dict[int, str] = {}
+    for e in reversed(entries):
+        package = e.module.split(".")[0]
+        parents[e.depth] = package
+        if e.depth == 0 or parents.get(e.depth - 1, None) != package:
+            packages[package] = packages.get(package, 0) + e.cumulative_us
+    packages.pop(exclude, None)
+    return packages
+
+def report(modules: list[str], budget_ms: float, top: int) -> bool:
+    """Prints the import cost of every module and the most expensive packages it pulls in, with the time of
+    nested packages included in the packages that import them.
+    Returns False if any module is over budget
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    within_budget = True
+    for module in modules:
+        try:
+            entries = profile_import(module, cwd)
+        except Exception as e:
+            print(f"{module}: {e}")
+            within_budget = False
+            continue
+
+        total_ms = _module_cumulative_us(entries, module) / 1000
+        over = total_ms > budget_ms
+        within_budget = within_budget and not over
+        print(f"{module}: {total_ms:.0f}ms {'OVER BUDGET' if over else 'ok'} (budget {budget_ms:.0f}ms)")
+
+        packages = sorted(_top_level_packages(entries, module).items(), key=lambda p: p[1], reverse=True)
+        for (package, cumulative_us) in packages[:top]:
+            print(f"    {cumulative_us / 1000:8.1f}ms  {package}")
+
+    return within_budget
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="report the import time of the production modules")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("DOMINO_IMPORT_BUDGET_MS", "2000")))
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    if not report(args.modules, args.budget_ms, args.top):
+        sys.exit(1)
@@ -1,9 +1,197 @@
-from db import collection
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Optional, Callable
+from db import get_collection
+from retrieval_cache import get_retrieval_cache
+
+N_RESULTS = 5
+
+def _query_collection(questions: list[str]) -> list[str]:
+    cache = get_retrieval_cache()
+    if cache is None:
+        results = get_collection().query(
+            query_texts=questions,
+            n_results=N_RESULTS
+        )
+        return ['.'.join(documents) for documents in results['documents']]
+
+    # read the version before querying, so that a write during the query leaves its results under the old version
+    version = get_collection().version
+    embeddings = cache.embed(questions)
+    documents = [cache.get_documents(e, N_RESULTS, version) for e in embeddings]
+    missing = [i for (i, d) in enumerate(documents) if d is None]
+    if missing:
+        results = get_collection().query(
+            query_embeddings=[embeddings[i] for i in missing],
+            n_results=N_RESULTS
+        )
+        for (i, retrieved) in zip(missing, results['documents']):
+            documents[i] = retrieved
+            cache.put_documents(embeddings[i], N_RESULTS, version, retrieved)
+
+    return ['.'.join(d) for d in documents]
+
+# set once the collection and the retrieval cache have been created, after that a cache lookup is an in memory read
+_retrieval_ready = False
+
+def _cached_docs(question: str) -> Optional[str]:
+    global _retrieval_ready
+    cache = get_retrieval_cache()
+    version = get_collection().version
+    _retrieval_ready = True
+    documents = cache.lookup(question, N_RESULTS, version) if cache else None
+    return '.'.join(documents) if documents is not None else None
+
+def _histogram_bucket(batch_size: int) -> int:
+    # batch sizes are counted in power of two buckets, labelled by their upper bound
+    return 1 << (batch_size - 1).bit_length()
+
+class RetrievalBatcher:
+    """Collects questions from concurrent callers and retrieves their documents with one multi query call, so that
+    the questions are embedded and searched together. A batch is sent once it holds max_batch_size questions or
+    max_wait_ms after its first question arrived, whichever comes first.
+
+    Args:
+        query: retrieves the documents for a list of questions, in the same order as the questions
+
+        max_batch_size: the maximum number of questions in one query call
+
+        max_wait_ms: how long the first question of a batch waits for more questions to arrive
+    """
+    def __init__(self, query: Callable[[list[str]], list[str]], max_batch_size: int = 32, max_wait_ms: float = 5):
+        self.query_batch = query
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue: queue.Queue[tuple[str, Future]] = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._histogram: dict[int, int] = {}
+        self._stats = {
+            "batches": 0,
+            "questions": 0,
+            "failed_batches": 0,
+        }
+
+    def submit(self, question: str) -> Future:
+        """Queues a question and returns a future for its documents"""
+        self._start_worker()
+        future = Future()
+        self._queue.put((question, future))
+        return future
+
+    def query(self, question: str) -> str:
+        return self.submit(question).result()
+
+    async def query_async(self, question: str) -> str:
+        return await asyncio.wrap_future(self.submit(question))
+
+    def stats(self) -> dict:
+        """Returns the number of batches and questions, and a histogram of batch sizes keyed by
+        the upper bound of power of two buckets
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["batch_size_histogram"] = dict(sorted(self._histogram.items()))
+        stats["mean_batch_size"] = stats["questions"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _start_worker(self):
+        if self._worker is not None:
+            return
+
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="domino-retrieval-batcher", daemon=True)
+                self._worker.start()
+
+    def _next_batch(self) -> list[tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # skip questions whose callers have given up on them
+            batch = [(q, f) for (q, f) in self._next_batch() if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                results = self.query_batch([q for (q, _) in batch])
+                for ((_, future), result) in zip(batch, results):
+                    future.set_result(result)
+                failed = 0
+            except Exception as e:
+                logging.warning(f"Retrieval failed for a batch of {len(batch)} questions: {e}")
+                for (_, future) in batch:
+                    future.set_exception(e)
+                failed = 1
+
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["questions"] += len(batch)
+                self._stats["failed_batches"] += failed
+                bucket = _histogram_bucket(len(batch))
+                self._histogram[bucket] = self._histogram.get(bucket, 0) + 1
+
+_batcher: Optional[RetrievalBatcher] = None
+_batcher_lock = threading.Lock()
+
+def get_retrieval_batcher() -> Optional[RetrievalBatcher]:
+    """Returns the process wide retrieval batcher, configured with the DOMINO_RETRIEVAL_BATCH_SIZE and
+    DOMINO_RETRIEVAL_BATCH_WAIT_MS environment variables. Set DOMINO_RETRIEVAL_BATCHING_DISABLED=true
+    to query the collection once per question instead.
+    """
+    global _batcher
+    if os.getenv("DOMINO_RETRIEVAL_BATCHING_DISABLED", "false") == "true":
+        return None
+
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = RetrievalBatcher(
+                    _query_collection,
+                    max_batch_size=int(os.getenv("DOMINO_RETRIEVAL_BATCH_SIZE", "32")),
+                    max_wait_ms=float(os.getenv("DOMINO_RETRIEVAL_BATCH_WAIT_MS", "5")),
+                )
+    return _batcher
 
 def query_docs(question: str) -> str:
-    results = collection.query(
-        query_texts=[question],
-        n_results=5
-    )
+    # repeated questions are answered from the cache without waiting for a batch
+    cached = _cached_docs(question)
+    if cached is not None:
+        return cached
+
+    batcher = get_retrieval_batcher()
+    if batcher is None:
+        return _query_collection([question])[0]
+    return batcher.query(question)
+
+async def query_docs_async(question: str) -> str:
+    if _retrieval_ready:
+        cached = _cached_docs(question)
+    else:
+        # the first lookup opens chroma, loads the embedding model and ingests the seed documents, which
+        # would block every other request on the event loop
+        cached = await asyncio.to_thread(_cached_docs, question)
+    if cached is not None:
+        return cached
 
-    return '.'.join(results['documents'][0])
+    batcher = get_retrieval_batcher()
+    if batcher is None:
+        # chroma's client is synchronous, so the query runs on a worker thread to keep the event loop free
+        return await asyncio.to_thread(query_docs, question)
+    # the batcher's thread runs the query, the event loop only waits for the result
+    return await batcher.query_async(question)
@@ -0,0 +1,162 @@
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict, deque
+from typing import Optional, Callable
+
+class _CachedResponse:
+    def __init__(self, slot: int, context_hash: str, response: str):
+        self.slot = slot
+        self.context_hash = context_hash
+        self.response = response
+
+def _context_hash(context: str) -> str:
+    return hashlib.sha256(context.encode()).hexdigest()
+
+class SemanticResponseCache:
+    """Caches responses by the meaning of the question. A cached response is returned for a new question when the
+    cosine similarity of their embeddings is at least similarity_threshold and the retrieved context is exactly
+    the same, so a change to the knowledge base is never hidden by the cache.
+
+    Args:
+        embed: embeds a list of texts
+        similarity_threshold: the minimum cosine similarity for two questions to share a response
+        ttl_s: how long a response stays in the cache
+        max_entries: the maximum number of cached responses. The least recently used response is evicted first
+    """
+    def __init__(
+            self,
+            embed: Callable[[list[str]], list],
+            similarity_threshold: float = 0.95,
+            ttl_s: float = 60 * 60,
+            max_entries: int = 10000):
+        self.embed_texts = embed
+        self.similarity_threshold = similarity_threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, _CachedResponse] = OrderedDict()
+        self._next_id = 0
+        # the entries in the order they expire, every entry has the same ttl
+        self._expiry: deque[tuple[float, int]] = deque()
+        # the normalized embeddings of the entries, one row per slot. An entry's row is written in place when it is
+        # added and its slot is reused after it is evicted, so the matrix is never rebuilt
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._slot_ids: list[Optional[int]] = []
+        self._free_slots: list[int] = []
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+    def embed(self, question: str) -> np.ndarray:
+        embedding = np.asarray(self.embed_texts([question])[0], dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    def get(self, embedding: np.ndarray, context: str) -> Optional[tuple[str, float]]:
+        """Returns the cached response and its similarity for the most similar cached question, if it is similar enough
+        and was answered with the same context
+        """
+        context_hash = _context_hash(context)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if not self._entries:
+                self._stats["misses"] += 1
+                return None
+
+            similarities = self._matrix[:len(self._slot_ids)] @ embedding
+            candidates = np.flatnonzero(similarities >= self.similarity_threshold)
+            for slot in candidates[np.argsort(-similarities[candidates])]:
+                entry_id = self._slot_ids[slot]
+                if entry_id is None:
+                    # a free slot
+                    continue
+
+                similarity = float(similarities[slot])
+                entry = self._entries[entry_id]
+                if entry.context_hash == context_hash:
+                    self._entries.move_to_end(entry_id)
+                    self._stats["hits"] += 1
+                    return entry.response, similarity
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, embedding: np.ndarray, context: str, response: str):
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                (_, evicted) = self._entries.popitem(last=False)
+                self._free(evicted)
+                self._stats["evictions"] += 1
+
+            slot = self._free_slots.pop() if self._free_slots else self._new_slot(embedding.shape[0])
+            self._matrix[slot] = embedding
+            self._slot_ids[slot] = self._next_id
+            expires_at = time.time() + self.ttl_s
+            self._entries[self._next_id] = _CachedResponse(slot, _context_hash(context), response)
+            self._expiry.append((expires_at, self._next_id))
+            self._next_id += 1
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _new_slot(self, dimensions: int) -> int:
+        slot = len(self._slot_ids)
+        if slot == self._matrix.shape[0]:
+            # the matrix doubles when it is full, so adding an entry copies the matrix only O(log n) times in total
+            matrix = np.zeros((min(max(16, 2 * slot), self.max_entries), dimensions), dtype=np.float32)
+            if slot:
+                matrix[:slot] = self._matrix[:slot]
+            self._matrix = matrix
+        self._slot_ids.append(None)
+        return slot
+
+    def _free(self, entry: _CachedResponse):
+        self._slot_ids[entry.slot] = None
+        self._free_slots.append(entry.slot)
+
+    def _expire(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            (_, entry_id) = self._expiry.popleft()
+            # the entry may have been evicted already
+            entry = self._entries.pop(entry_id, None)
+            if entry is not None:
+                self._free(entry)
+
+_cache: Optional[SemanticResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[SemanticResponseCache]:
+    """Returns the process wide response cache, which embeds questions with the same model as the chroma collection.
+    It is configured with the DOMINO_RESPONSE_CACHE_THRESHOLD, DOMINO_RESPONSE_CACHE_TTL_S and
+    DOMINO_RESPONSE_CACHE_MAX_ENTRIES environment variables. Set DOMINO_RESPONSE_CACHE_DISABLED=true to turn it off.
+    """
+    global _cache
+    if os.getenv("DOMINO_RESPONSE_CACHE_DISABLED", "false") == "true":
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from retrieval_cache import get_retrieval_cache
+                from db import get_embedding_function
+
+                # share the retrieval cache's embeddings, so the question retrieved for is not embedded twice
+                retrieval_cache = get_retrieval_cache()
+                _cache = SemanticResponseCache(
+                    retrieval_cache.embed if retrieval_cache else get_embedding_function(),
+                    similarity_threshold=float(os.getenv("DOMINO_RESPONSE_CACHE_THRESHOLD", "0.95")),
+                    ttl_s=float(os.getenv("DOMINO_RESPONSE_CACHE_TTL_S", str(60 * 60))),
+                    max_entries=int(os.getenv("DOMINO_RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+                )
+    return _cache
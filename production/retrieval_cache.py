@@ -0,0 +1,153 @@
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional, Callable, Any
+
+class _LRUCache:
+    def __init__(self, max_entries: int, ttl_s: Optional[float]):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+
+    def get(self, key: Any) -> Optional[Any]:
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Any, value: Any) -> int:
+        """Adds an entry and returns the number of entries evicted to make room for it"""
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s else float("inf")
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        evicted = 0
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def _embedding_key(embedding: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+
+class RetrievalCache:
+    """A two level cache for retrieval. The first level maps question text to its embedding and the second maps
+    an embedding, the number of results and the collection version to the retrieved documents. The collection
+    version changes whenever this process writes to the collection, so results are never served from before a write.
+
+    Args:
+        embed: embeds a list of texts
+
+        max_embeddings: the maximum number of cached embeddings. The least recently used embedding is evicted first
+
+        max_results: the maximum number of cached retrieval results. The least recently used result is evicted first
+
+        ttl_s: how long a retrieval result stays in the cache. This bounds how stale a result can be when
+        another process writes to a shared collection
+    """
+    def __init__(
+            self,
+            embed: Callable[[list[str]], list],
+            max_embeddings: int = 10000,
+            max_results: int = 10000,
+            ttl_s: Optional[float] = 5 * 60):
+        self.embed_texts = embed
+        self._lock = threading.Lock()
+        self._embeddings = _LRUCache(max_embeddings, None)
+        self._results = _LRUCache(max_results, ttl_s)
+        self._stats = {
+            "embedding_hits": 0,
+            "embedding_misses": 0,
+            "result_hits": 0,
+            "result_misses": 0,
+            "evictions": 0,
+        }
+
+    def embed(self, texts: list[str]) -> list[np.ndarray]:
+        """Returns the embeddings of the texts, embedding only the texts that aren't cached, in a single call"""
+        with self._lock:
+            embeddings = [self._embeddings.get(t) for t in texts]
+        missing = list(dict.fromkeys(t for (t, e) in zip(texts, embeddings) if e is None))
+        if not missing:
+            with self._lock:
+                self._stats["embedding_hits"] += len(texts)
+            return embeddings
+
+        computed = dict(zip(missing, (np.asarray(e, dtype=np.float32) for e in self.embed_texts(missing))))
+        with self._lock:
+            self._stats["embedding_hits"] += len(texts) - len(missing)
+            self._stats["embedding_misses"] += len(missing)
+            for (text, embedding) in computed.items():
+                self._stats["evictions"] += self._embeddings.put(text, embedding)
+        return [e if e is not None else computed[t] for (t, e) in zip(texts, embeddings)]
+
+    def get_documents(self, embedding: np.ndarray, n_results: int, version: int) -> Optional[list[str]]:
+        with self._lock:
+            documents = self._results.get((_embedding_key(embedding), n_results, version))
+            self._stats["result_hits" if documents is not None else "result_misses"] += 1
+        return documents
+
+    def put_documents(self, embedding: np.ndarray, n_results: int, version: int, documents: list[str]):
+        with self._lock:
+            self._stats["evictions"] += self._results.put((_embedding_key(embedding), n_results, version), documents)
+
+    def lookup(self, text: str, n_results: int, version: int) -> Optional[list[str]]:
+        """Returns the cached documents for a question when both its embedding and its results are cached,
+        without embedding it or querying the collection
+        """
+        with self._lock:
+            embedding = self._embeddings.get(text)
+            if embedding is None:
+                return None
+            documents = self._results.get((_embedding_key(embedding), n_results, version))
+            if documents is None:
+                return None
+            self._stats["embedding_hits"] += 1
+            self._stats["result_hits"] += 1
+        return documents
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["embeddings"] = len(self._embeddings)
+            stats["results"] = len(self._results)
+        lookups = stats["result_hits"] + stats["result_misses"]
+        stats["hit_rate"] = stats["result_hits"] / lookups if lookups else 0.0
+        return stats
+
+_cache: Optional[RetrievalCache] = None
+_cache_lock = threading.Lock()
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """Returns the process wide retrieval cache, which embeds with the collection's embedding function.
+    It is configured with the DOMINO_RETRIEVAL_CACHE_MAX_EMBEDDINGS, DOMINO_RETRIEVAL_CACHE_MAX_RESULTS and
+    DOMINO_RETRIEVAL_CACHE_TTL_S environment variables. Set DOMINO_RETRIEVAL_CACHE_DISABLED=true to turn it off.
+    """
+    global _cache
+    if os.getenv("DOMINO_RETRIEVAL_CACHE_DISABLED", "false") == "true":
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from db import get_embedding_function
+
+                _cache = RetrievalCache(
+                    get_embedding_function(),
+                    max_embeddings=int(os.getenv("DOMINO_RETRIEVAL_CACHE_MAX_EMBEDDINGS", "10000")),
+                    max_results=int(os.getenv("DOMINO_RETRIEVAL_CACHE_MAX_RESULTS", "10000")),
+                    ttl_s=float(os.getenv("DOMINO_RETRIEVAL_CACHE_TTL_S", str(5 * 60))),
+                )
+    return _cache
@@ -1,16 +1,23 @@
 import os
+import json
 import mlflow
 
 from random import random, randint
 from mlflow.entities import SpanType
-from openai import OpenAI
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import util
+import rag
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from domino_eval_trace import init_domino_tracing
 import logging
+from contextlib import asynccontextmanager
+from domino_eval_executor import flush_domino_evaluations_async
+from retrieval_cache import get_retrieval_cache
+from http_clients import get_http_pool_stats
+from domino_trace_spool import get_trace_spool
 
 logging.basicConfig(level=logging.WARNING)
 
@@ -19,15 +26,51 @@ load_dotenv()
 class Question(BaseModel):
         content: str
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # let queued evaluations tag their traces before the worker exits
+    await flush_domino_evaluations_async(timeout=30)
+
+app = FastAPI(lifespan=lifespan)
 
 init_domino_tracing(
     "all_knowing_rag_agent_analysis",
     is_production=os.getenv("PRODUCTION", "false") == "true",
     ai_frameworks=["openai", "langchain"],
+    autolog_mode="allow_list",
     ai_system_config_path="./production/ai_system_config.yaml"
 )
 
 @app.post("/assistant")
 async def assistant(question: Question):
-    return util.answer_question_with_context(question.content)
+    return await util.answer_question_with_context_async(question.content)
+
+@app.post("/assistant/stream")
+async def assistant_stream(question: Question):
+    """streams the answer as server-sent events, each with a piece of the answer, followed by a [DONE] event"""
+    async def events():
+        async for content in util.stream_answer_question_with_context(question.content):
+            yield f"data: {json.dumps({'content': content})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/retrieval/stats")
+async def retrieval_stats():
+    batcher = rag.get_retrieval_batcher()
+    cache = get_retrieval_cache()
+    return {
+        "batcher": batcher.stats() if batcher else None,
+        "cache": cache.stats() if cache else None,
+    }
+
+@app.get("/http/stats")
+async def http_stats():
+    return get_http_pool_stats()
+
+@app.get("/tracing/stats")
+async def tracing_stats():
+    spool = get_trace_spool()
+    return {"spool": spool.stats() if spool else None}
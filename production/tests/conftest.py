@@ -0,0 +1,47 @@
+import os
+import tempfile
+import httpx
+import pytest
+
+"""
+Fixtures for the production tests. Run them from the repository root with:
+
+    uv run pytest
+
+Modules like build_production_evaluation_dataset create an mlflow client when they are imported, so the tests default
+MLFLOW_TRACKING_URI to a temporary file store before any test module is imported. Tests that log traces use the
+tracking_uri fixture, which gives every test its own store.
+"""
+
+COMPLETION = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4o-mini",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "Domino is an enterprise AI platform."},
+        "finish_reason": "stop",
+    }],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 8, "total_tokens": 20},
+}
+
+def pytest_configure(config):
+    os.environ.setdefault("MLFLOW_TRACKING_URI", tempfile.mkdtemp(prefix="domino_tests_mlruns_"))
+
+@pytest.fixture
+def tracking_uri(tmp_path, monkeypatch) -> str:
+    """Logs to a file store in the test's temporary directory"""
+    import mlflow
+
+    uri = (tmp_path / "mlruns").as_uri()
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", uri)
+    mlflow.set_tracking_uri(uri)
+    return uri
+
+@pytest.fixture
+def llm_http_client() -> httpx.Client:
+    """An http client for the OpenAI and LangChain clients that answers every chat completion with COMPLETION"""
+    client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200, json=COMPLETION)))
+    yield client
+    client.close()
@@ -0,0 +1,199 @@
+import json
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import evaluation_cache
+import response_cache
+import retrieval_cache
+from evaluation_cache import EvaluationCache, cached_evaluation
+from response_cache import SemanticResponseCache
+from retrieval_cache import RetrievalCache
+
+class Clock:
+    """Replaces a cache module's clock, so that access order and expiry don't depend on how fast the test runs"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        self.now += 0.001
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    for module in [evaluation_cache, response_cache, retrieval_cache]:
+        monkeypatch.setattr(module, "time", SimpleNamespace(time=clock, monotonic=clock))
+    return clock
+
+def _unit(seed: int, dimensions: int = 64) -> np.ndarray:
+    v = np.random.default_rng(seed).normal(size=dimensions).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+# evaluation cache
+
+def test_evaluation_cache_round_trip_and_persistence(tmp_path):
+    path = str(tmp_path / "evaluations.sqlite")
+    cache = EvaluationCache(path)
+    key = EvaluationCache.key("judge", "gpt-4o-mini", "prompt", "question", "answer")
+
+    assert cache.get(key) is None
+    cache.put(key, {"fullfilled": 0.8})
+    assert cache.get(key) == {"fullfilled": 0.8}
+    assert cache.stats()["hit_rate"] == 0.5
+
+    # other processes and later runs share the file
+    assert EvaluationCache(path).get(key) == {"fullfilled": 0.8}
+
+def test_evaluation_cache_key_hashes_json_strings_as_their_value():
+    inputs = {"question": "What is Domino?", "context": ["a", "b"]}
+    assert EvaluationCache.key("judge", inputs) == EvaluationCache.key("judge", json.dumps(inputs))
+    assert EvaluationCache.key("judge", inputs) != EvaluationCache.key("other judge", inputs)
+
+def test_evaluation_cache_evicts_least_recently_used(tmp_path, clock):
+    cache = EvaluationCache(str(tmp_path / "evaluations.sqlite"), max_entries=10)
+    for i in range(10):
+        cache.put(str(i), i)
+    # 0 is read, so 1 is now the least recently used
+    assert cache.get("0") == 0
+    cache.put("10", 10)
+
+    # eviction goes down to 90% of the limit
+    assert cache.stats()["entries"] == 9
+    assert cache.get("0") == 0
+    assert cache.get("1") is None
+    assert cache.get("2") is None
+    assert cache.get("10") == 10
+
+def test_evaluation_cache_evicts_by_size(tmp_path):
+    cache = EvaluationCache(str(tmp_path / "evaluations.sqlite"), max_bytes=1000)
+    for i in range(20):
+        cache.put(str(i), "x" * 98)
+    stats = cache.stats()
+    assert stats["bytes"] <= 1000
+    assert stats["evictions"] > 0
+
+def test_cached_evaluation_calls_the_judge_once(tmp_path, monkeypatch):
+    monkeypatch.setenv("DOMINO_EVAL_CACHE_PATH", str(tmp_path / "evaluations.sqlite"))
+    monkeypatch.setattr(evaluation_cache, "_cache", None)
+    calls = []
+
+    @cached_evaluation(judge_model=lambda: "gpt-4o-mini", prompt="is the answer fullfilled?")
+    def judge(question, answer):
+        calls.append((question, answer))
+        return {"fullfilled": 1.0}
+
+    assert judge("q", "a") == {"fullfilled": 1.0}
+    assert judge("q", "a") == {"fullfilled": 1.0}
+    assert judge("q", "another answer") == {"fullfilled": 1.0}
+    assert calls == [("q", "a"), ("q", "another answer")]
+
+# response cache
+
+def test_response_cache_hits_similar_questions_with_the_same_context():
+    cache = SemanticResponseCache(embed=None, similarity_threshold=0.95)
+    question = _unit(1)
+    cache.put(question, "context", "answer")
+
+    similar = question + 0.01 * _unit(2)
+    similar /= np.linalg.norm(similar)
+    (response, similarity) = cache.get(similar, "context")
+    assert response == "answer"
+    assert similarity >= 0.95
+
+    # a different question or a change to the knowledge base is a miss
+    assert cache.get(_unit(3), "context") is None
+    assert cache.get(question, "new context") is None
+    assert cache.stats()["hits"] == 1
+
+def test_response_cache_returns_the_most_similar_entry():
+    cache = SemanticResponseCache(embed=None, similarity_threshold=0.5)
+    question = _unit(1)
+    near = question + 0.1 * _unit(2)
+    far = question + 0.6 * _unit(3)
+    cache.put(far / np.linalg.norm(far), "context", "far")
+    cache.put(near / np.linalg.norm(near), "context", "near")
+
+    assert cache.get(question, "context")[0] == "near"
+
+def test_response_cache_evicts_least_recently_used_and_reuses_slots():
+    cache = SemanticResponseCache(embed=None, max_entries=20)
+    for i in range(20):
+        cache.put(_unit(i), "context", str(i))
+    assert cache.get(_unit(0), "context")[0] == "0"
+
+    for i in range(20, 40):
+        cache.put(_unit(i), "context", str(i))
+    stats = cache.stats()
+    assert stats["entries"] == 20
+    assert stats["evictions"] == 20
+    # the matrix never grew past max_entries, evicted entries' rows were reused
+    assert cache._matrix.shape[0] == 20
+    assert cache.get(_unit(0), "context") is None
+    assert all(cache.get(_unit(i), "context")[0] == str(i) for i in range(20, 40))
+
+def test_response_cache_entries_expire(clock):
+    cache = SemanticResponseCache(embed=None, ttl_s=60)
+    cache.put(_unit(1), "context", "answer")
+    clock.advance(30)
+    assert cache.get(_unit(1), "context") is not None
+    clock.advance(31)
+    assert cache.get(_unit(1), "context") is None
+    assert cache.stats()["entries"] == 0
+
+    # the expired entry's slot is reused
+    cache.put(_unit(2), "context", "another answer")
+    assert len(cache._slot_ids) == 1
+
+# retrieval cache
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls: list[list[str]] = []
+
+    def __call__(self, texts: list[str]) -> list[np.ndarray]:
+        self.calls.append(list(texts))
+        return [_unit(sum(map(ord, t))) for t in texts]
+
+def test_retrieval_cache_embeds_each_text_once():
+    embed = CountingEmbedder()
+    cache = RetrievalCache(embed)
+
+    first = cache.embed(["a", "b", "a"])
+    second = cache.embed(["b", "c"])
+
+    assert embed.calls == [["a", "b"], ["c"]]
+    assert np.array_equal(first[0], first[2])
+    assert np.array_equal(first[1], second[0])
+    stats = cache.stats()
+    assert stats["embedding_misses"] == 3
+    assert stats["embedding_hits"] == 2
+
+def test_retrieval_cache_results_are_keyed_by_collection_version():
+    cache = RetrievalCache(CountingEmbedder())
+    (embedding,) = cache.embed(["what is domino?"])
+    cache.put_documents(embedding, 5, version=1, documents=["doc"])
+
+    assert cache.get_documents(embedding, 5, version=1) == ["doc"]
+    assert cache.get_documents(embedding, 3, version=1) is None
+    # the collection was written to
+    assert cache.get_documents(embedding, 5, version=2) is None
+    assert cache.lookup("what is domino?", 5, version=1) == ["doc"]
+    assert cache.lookup("never embedded", 5, version=1) is None
+
+def test_retrieval_cache_results_expire_and_are_evicted(clock):
+    cache = RetrievalCache(CountingEmbedder(), max_results=2, ttl_s=60)
+    embeddings = cache.embed(["a", "b", "c"])
+    for (i, e) in enumerate(embeddings[:2]):
+        cache.put_documents(e, 5, 1, [str(i)])
+
+    clock.advance(61)
+    assert cache.get_documents(embeddings[0], 5, 1) is None
+
+    for (i, e) in enumerate(embeddings):
+        cache.put_documents(e, 5, 1, [str(i)])
+    assert cache.get_documents(embeddings[0], 5, 1) is None
+    assert cache.get_documents(embeddings[2], 5, 1) == ["2"]
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,99 @@
+import json
+import dataclasses
+import datetime
+import numpy as np
+import pydantic
+import pytest
+import domino_json
+from domino_json import dumps, json_encoders, register_json_encoder, set_json_encoder
+
+class Message(pydantic.BaseModel):
+    role: str
+    content: str
+    embedding: list[float]
+
+@dataclasses.dataclass
+class Score:
+    name: str
+    value: float
+
+class Opaque:
+    def __str__(self):
+        return "opaque"
+
+PAYLOAD = {
+    "text": "héllo",
+    "int": 3,
+    "float": 0.1,
+    "nested": {"list": [1, "two", None, True]},
+    "float32": np.float32(0.9),
+    "float16": np.float16(0.5),
+    "array": np.array([0.1, 0.2], dtype=np.float32),
+    "int_array": np.arange(3),
+    "matrix": np.eye(2),
+    "message": Message(role="user", content="hi", embedding=[0.25]),
+    "score": Score("fullfilled", 0.75),
+    "set": {1},
+    "date": datetime.date(2025, 1, 2),
+    "nan": float("nan"),
+    "infinities": [float("inf"), float("-inf")],
+    "numpy_nan": np.float64("nan"),
+    "other": Opaque(),
+}
+
+@pytest.fixture(params=["stdlib", "orjson"])
+def encoder(request):
+    if request.param not in json_encoders():
+        pytest.skip(f"{request.param} is not installed")
+    previous = domino_json._encoder, domino_json._encoder_name
+    set_json_encoder(request.param)
+    yield request.param
+    domino_json._encoder, domino_json._encoder_name = previous
+
+def test_encoders_write_the_same_values(encoder):
+    encoded = json.loads(dumps(PAYLOAD))
+
+    assert encoded == {
+        "text": "héllo",
+        "int": 3,
+        "float": 0.1,
+        "nested": {"list": [1, "two", None, True]},
+        "float32": 0.9,
+        "float16": 0.5,
+        "array": [0.1, 0.2],
+        "int_array": [0, 1, 2],
+        "matrix": [[1.0, 0.0], [0.0, 1.0]],
+        "message": {"role": "user", "content": "hi", "embedding": [0.25]},
+        "score": {"name": "fullfilled", "value": 0.75},
+        "set": [1],
+        "date": "2025-01-02",
+        "nan": None,
+        "infinities": [None, None],
+        "numpy_nan": None,
+        "other": "opaque",
+    }
+
+def test_output_is_compact_and_keeps_unicode(encoder):
+    assert dumps({"a": [1, 2], "b": "é"}) == '{"a":[1,2],"b":"é"}'
+
+def test_float32_is_written_as_its_shortest_decimal(encoder):
+    assert dumps(np.float32(0.9)) == "0.9"
+    assert dumps([np.float32(0.1)]) == "[0.1]"
+
+def test_big_integers(encoder):
+    # orjson only writes 64 bit integers and falls back to the standard library
+    assert dumps({"big": 2 ** 70}) == '{"big":1180591620717411303424}'
+
+def test_unknown_encoder():
+    with pytest.raises(Exception, match="json encoder must be auto or one of"):
+        set_json_encoder("simdjson")
+
+def test_registered_encoder(monkeypatch):
+    monkeypatch.setattr(domino_json, "_ENCODERS", dict(domino_json._ENCODERS))
+    previous = domino_json._encoder, domino_json._encoder_name
+    try:
+        register_json_encoder("upper", lambda: lambda value: json.dumps(value).upper())
+        assert set_json_encoder("upper") == "upper"
+        assert dumps({"a": "b"}) == '{"A": "B"}'
+    finally:
+        domino_json._encoder, domino_json._encoder_name = previous
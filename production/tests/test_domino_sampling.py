@@ -0,0 +1,84 @@
+import logging
+import httpx
+import mlflow
+import pytest
+from mlflow.tracing.trace_manager import InMemoryTraceManager
+from domino_autolog import enable_autolog
+from domino_eval_trace import start_domino_trace
+from domino_sampling import DominoSamplingPolicy, configure_sampling
+
+"""
+Checks that calls sampled out in production create no spans, also not the spans that autologging starts inside of
+them, and log nothing above DEBUG. The LLM provider is replaced by a canned response.
+"""
+
+FRAMEWORKS = ["openai", "langchain"]
+
+@pytest.fixture(scope="module", autouse=True)
+def autologging():
+    enable_autolog(FRAMEWORKS, mode="allow_list")
+    yield
+    for fw in FRAMEWORKS:
+        getattr(mlflow, fw).autolog(disable=True)
+
+@pytest.fixture
+def answer(tracking_uri, llm_http_client, monkeypatch):
+    from openai import OpenAI
+    from langchain_openai import ChatOpenAI
+
+    monkeypatch.setenv("DOMINO_EVALUATION_LOGGING_IS_PROD", "true")
+    monkeypatch.setenv("DOMINO_TRACE_SPOOL_DISABLED", "true")
+    mlflow.set_experiment("domino_sampling_test")
+
+    settings = {"api_key": "test", "base_url": "http://llm.invalid/v1", "http_client": llm_http_client}
+    openai_client = OpenAI(**settings)
+    llm = ChatOpenAI(model="gpt-4o-mini", **settings)
+
+    @start_domino_trace("rag_response")
+    def answer(question: str) -> str:
+        openai_client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": question}])
+        # langchain calls openai, so this is a span nested in an autologged span
+        return llm.invoke(question).content
+
+    yield answer
+    configure_sampling(None)
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+def _trace_count() -> int:
+    return len(mlflow.search_traces(return_type="list", max_results=1000))
+
+def test_sampled_out_calls_create_no_spans(answer):
+    configure_sampling(DominoSamplingPolicy(rate=0.0, keep_errors=False))
+    handler = _Records()
+    loggers = [logging.getLogger(), logging.getLogger("mlflow")]
+    for logger in loggers:
+        logger.addHandler(handler)
+    try:
+        for _ in range(5):
+            assert answer("What is Domino?") == "Domino is an enterprise AI platform."
+    finally:
+        for logger in loggers:
+            logger.removeHandler(handler)
+
+    assert _trace_count() == 0
+    assert len(InMemoryTraceManager.get_instance()._traces) == 0
+    logged = [f"{r.levelname} {r.name}: {r.getMessage()}" for r in handler.records if r.levelno > logging.DEBUG]
+    assert logged == []
+
+def test_kept_calls_have_autologged_spans(answer):
+    configure_sampling(DominoSamplingPolicy(rate=1.0))
+    answer("What is Domino?")
+
+    trace = mlflow.get_trace(mlflow.get_last_active_trace_id())
+    names = [span.name for span in trace.data.spans]
+    assert names[0] == "rag_response"
+    assert "ChatOpenAI" in names
+    assert len([n for n in names if n.startswith("Completions")]) == 2
+    assert trace.info.tags["domino.internal.sampling_rate"] == "1.0"
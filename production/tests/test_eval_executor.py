@@ -0,0 +1,94 @@
+import threading
+import pytest
+from domino_eval_executor import DominoEvaluationExecutor
+
+"""
+The evaluation executor's backpressure policies. Every test fills the queue behind a worker that is held inside
+an evaluation, so the queue's length is known when the next evaluation is submitted.
+"""
+
+@pytest.fixture
+def held_worker():
+    """An evaluation that holds its worker until the test releases it"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(10)
+
+    yield hold, started, release
+    release.set()
+
+def _hold_worker(executor: DominoEvaluationExecutor, held_worker):
+    hold, started, _ = held_worker
+    assert executor.submit(hold)
+    assert started.wait(5)
+
+def test_drop_discards_evaluations_when_the_queue_is_full(held_worker):
+    executor = DominoEvaluationExecutor(max_workers=1, max_queue_size=2, backpressure="drop")
+    _hold_worker(executor, held_worker)
+    ran = []
+
+    assert executor.submit(ran.append, 1)
+    assert executor.submit(ran.append, 2)
+    assert not executor.submit(ran.append, 3)
+
+    held_worker[2].set()
+    assert executor.flush(timeout=5)
+    assert ran == [1, 2]
+    stats = executor.stats()
+    assert stats["dropped"] == 1
+    assert stats["submitted"] == 3
+    assert stats["completed"] == 3
+    assert stats["pending"] == 0
+
+def test_block_waits_for_room_in_the_queue(held_worker):
+    executor = DominoEvaluationExecutor(max_workers=1, max_queue_size=1, backpressure="block")
+    _hold_worker(executor, held_worker)
+    ran = []
+    assert executor.submit(ran.append, 1)
+
+    submitted = []
+    submitter = threading.Thread(target=lambda: submitted.append(executor.submit(ran.append, 2)))
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive()
+
+    held_worker[2].set()
+    submitter.join(5)
+    assert submitted == [True]
+    assert executor.flush(timeout=5)
+    assert ran == [1, 2]
+    assert executor.stats()["dropped"] == 0
+
+@pytest.mark.parametrize(("sample_rate", "accepted"), [(0.0, 2), (1.0, 4)])
+def test_sample_keeps_a_fraction_once_the_queue_is_half_full(held_worker, sample_rate, accepted):
+    executor = DominoEvaluationExecutor(max_workers=1, max_queue_size=4, backpressure="sample", sample_rate=sample_rate)
+    _hold_worker(executor, held_worker)
+
+    # the first half of the queue is always accepted, after that a sample_rate fraction until the queue is full
+    results = [executor.submit(lambda: None) for _ in range(6)]
+
+    assert sum(results) == accepted
+    assert results[:2] == [True, True]
+    assert executor.stats()["dropped"] == 6 - accepted
+    held_worker[2].set()
+    assert executor.flush(timeout=5)
+
+def test_failed_evaluations_are_counted():
+    executor = DominoEvaluationExecutor(max_workers=2)
+
+    def fail():
+        raise Exception("judge unavailable")
+
+    assert executor.submit(fail)
+    assert executor.submit(lambda: None)
+    assert executor.flush(timeout=5)
+    stats = executor.stats()
+    assert stats["failed"] == 1
+    assert stats["completed"] == 1
+
+def test_unknown_backpressure_policy():
+    with pytest.raises(Exception, match="backpressure must be one of"):
+        DominoEvaluationExecutor(backpressure="queue")
@@ -0,0 +1,79 @@
+import os
+import json
+import re
+from types import SimpleNamespace
+import pytest
+import build_production_evaluation_dataset as extraction
+from build_production_evaluation_dataset import (
+    CHECKPOINT_FILE_NAME,
+    ExtractionCheckpoint,
+    read_checkpoint,
+    read_dataset_file,
+    write_checkpoint,
+)
+
+def _trace(trace_id: str, timestamp_ms: int):
+    span = SimpleNamespace(name="rag_response", inputs={"question": trace_id}, outputs=f"answer {trace_id}")
+    return SimpleNamespace(
+        info=SimpleNamespace(trace_id=trace_id, timestamp_ms=timestamp_ms, tags={"domino.evaluation_result.fullfilled": "1.0"}),
+        search_spans=lambda name: [span],
+    )
+
+class FakeTraceStore:
+    """Serves the traces that iter_traces would find with the extraction's timestamp filter"""
+    def __init__(self):
+        self.traces = []
+
+    def iter_traces(self, experiment_ids, filter_string, page_size, order_by):
+        start = int(re.search(r"attributes.timestamp >= (\d+)", filter_string).group(1))
+        return iter(sorted((t for t in self.traces if t.info.timestamp_ms >= start), key=lambda t: t.info.timestamp_ms))
+
+@pytest.fixture
+def store(monkeypatch) -> FakeTraceStore:
+    store = FakeTraceStore()
+    monkeypatch.setattr(extraction, "iter_traces", store.iter_traces)
+    monkeypatch.setenv("DOMINO_EVAL_DATASET_FORMAT", "csv")
+    monkeypatch.setenv("DOMINO_EVAL_EXTRACT_START_TS", "1970-01-01 00:00:00+00:00")
+    return store
+
+def _extracted_ids(dataset_path: str, partition: int) -> list[str]:
+    df = read_dataset_file(os.path.join(dataset_path, f"{partition}.csv"))
+    return [json.loads(outputs).removeprefix("answer ") for outputs in df["outputs"]]
+
+def test_checkpoint_round_trip(tmp_path):
+    assert read_checkpoint(str(tmp_path)) is None
+
+    write_checkpoint(str(tmp_path), ExtractionCheckpoint(1000, ["a", "b"]))
+    write_checkpoint(str(tmp_path), ExtractionCheckpoint(2000, ["c"]))
+
+    checkpoint = read_checkpoint(str(tmp_path))
+    assert checkpoint.last_timestamp_ms == 2000
+    assert checkpoint.boundary_trace_ids == ["c"]
+    # the checkpoint is replaced atomically, no temporary file is left behind
+    assert os.listdir(tmp_path) == [CHECKPOINT_FILE_NAME]
+
+def test_boundary_traces_are_extracted_once(tmp_path, store):
+    dataset_path = str(tmp_path)
+    store.traces = [_trace("a", 100), _trace("b", 200), _trace("c", 200)]
+
+    extraction._extract_partition("0", dataset_path, page_size=10, row_group_size=10)
+    checkpoint = read_checkpoint(dataset_path)
+    assert (checkpoint.last_timestamp_ms, checkpoint.boundary_trace_ids) == (200, ["b", "c"])
+    assert _extracted_ids(dataset_path, 0) == ["a", "b", "c"]
+
+    # d has the boundary's timestamp but was logged after the first run
+    store.traces += [_trace("d", 200), _trace("e", 300)]
+    extraction._extract_partition("0", dataset_path, page_size=10, row_group_size=10)
+    checkpoint = read_checkpoint(dataset_path)
+    assert (checkpoint.last_timestamp_ms, checkpoint.boundary_trace_ids) == (300, ["e"])
+    assert _extracted_ids(dataset_path, 200) == ["d", "e"]
+
+def test_a_run_without_new_traces_writes_no_partition(tmp_path, store):
+    dataset_path = str(tmp_path)
+    store.traces = [_trace("a", 100)]
+    extraction._extract_partition("0", dataset_path, page_size=10, row_group_size=10)
+    extraction._extract_partition("0", dataset_path, page_size=10, row_group_size=10)
+
+    assert sorted(os.listdir(dataset_path)) == ["0.csv", CHECKPOINT_FILE_NAME]
+    checkpoint = read_checkpoint(dataset_path)
+    assert (checkpoint.last_timestamp_ms, checkpoint.boundary_trace_ids) == (100, ["a"])
@@ -0,0 +1,75 @@
+import json
+import numpy as np
+import pytest
+from domino_summary_metrics import BucketAggregate, QuantileSketch
+
+QUANTILES = [0.0, 0.01, 0.25, 0.5, 0.9, 0.95, 0.99, 1.0]
+
+def _exact(values: np.ndarray, q: float) -> float:
+    # the value at the rank the sketch reports, rather than an interpolation between two values
+    return float(np.sort(values)[int(q * (len(values) - 1))])
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_quantiles_are_within_the_relative_accuracy(relative_accuracy):
+    values = np.random.default_rng(0).lognormal(mean=0, sigma=2, size=10000)
+    sketch = QuantileSketch(relative_accuracy)
+    for v in values:
+        sketch.add(float(v))
+
+    for q in QUANTILES:
+        assert sketch.quantile(q) == pytest.approx(_exact(values, q), rel=relative_accuracy)
+
+def test_negative_and_zero_values():
+    values = np.concatenate([-np.arange(1, 101), np.zeros(50), np.arange(1, 101)]).astype(float)
+    sketch = QuantileSketch()
+    for v in values:
+        sketch.add(float(v))
+
+    assert sketch.quantile(0.0) == pytest.approx(-100, rel=0.01)
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(100, rel=0.01)
+    assert sketch.count == len(values)
+
+def test_empty_sketch():
+    assert QuantileSketch().quantile(0.5) is None
+
+def test_weights_count_like_repeated_values():
+    weighted, repeated = QuantileSketch(), QuantileSketch()
+    for (value, weight) in [(1.0, 1), (10.0, 10), (100.0, 1)]:
+        weighted.add(value, weight=weight)
+        for _ in range(weight):
+            repeated.add(value)
+
+    for q in QUANTILES:
+        assert weighted.quantile(q) == repeated.quantile(q)
+    assert weighted.quantile(0.5) == pytest.approx(10.0, rel=0.01)
+
+def test_a_saved_sketch_keeps_adding():
+    values = np.random.default_rng(1).exponential(size=2000)
+    whole, saved = QuantileSketch(), QuantileSketch()
+    for v in values[:1000]:
+        whole.add(float(v))
+        saved.add(float(v))
+
+    # the state file is JSON, which turns the bucket indexes into strings
+    saved = QuantileSketch.from_dict(json.loads(json.dumps(saved.to_dict())))
+    for v in values[1000:]:
+        whole.add(float(v))
+        saved.add(float(v))
+
+    assert saved.to_dict() == whole.to_dict()
+
+def test_bucket_aggregate():
+    bucket = BucketAggregate()
+    for (value, weight) in [(0.5, 2.0), (1.0, 2.0), (0.0, 4.0)]:
+        bucket.add(value, weight)
+
+    bucket = BucketAggregate.from_dict(json.loads(json.dumps(bucket.to_dict())))
+    assert bucket.value("count") == 8.0
+    assert bucket.value("sum") == 3.0
+    assert bucket.value("mean") == 0.375
+    assert (bucket.value("min"), bucket.value("max")) == (0.0, 1.0)
+    assert bucket.value("p50") == 0.0
+    assert bucket.value("p90") == pytest.approx(1.0, rel=0.01)
+    with pytest.raises(Exception, match="Unsupported summary aggregation"):
+        bucket.value("median")
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import pytest
+from rag import RetrievalBatcher
+
+class FakeCollection:
+    """Answers a batch of questions with one document each and records the batches. When held, a query waits
+    until the test releases it, so that the next questions queue up behind it
+    """
+    def __init__(self):
+        self.batches: list[list[str]] = []
+        self.fail = False
+        self.querying = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def query(self, questions: list[str]) -> list[str]:
+        self.batches.append(list(questions))
+        self.querying.set()
+        assert self.release.wait(10)
+        if self.fail:
+            raise Exception("chroma unavailable")
+        return [f"documents for {q}" for q in questions]
+
+    def hold(self):
+        self.querying.clear()
+        self.release.clear()
+
+@pytest.fixture
+def collection():
+    collection = FakeCollection()
+    yield collection
+    collection.release.set()
+
+def test_concurrent_questions_share_a_query(collection):
+    batcher = RetrievalBatcher(collection.query, max_batch_size=4, max_wait_ms=1000)
+
+    futures = [batcher.submit(f"q{i}") for i in range(4)]
+
+    assert [f.result(5) for f in futures] == [f"documents for q{i}" for i in range(4)]
+    # the batch was sent as soon as it was full, not after max_wait_ms
+    assert collection.batches == [["q0", "q1", "q2", "q3"]]
+    stats = batcher.stats()
+    assert stats["batches"] == 1
+    assert stats["batch_size_histogram"] == {4: 1}
+
+def test_a_batch_is_sent_after_max_wait(collection):
+    batcher = RetrievalBatcher(collection.query, max_batch_size=32, max_wait_ms=20)
+
+    assert batcher.query("alone") == "documents for alone"
+    assert collection.batches == [["alone"]]
+
+def test_questions_queue_up_while_a_batch_is_queried(collection):
+    batcher = RetrievalBatcher(collection.query, max_batch_size=32, max_wait_ms=1)
+    collection.hold()
+    first = batcher.submit("first")
+    assert collection.querying.wait(5)
+
+    waiting = [batcher.submit(f"q{i}") for i in range(5)]
+    collection.release.set()
+
+    assert first.result(5) == "documents for first"
+    assert [f.result(5) for f in waiting] == [f"documents for q{i}" for i in range(5)]
+    assert collection.batches == [["first"], [f"q{i}" for i in range(5)]]
+    assert batcher.stats()["mean_batch_size"] == 3
+
+def test_cancelled_questions_are_not_queried(collection):
+    batcher = RetrievalBatcher(collection.query, max_batch_size=32, max_wait_ms=1)
+    collection.hold()
+    batcher.submit("first")
+    assert collection.querying.wait(5)
+
+    cancelled = batcher.submit("given up")
+    kept = batcher.submit("kept")
+    assert cancelled.cancel()
+    collection.release.set()
+
+    assert kept.result(5) == "documents for kept"
+    assert collection.batches[1] == ["kept"]
+
+def test_a_failed_query_fails_every_question_of_the_batch(collection):
+    batcher = RetrievalBatcher(collection.query, max_batch_size=2, max_wait_ms=1000)
+    collection.fail = True
+
+    futures = [batcher.submit("a"), batcher.submit("b")]
+
+    for future in futures:
+        with pytest.raises(Exception, match="chroma unavailable"):
+            future.result(5)
+    assert batcher.stats()["failed_batches"] == 1
+
+    # the worker keeps going after a failure
+    collection.fail = False
+    assert batcher.query("c") == "documents for c"
+
+def test_query_async(collection):
+    batcher = RetrievalBatcher(collection.query, max_batch_size=3, max_wait_ms=1000)
+
+    async def ask():
+        return await asyncio.gather(*[batcher.query_async(q) for q in ["a", "b", "c"]])
+
+    assert asyncio.run(ask()) == ["documents for a", "documents for b", "documents for c"]
+    assert collection.batches == [["a", "b", "c"]]
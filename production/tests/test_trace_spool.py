@@ -0,0 +1,143 @@
+import threading
+import pytest
+from domino_trace_spool import TRACE_EXPORT_KEY, TraceWriteSpool
+
+"""
+The spool's delivery guarantees: a trace's writes are sent in the order they were spooled with the export first,
+failed writes are retried without the trace's later writes overtaking them, and a tag write that fails because its
+trace hasn't been exported yet waits for the export instead of using up its attempts.
+"""
+
+class FakeTrackingServer:
+    """Records the writes the spool sends. A tag write fails like the tracking server's foreign key does when its
+    trace wasn't exported yet, and fail_times makes a write fail that many times before it succeeds
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.exported: set[str] = set()
+        self.writes: list[tuple[str, str, str]] = []
+        self.fail_times: dict[tuple[str, str], int] = {}
+        self.before_write = None
+
+    def write(self, trace_id: str, key: str, value: str):
+        if self.before_write:
+            self.before_write(trace_id, key)
+        with self.lock:
+            remaining = self.fail_times.get((trace_id, key), 0)
+            if remaining:
+                self.fail_times[(trace_id, key)] = remaining - 1
+                raise Exception("tracking server unavailable")
+            if key == TRACE_EXPORT_KEY:
+                self.exported.add(trace_id)
+            elif trace_id not in self.exported:
+                raise Exception("FOREIGN KEY constraint failed")
+            self.writes.append((trace_id, key, value))
+
+    def keys(self, trace_id: str) -> list[str]:
+        return [k for (t, k, _) in self.writes if t == trace_id]
+
+@pytest.fixture
+def server() -> FakeTrackingServer:
+    return FakeTrackingServer()
+
+@pytest.fixture
+def make_spool(tmp_path, server):
+    def make(**kwargs) -> TraceWriteSpool:
+        kwargs.setdefault("base_backoff_s", 0.01)
+        kwargs.setdefault("max_backoff_s", 0.05)
+        return TraceWriteSpool(str(tmp_path / "spool.sqlite"), write=server.write, **kwargs)
+    return make
+
+def test_writes_of_a_trace_are_sent_in_order(make_spool, server):
+    spool = make_spool(batch_size=3)
+    for t in ["a", "b", "c"]:
+        spool.enqueue(t, {TRACE_EXPORT_KEY: "{}"})
+    for i in range(5):
+        for t in ["a", "b", "c"]:
+            spool.enqueue(t, {f"tag{i}": str(i)})
+
+    assert spool.flush(timeout=10)
+    for t in ["a", "b", "c"]:
+        assert server.keys(t) == [TRACE_EXPORT_KEY, *[f"tag{i}" for i in range(5)]]
+    stats = spool.stats()
+    assert stats["exported"] == 18
+    assert stats["depth"] == 0
+
+def test_export_goes_before_tags_spooled_earlier(make_spool, server):
+    spool = make_spool()
+    spool.enqueue("a", {"evaluation": "1", TRACE_EXPORT_KEY: "{}"})
+
+    assert spool.flush(timeout=10)
+    assert server.keys("a") == [TRACE_EXPORT_KEY, "evaluation"]
+    assert spool.stats()["retries"] == 0
+
+def test_failed_write_is_retried_before_the_later_writes(make_spool, server):
+    spool = make_spool()
+    server.fail_times[("a", "first")] = 2
+    spool.enqueue("a", {TRACE_EXPORT_KEY: "{}", "first": "1", "second": "2"})
+
+    assert spool.flush(timeout=10)
+    assert server.keys("a") == [TRACE_EXPORT_KEY, "first", "second"]
+    assert spool.stats()["retries"] == 2
+
+def test_tags_wait_for_a_retried_export(make_spool, server):
+    spool = make_spool(base_backoff_s=0.2, max_backoff_s=0.2)
+    server.fail_times[("a", TRACE_EXPORT_KEY)] = 1
+    spool.enqueue("a", {TRACE_EXPORT_KEY: "{}"})
+    spool.enqueue("a", {"evaluation": "1"})
+
+    assert spool.flush(timeout=10)
+    assert server.keys("a") == [TRACE_EXPORT_KEY, "evaluation"]
+    stats = spool.stats()
+    assert stats["retries"] == 1
+    assert stats["dropped"] == 0
+
+def test_tag_spooled_before_its_export_is_requeued(make_spool, server):
+    spool = make_spool(max_attempts=1)
+    spooled_export = threading.Event()
+
+    def export_arrives(trace_id: str, key: str):
+        # the trace is spooled by the exporter while its tag write is being sent
+        if key != TRACE_EXPORT_KEY and not spooled_export.is_set():
+            spooled_export.set()
+            spool.enqueue(trace_id, {TRACE_EXPORT_KEY: "{}"})
+    server.before_write = export_arrives
+    spool.enqueue("a", {"evaluation": "1"})
+
+    assert spool.flush(timeout=10)
+    # with a single attempt, the tag would have been dropped if the failure had counted
+    assert server.keys("a") == [TRACE_EXPORT_KEY, "evaluation"]
+    stats = spool.stats()
+    assert stats["requeued"] == 1
+    assert stats["dropped"] == 0
+
+def test_write_is_dropped_after_max_attempts(make_spool, server):
+    spool = make_spool(max_attempts=3)
+    server.fail_times[("a", "broken")] = 100
+    spool.enqueue("a", {TRACE_EXPORT_KEY: "{}", "broken": "1", "after": "2"})
+
+    assert spool.flush(timeout=10)
+    assert server.keys("a") == [TRACE_EXPORT_KEY, "after"]
+    stats = spool.stats()
+    assert stats["dropped"] == 1
+    assert stats["retries"] == 2
+    assert stats["depth"] == 0
+
+def test_writes_survive_a_restart(tmp_path, server):
+    path = str(tmp_path / "spool.sqlite")
+    crashed = threading.Event()
+
+    def hang(trace_id: str, key: str, value: str):
+        # the process dies while sending, so the write is never confirmed
+        crashed.wait()
+        raise Exception("the process exited")
+
+    first = TraceWriteSpool(path, write=hang, lease_s=0.2)
+    first.enqueue("a", {TRACE_EXPORT_KEY: "{}", "evaluation": "1"})
+    try:
+        # a new process on the same file sends the writes once the first one's lease has run out
+        second = TraceWriteSpool(path, write=server.write, lease_s=0.2)
+        assert second.flush(timeout=10)
+        assert server.keys("a") == [TRACE_EXPORT_KEY, "evaluation"]
+    finally:
+        crashed.set()
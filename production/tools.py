@@ -1,10 +1,19 @@
-from random import random, randint
-from openai import OpenAI
+import os
+import time
+import logging
+import functools
+import threading
+import contextvars
 import mlflow
+from random import random, randint
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Any, Optional
+from mlflow.entities import SpanType, LiveSpan
+from mlflow.tracing.provider import set_span_in_context, detach_span_from_context
 from langchain_core.tools import tool
+from http_clients import get_openai_client
 
-client = OpenAI()
-mlflow.openai.autolog()
+# autologging is turned on by init_domino_tracing, or enable_autolog in scripts that don't call it, for the frameworks the application uses
 
 @tool
 def add(a: int, b: int) -> int:
@@ -38,6 +47,12 @@ def ask_chat_bot_assistant(question: str) -> str:
         {"role": "user", "content": question}
     ]
 
+    # inside of a tool call, the request gives up when the call times out instead of holding the tool's worker thread.
+    # Called directly, it keeps the client's timeout and retries
+    client = get_openai_client()
+    time_left_s = tool_time_left_s()
+    if time_left_s is not None:
+        client = client.with_options(timeout=time_left_s, max_retries=0)
     response = client.chat.completions.create(model="gpt-4o-mini", messages=messages)
     content = response.choices[0].message.content
 
@@ -52,3 +67,147 @@ tools_table = {
     "multiply": multiply,
     "ask_chat_bot_assistant": ask_chat_bot_assistant
 }
+
+# tools that are slower than DOMINO_TOOL_TIMEOUT_S need their own timeout
+TOOL_TIMEOUTS_S = {
+    "ask_chat_bot_assistant": 60.0,
+}
+
+UNKNOWN_TOOL_RESULT = "I couldn't help with that"
+
+# the time.monotonic() by which the tool call that is running on this thread has to finish
+_tool_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("domino_tool_deadline", default=None)
+
+def _tool_timeout_s(name: str) -> float:
+    return TOOL_TIMEOUTS_S.get(name, float(os.getenv("DOMINO_TOOL_TIMEOUT_S", "30")))
+
+def tool_time_left_s(default: Optional[float] = None) -> Optional[float]:
+    """Returns the seconds left before the running tool call times out, or default outside of a tool call.
+    A Python thread can't be stopped, so tools should pass this down as the timeout of their blocking calls
+    """
+    deadline = _tool_deadline.get()
+    if deadline is None:
+        return default
+    return max(deadline - time.monotonic(), 0.001)
+
+class _ToolPool:
+    """The worker threads of the tool calls. A tool that times out keeps running on its thread, so when half
+    of the workers are stuck in such tools, the pool is replaced and the stuck threads are left to finish
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._stuck = 0
+
+    def _new_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="domino-tool")
+
+    def submit(self, fn, *args) -> tuple[Future, ThreadPoolExecutor]:
+        with self._lock:
+            executor = self._executor
+            return executor.submit(fn, *args), executor
+
+    def stuck(self, future: Future, executor: ThreadPoolExecutor, name: str):
+        """Records that a tool that timed out is still running on one of the executor's threads"""
+        with self._lock:
+            if executor is self._executor:
+                self._stuck += 1
+                if self._stuck >= max(1, self.workers // 2):
+                    logging.warning(f"{self._stuck} of {self.workers} tool workers are stuck in tools that timed out, "
+                                    "starting new workers")
+                    executor.shutdown(wait=False)
+                    self._executor = self._new_executor()
+                    self._stuck = 0
+        future.add_done_callback(lambda f: self._finished(executor, name))
+
+    def _finished(self, executor: ThreadPoolExecutor, name: str):
+        logging.warning(f"Tool {name} finished after it had timed out")
+        with self._lock:
+            if executor is self._executor:
+                self._stuck -= 1
+
+@functools.cache
+def _tool_pool() -> _ToolPool:
+    return _ToolPool(int(os.getenv("DOMINO_TOOL_WORKERS", "16")))
+
+class _ToolStart:
+    """Set by the worker thread when a tool call starts, with the deadline of the call"""
+    def __init__(self):
+        self.started = threading.Event()
+        self.deadline: Optional[float] = None
+
+    def set(self, timeout_s: float) -> float:
+        self.deadline = time.monotonic() + timeout_s
+        self.started.set()
+        return self.deadline
+
+def _invoke_tool(tool_call: dict, span: Optional[LiveSpan], start: _ToolStart) -> Any:
+    _tool_deadline.set(start.set(_tool_timeout_s(tool_call["name"])))
+    # make the tool's span the active one on this thread, so that autologged spans inside the tool nest under it
+    token = set_span_in_context(span) if span else None
+    try:
+        selected_tool = tools_table.get(tool_call["name"], None)
+        if selected_tool is None:
+            return UNKNOWN_TOOL_RESULT
+        return selected_tool.invoke(tool_call["args"])
+    finally:
+        if token:
+            detach_span_from_context(token)
+
+def _wait_for_tool(future: Future, start: _ToolStart, timeout_s: float, submitted: float) -> Any:
+    # the timeout counts from when the tool starts, and a tool that doesn't get a worker within it times out as well
+    if not start.started.wait(max(submitted + timeout_s - time.monotonic(), 0)) and future.cancel():
+        raise TimeoutError()
+    start.started.wait()
+    return future.result(timeout=max(start.deadline - time.monotonic(), 0))
+
+def run_tool_calls(tool_calls: list[dict]) -> list[Any]:
+    """Runs the tool calls that a model requested concurrently and returns their results in the same order as
+    the calls. Each call gets its own child span of the active span and times out after its tool's timeout,
+    counted from when the tool starts, in which case its result is an error message. Tools can read the time
+    they have left with tool_time_left_s.
+
+    Args:
+        tool_calls: the tool calls of a model response, dictionaries with a name and args
+    """
+    parent = mlflow.get_current_active_span()
+    spans = [
+        mlflow.start_span_no_context(name=call["name"], span_type=SpanType.TOOL, parent_span=parent, inputs=call["args"])
+        if parent else None
+        for call in tool_calls
+    ]
+    # each tool runs in a copy of the caller's context, so the trace's context variables are visible to it
+    pool = _tool_pool()
+    starts = [_ToolStart() for _ in tool_calls]
+    submitted_at = time.monotonic()
+    submitted = [
+        pool.submit(contextvars.copy_context().run, _invoke_tool, call, span, start)
+        for (call, span, start) in zip(tool_calls, spans, starts)
+    ]
+
+    results = []
+    for (call, span, start, (future, executor)) in zip(tool_calls, spans, starts, submitted):
+        timeout_s = _tool_timeout_s(call["name"])
+        try:
+            result = _wait_for_tool(future, start, timeout_s, submitted_at)
+            if span:
+                span.end(outputs=result)
+        except TimeoutError:
+            if future.cancelled():
+                logging.warning(f"Tool {call['name']} didn't get a worker within its {timeout_s}s timeout")
+            else:
+                # the thread can't be stopped, the tool has to give up by itself, see tool_time_left_s
+                logging.warning(f"Tool {call['name']} timed out after {timeout_s}s and is still running")
+                pool.stuck(future, executor, call["name"])
+            result = f"The {call['name']} tool timed out"
+            if span:
+                span.end(outputs=result, status="ERROR")
+        except Exception as e:
+            logging.warning(f"Tool {call['name']} failed: {e}")
+            result = f"The {call['name']} tool failed"
+            if span:
+                span.record_exception(e)
+                span.end(outputs=result, status="ERROR")
+        results.append(result)
+    return results
@@ -1,50 +1,177 @@
 import mlflow
 from random import random, randint
 from mlflow.entities import SpanType
-from openai import OpenAI
 import os
-from langchain.chat_models import init_chat_model
-from tools import tools, tools_table
-from rag import query_docs
+import json
+import time
+import asyncio
+import functools
+from tools import tools, run_tool_calls
+from rag import query_docs, query_docs_async
 
-from domino.aisystems.tracing import add_tracing
-from domino.aisystems import read_ai_system_config
+from domino_eval_trace import start_domino_trace, set_domino_trace_tag
+from response_cache import get_response_cache
+from http_clients import get_http_client, get_async_http_client, get_openai_client, get_async_openai_client
+from domino_eval_trace import read_ai_system_config
+from ai_system_config import subscribe_ai_system_config
 import evaluators
 
-ai_system_config = read_ai_system_config("./production/ai_system_config.yaml")
+AI_SYSTEM_CONFIG_PATH = "./production/ai_system_config.yaml"
 
-client = OpenAI()
-llm = init_chat_model(
-    ai_system_config["llm"]["tool_model"],
-    model_provider="openai"
-)
-llm_with_tools = llm.bind_tools(tools, tool_choice="any")
+# the config and clients are created on first use, so that importing this module stays cheap
 
-@add_tracing(name="rag_response", evaluator=evaluators.question_fullfillment_evaluator)
+def get_ai_system_config() -> dict:
+    """the config is cached in memory and reloaded when the file changes, so it is cheap to read on every request"""
+    return read_ai_system_config(AI_SYSTEM_CONFIG_PATH)
+
+@functools.cache
+def _rebuild_llm_on_config_change():
+    subscribe_ai_system_config(AI_SYSTEM_CONFIG_PATH, lambda new, old: get_llm_with_tools.cache_clear())
+
+@functools.cache
+def get_llm_with_tools():
+    from langchain.chat_models import init_chat_model
+
+    _rebuild_llm_on_config_change()
+    llm = init_chat_model(
+        get_ai_system_config()["llm"]["tool_model"],
+        model_provider="openai",
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client()
+    )
+    return llm.bind_tools(tools, tool_choice="any")
+
+def _rag_messages(question: str, question_context: str) -> list[dict]:
+    system_content = f"Please answer the question. Here is some context that may be helpful in answering the question: {question_context}"
+    return [
+        {"role": "system", "content": system_content },
+        {"role": "user", "content": question }
+    ]
+
+def _cached_answer(response_cache, question: str, question_context: str):
+    """returns the cached answer, if there is one, and the question's embedding for caching a new answer"""
+    question_embedding = response_cache.embed(question)
+    cached = response_cache.get(question_embedding, question_context)
+    set_domino_trace_tag("domino.internal.response_cache_hit", json.dumps(cached is not None))
+    if cached:
+        answer, similarity = cached
+        set_domino_trace_tag("domino.internal.response_cache_similarity", json.dumps(similarity))
+        return answer, question_embedding
+    return None, question_embedding
+
+@start_domino_trace(name="rag_response", evaluator=evaluators.question_fullfillment_evaluator)
 def answer_question_with_context(question: str) -> str:
     """
         users asks questions and this function should be able to answer anything
         in a conversational way with good context.
     """
     question_context = query_docs(question)
-    system_content = f"Please answer the question. Here is some context that may be helpful in answering the question: {question_context}"
-    messages = [
-        {"role": "system", "content": system_content },
-        {"role": "user", "content": question }
-    ]
-    # openai autolog example
+
+    # near duplicate questions with the same context get the cached answer and skip the completion
+    response_cache = get_response_cache()
+    if response_cache:
+        answer, question_embedding = _cached_answer(response_cache, question, question_context)
+        if answer:
+            return answer
+
+    # openai autolog example, autologging is turned on by init_domino_tracing or enable_autolog
     # Inputs and outputs of the API request will be logged in a trace
-    response = client.chat.completions.create(model=ai_system_config["llm"]["chat_model"], messages=messages)
+    response = get_openai_client().chat.completions.create(model=get_ai_system_config()["llm"]["chat_model"], messages=_rag_messages(question, question_context))
+    content = response.choices[0].message.content
+
+    if content is None:
+        return "Sorry, I couldn't answer that question"
+
+    if response_cache:
+        response_cache.put(question_embedding, question_context, content)
+    return content
+
+@start_domino_trace(name="rag_response", evaluator=evaluators.question_fullfillment_evaluator)
+async def answer_question_with_context_async(question: str) -> str:
+    """
+        the async version of answer_question_with_context, which never blocks the event loop,
+        so that one server worker can answer many questions at once
+    """
+    question_context = await query_docs_async(question)
+
+    response_cache = get_response_cache()
+    if response_cache:
+        # embedding the question is cpu bound
+        answer, question_embedding = await asyncio.to_thread(_cached_answer, response_cache, question, question_context)
+        if answer:
+            return answer
+
+    response = await get_async_openai_client().chat.completions.create(model=get_ai_system_config()["llm"]["chat_model"], messages=_rag_messages(question, question_context))
+    content = response.choices[0].message.content
+
+    if content is None:
+        return "Sorry, I couldn't answer that question"
+
+    if response_cache:
+        response_cache.put(question_embedding, question_context, content)
+    return content
+
+@start_domino_trace(name="rag_response", evaluator=evaluators.question_fullfillment_evaluator, output_reducer="".join)
+async def stream_answer_question_with_context(question: str):
+    """
+        the streaming version of answer_question_with_context, which yields the answer as the model generates it.
+        The trace gets the assembled answer and is evaluated once the stream is done
+    """
+    started = time.monotonic()
+    question_context = await query_docs_async(question)
+
+    response_cache = get_response_cache()
+    if response_cache:
+        answer, question_embedding = await asyncio.to_thread(_cached_answer, response_cache, question, question_context)
+        if answer:
+            yield answer
+            return
+
+    stream = await get_async_openai_client().chat.completions.create(
+        model=get_ai_system_config()["llm"]["chat_model"],
+        messages=_rag_messages(question, question_context),
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    chunks = []
+    first_token_at = None
+    usage = None
+    # closes the response, and releases its connection, when the client disconnects or the generator is closed early
+    async with stream:
+        async for chunk in stream:
+            usage = chunk.usage or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+                set_domino_trace_tag("domino.internal.time_to_first_token_ms", json.dumps(round((first_token_at - started) * 1000, 1)))
+            chunks.append(delta)
+            yield delta
+
+    if not chunks:
+        yield "Sorry, I couldn't answer that question"
+        return
 
-    return response.choices[0].message.content or "Sorry, I couldn't answer that question"
+    # the usage chunk has the exact token count, the number of chunks is close to it
+    output_tokens = usage.completion_tokens if usage else len(chunks)
+    generation_s = time.monotonic() - first_token_at
+    set_domino_trace_tag("domino.internal.output_tokens", json.dumps(output_tokens))
+    if generation_s > 0:
+        set_domino_trace_tag("domino.internal.tokens_per_second", json.dumps(round(output_tokens / generation_s, 2)))
 
+    if response_cache:
+        response_cache.put(question_embedding, question_context, "".join(chunks))
 
-@add_tracing(name="domino_eval_trace", evaluator=evaluators.assistant_evaluator)
+@start_domino_trace(name="domino_eval_trace", evaluator=evaluators.assistant_evaluator)
 def ask_assistant(question: str) -> str:
     # is very unhelpful half of the time
-    content = llm_with_tools.invoke(question)
-    tool_call = content.tool_calls[0]
+    content = get_llm_with_tools().invoke(question)
 
     # NOTE: I messed up the tool call definition earilier
     # and used the tracing to figure out the bug
-    return tools_table.get(tool_call["name"], lambda x: "I couldn't help with that").invoke(tool_call["args"])
+    # the model can ask for several tools, they run at the same time so the slowest tool sets the latency
+    results = run_tool_calls(content.tool_calls)
+    if len(results) == 1:
+        return results[0]
+    return "\n".join(str(r) for r in results)